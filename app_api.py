@@ -0,0 +1,91 @@
+"""
+Async HTTP API service
+
+Runs alongside the Streamlit UI, over the same providers and database.
+
+Usage:
+    python app_api.py --port 8000
+
+Listening on a non-local address requires an API key (API_KEY), sent by
+the clients in the "Authorization: Bearer <API_KEY>" header.
+"""
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from src.codegen_api import (
+    make_api_app,
+    DEFAULT_API_WORKERS,
+    DEFAULT_API_VIDEO_WORKERS,
+)
+from src.codegen_db import init_db_from_env
+from src.codegen_utilities import log_debug
+from src.codegen_warmup import start_warm_up, get_warm_up_steps
+from src.codegen_semantic_cache import get_semantic_cache
+
+from app_streamlit_contants import (
+    CONVERSATION_DB_PATH,
+    CONVERSATIONS_PAGE_SIZE,
+    REFINE_VIDEO_PROMPT_TEXT,
+    REFINE_LLM_PROMPT_TEXT,
+    TEXT_GENERATION_TIMEOUT,
+    VIDEO_GENERATION_TIMEOUT,
+)
+
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+async def serve(args):
+    db = init_db_from_env(CONVERSATION_DB_PATH)
+    app = make_api_app({
+        "db": db,
+        "workers": args.workers,
+        "video_workers": args.video_workers,
+        "api_key": os.environ.get("API_KEY"),
+        "llm_prompt_enhancement_text": REFINE_LLM_PROMPT_TEXT,
+        "video_prompt_enhancement_text": REFINE_VIDEO_PROMPT_TEXT,
+        "text_timeout": float(os.environ.get("TEXT_GENERATION_TIMEOUT",
+                                             TEXT_GENERATION_TIMEOUT)),
+        "video_timeout": float(os.environ.get("VIDEO_GENERATION_TIMEOUT",
+                                              VIDEO_GENERATION_TIMEOUT)),
+    })
+    context = app.settings["api_context"]
+    # Readiness is reported by /api/ready
+    context.warm_up = start_warm_up("api", get_warm_up_steps(
+        db, context.get_llm_model, context.get_ttv_model,
+        CONVERSATIONS_PAGE_SIZE, semantic_cache=get_semantic_cache()))
+    # LlmProvider.query_async() runs in the loop default executor
+    asyncio.get_running_loop().set_default_executor(context.executor)
+    app.listen(args.port, address=args.host)
+    log_debug(f"app_api | Listening on {args.host}:{args.port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default=os.environ.get("API_HOST",
+                                                         "127.0.0.1"),
+                        help="Listening address. A non-local one requires"
+                        " API_KEY")
+    parser.add_argument("--port", type=int,
+                        default=int(os.environ.get("API_PORT", 8000)))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("API_WORKERS",
+                                                   DEFAULT_API_WORKERS)),
+                        help="Threads for the blocking provider and"
+                        " database calls")
+    parser.add_argument("--video-workers", type=int,
+                        default=int(os.environ.get(
+                            "API_VIDEO_WORKERS", DEFAULT_API_VIDEO_WORKERS)),
+                        help="Threads for the video generation checks")
+    args = parser.parse_args()
+    if args.host not in LOCAL_HOSTS and not os.environ.get("API_KEY"):
+        parser.error(f"API_KEY is required to listen on {args.host}")
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
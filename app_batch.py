@@ -0,0 +1,107 @@
+"""
+Headless batch text and video generation
+
+Reads prompts from a file or stdin (one per line: a JSON object with
+"question" and optionally "type", "enhance", "id" and "timeout", or a
+plain question) and streams the results as NDJSON.
+
+Usage:
+    python app_batch.py --input prompts.ndjson --output results.ndjson \\
+        --concurrency 8 --save --checkpoint batch.checkpoint
+    cat questions.txt | python app_batch.py --type text > results.ndjson
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+from src import codegen_utilities
+from src.codegen_batch import (
+    BatchProcessor,
+    DEFAULT_BATCH_CONCURRENCY,
+    DEFAULT_DB_BATCH_SIZE,
+    DEFAULT_CHECKPOINT_EVERY,
+)
+from src.codegen_db import init_db_from_env
+
+from app_streamlit_contants import (
+    CONVERSATION_DB_PATH,
+    REFINE_VIDEO_PROMPT_TEXT,
+    REFINE_LLM_PROMPT_TEXT,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--input", default="-",
+                        help="Prompts file. Defaults to stdin")
+    parser.add_argument("--output", default="-",
+                        help="NDJSON results file. Defaults to stdout")
+    parser.add_argument("--type", dest="default_type", default="text",
+                        choices=["text", "video"],
+                        help="Type of the prompts without a \"type\"")
+    parser.add_argument("--concurrency", type=int,
+                        default=DEFAULT_BATCH_CONCURRENCY,
+                        help="Concurrent generation requests")
+    parser.add_argument("--enhance", action="store_true",
+                        help="Enhance the prompts without an \"enhance\"")
+    parser.add_argument("--wait-time", type=int, default=60,
+                        help="Seconds between video generation checks")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Seconds for each prompt generation")
+    parser.add_argument("--save", action="store_true",
+                        help="Save the results in the configured database")
+    parser.add_argument("--db-batch-size", type=int,
+                        default=DEFAULT_DB_BATCH_SIZE,
+                        help="Results saved per database write")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file to resume an interrupted run")
+    parser.add_argument("--checkpoint-every", type=int,
+                        default=DEFAULT_CHECKPOINT_EVERY,
+                        help="Processed prompts between checkpoints")
+    parser.add_argument("--debug", action="store_true",
+                        help="Show the debug messages (in stderr)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.debug:
+        # Keep stdout for the NDJSON results
+        sys.stdout, stdout = sys.stderr, sys.stdout
+    else:
+        codegen_utilities.DEBUG = False
+        stdout = sys.stdout
+
+    processor = BatchProcessor({
+        "concurrency": args.concurrency,
+        "default_type": args.default_type,
+        "enhance": args.enhance,
+        "wait_time": args.wait_time,
+        "timeout": args.timeout,
+        "db": init_db_from_env(CONVERSATION_DB_PATH) if args.save else None,
+        "db_batch_size": args.db_batch_size,
+        "checkpoint_path": args.checkpoint,
+        "checkpoint_every": args.checkpoint_every,
+        "llm_prompt_enhancement_text": REFINE_LLM_PROMPT_TEXT,
+        "video_prompt_enhancement_text": REFINE_VIDEO_PROMPT_TEXT,
+    })
+
+    # Resuming appends to the previous output
+    output_mode = "a" if args.checkpoint and \
+        processor.read_checkpoint() else "w"
+    input_stream = sys.stdin if args.input == "-" else open(args.input)
+    output_stream = stdout if args.output == "-" \
+        else open(args.output, output_mode)
+    try:
+        stats = processor.run(input_stream, output_stream)
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not stdout:
+            output_stream.close()
+    print(f"Processed: {stats['processed']} | Errors: {stats['errors']}",
+          file=sys.stderr)
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Conversations database export, import and migration
+
+Streams the conversations of the configured database (DB_TYPE), with the
+archived ones, to an NDJSON file (gzip compressed if its name ends with
+".gz"), and imports them back, with checkpoint resume. Migrates them to
+another database, configured with the same environment variables (see
+codegen_db_migrate).
+
+Usage:
+    python app_db.py export --output conversations.ndjson.gz \\
+        --type video --since 2024-01-01 --checkpoint export.checkpoint
+    python app_db.py import --input conversations.ndjson.gz \\
+        --batch-size 500 --checkpoint import.checkpoint
+    python app_db.py migrate --to mongodb --workers 4 \\
+        --checkpoint migrate.checkpoint --verify
+    python app_db.py verify --to mongodb
+"""
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from src import codegen_utilities
+from src.codegen_db import (
+    CodegenDatabase,
+    get_db_config_from_env,
+    init_db_from_env,
+)
+from src.codegen_db_export import (
+    DEFAULT_CHECKPOINT_EVERY,
+    DEFAULT_IMPORT_BATCH_SIZE,
+    export_to_file,
+    import_from_file,
+)
+from src.codegen_db_migrate import (
+    DEFAULT_MAX_PASSES,
+    DEFAULT_MIGRATION_BATCH_SIZE,
+    DEFAULT_MIGRATION_WORKERS,
+    DatabaseMigration,
+)
+
+from app_streamlit_contants import CONVERSATION_DB_PATH
+
+
+def get_timestamp(value: str) -> float:
+    """
+    Returns the timestamp of a Unix timestamp or an ISO date / date time
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def get_target_db(db_type: str, options: list) -> CodegenDatabase:
+    """
+    Returns the migration target database, configured by the environment
+    variables and the KEY=VALUE options, without item cache
+    """
+    other_data = get_db_config_from_env(db_type, CONVERSATION_DB_PATH)
+    for option in options or []:
+        key, _, value = option.partition("=")
+        other_data[key] = value
+    return CodegenDatabase(db_type, other_data, item_cache_size=0)
+
+
+def add_target_arguments(parser) -> None:
+    parser.add_argument("--to", required=True, dest="target_type",
+                        help="Target database type (e.g. mongodb)")
+    parser.add_argument("--to-option", action="append", dest="to_options",
+                        metavar="KEY=VALUE",
+                        help="Target configuration, instead of the "
+                             "environment variable (e.g. "
+                             "MONGODB_COLLECTION_NAME=conversations)")
+    parser.add_argument("--no-archive", action="store_true",
+                        help="Skip the archived conversations")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--debug", action="store_true",
+                        help="Show the debug messages (in stderr)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Export the conversations as NDJSON")
+    export_parser.add_argument("--output", default="-",
+                               help="NDJSON file. Defaults to stdout")
+    export_parser.add_argument("--gzip", action="store_true", default=None,
+                               help="Compress the output (default: if "
+                                    "its name ends with .gz)")
+    export_parser.add_argument("--type", choices=["text", "video"],
+                               help="Export only this conversations type")
+    export_parser.add_argument("--since", type=get_timestamp,
+                               help="Oldest timestamp or ISO date")
+    export_parser.add_argument("--until", type=get_timestamp,
+                               help="Timestamp or ISO date to stop before")
+    export_parser.add_argument("--no-archive", action="store_true",
+                               help="Skip the archived conversations")
+    export_parser.add_argument("--checkpoint", default=None,
+                               help="Checkpoint file to resume an "
+                                    "interrupted export")
+    export_parser.add_argument("--checkpoint-every", type=int,
+                               default=DEFAULT_CHECKPOINT_EVERY,
+                               help="Conversations per written chunk")
+
+    import_parser = subparsers.add_parser(
+        "import", help="Import the conversations of an NDJSON export")
+    import_parser.add_argument("--input", default="-",
+                               help="NDJSON file. Defaults to stdin")
+    import_parser.add_argument("--batch-size", type=int,
+                               default=DEFAULT_IMPORT_BATCH_SIZE,
+                               help="Conversations saved per database "
+                                    "write")
+    import_parser.add_argument("--checkpoint", default=None,
+                               help="Checkpoint file to resume an "
+                                    "interrupted import")
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Copy the conversations to another database")
+    add_target_arguments(migrate_parser)
+    migrate_parser.add_argument("--batch-size", type=int,
+                                default=DEFAULT_MIGRATION_BATCH_SIZE,
+                                help="Conversations saved per database "
+                                     "write")
+    migrate_parser.add_argument("--workers", type=int,
+                                default=DEFAULT_MIGRATION_WORKERS,
+                                help="Parallel database writes")
+    migrate_parser.add_argument("--max-passes", type=int,
+                                default=DEFAULT_MAX_PASSES,
+                                help="Catch-up passes, until one finds "
+                                     "no new conversations")
+    migrate_parser.add_argument("--checkpoint", default=None,
+                                help="Checkpoint file to resume the "
+                                     "migration and run catch-up passes")
+    migrate_parser.add_argument("--verify", action="store_true",
+                                help="Compare both databases at the end")
+
+    verify_parser = subparsers.add_parser(
+        "verify", help="Compare the conversations with another database")
+    add_target_arguments(verify_parser)
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.debug:
+        # Keep stdout for the NDJSON export
+        sys.stdout, stdout = sys.stderr, sys.stdout
+    else:
+        codegen_utilities.DEBUG = False
+        stdout = sys.stdout
+    db = init_db_from_env(CONVERSATION_DB_PATH)
+
+    if args.command == "export":
+        exported = export_to_file(
+            db, args.output,
+            filters={"type": args.type} if args.type else None,
+            since=args.since,
+            until=args.until,
+            include_archive=not args.no_archive,
+            compress=args.gzip,
+            checkpoint_path=args.checkpoint,
+            checkpoint_every=args.checkpoint_every,
+            stdout=stdout.buffer)
+        print(f"Exported: {exported}", file=sys.stderr)
+    elif args.command == "import":
+        processed_lines = import_from_file(
+            db, args.input, args.batch_size, args.checkpoint)
+        print(f"Processed lines: {processed_lines}", file=sys.stderr)
+    else:
+        migration = DatabaseMigration(
+            db, get_target_db(args.target_type, args.to_options), {
+                "include_archive": not args.no_archive,
+                "batch_size": getattr(args, "batch_size",
+                                      DEFAULT_MIGRATION_BATCH_SIZE),
+                "workers": getattr(args, "workers",
+                                   DEFAULT_MIGRATION_WORKERS),
+                "checkpoint_path": getattr(args, "checkpoint", None),
+            })
+        if args.command == "migrate":
+            for stats in migration.run(args.max_passes):
+                print(json.dumps(stats), file=sys.stderr)
+        if args.command == "verify" or args.verify:
+            result = migration.verify()
+            print(json.dumps(result), file=stdout)
+            return 0 if result["ok"] else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
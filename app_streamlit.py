@@ -2,6 +2,7 @@
 import os
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 import uuid
@@ -9,16 +10,41 @@ import streamlit as st
 
 from src.codegen_utilities import (
     log_debug,
-    get_date_time,
     get_default_resultset,
 )
-from src.codegen_db import CodegenDatabase
+from src.codegen_db import init_db_from_env
+from src.codegen_db_records import ConversationRecord, ConversationSummary
 from src.codegen_ai_utilities import TextToVideoProvider, LlmProvider
+from src.codegen_video_utilities import (
+    is_poster_extraction_available,
+    get_video_poster,
+)
+from src.codegen_video_cache import get_video_cache, get_video_poster_dir
+from src.codegen_deadlines import get_deadline
+from src.codegen_semantic_cache import (
+    get_semantic_cache,
+    get_semantic_cache_mode,
+)
+from src.codegen_warmup import (
+    PrefetchPool,
+    DEFAULT_SUGGESTIONS_POOL_SIZE,
+    is_warm_up_enabled,
+    start_warm_up,
+    get_warm_up,
+    get_warm_up_steps,
+)
 
 from app_streamlit_contants import (
     CONVERSATION_DB_PATH,
     CONVERSATION_TITLE_LENGTH,
+    CONVERSATIONS_PAGE_SIZE,
     VIDEO_GALLERY_COLUMNS,
+    VIDEO_GALLERY_PAGE_SIZE,
+    VIDEO_POSTER_WORKERS,
+    VIDEO_POSTER_RETRY_DELAY,
+    VIDEO_POSTER_MAX_RETRY_DELAY,
+    TEXT_GENERATION_TIMEOUT,
+    VIDEO_GENERATION_TIMEOUT,
     DEFAULT_SUGGESTIONS,
     SUGGESTIONS_PROMPT_TEXT,
     SUGGESTIONS_QTY,
@@ -66,28 +92,139 @@ def init_db():
     """
     Initialize the JSON file database
     """
-    db_type = os.getenv('DB_TYPE')
-    db = None
-    if db_type == 'json':
-        db = CodegenDatabase("json", {
-            "JSON_DB_PATH": os.getenv('JSON_DB_PATH', CONVERSATION_DB_PATH),
-        })
-    if db_type == 'mongodb':
-        db = CodegenDatabase("mongodb", {
-            "MONGODB_URI": os.getenv('MONGODB_URI'),
-            "MONGODB_DB_NAME": os.getenv('MONGODB_DB_NAME'),
-            "MONGODB_COLLECTION_NAME": os.getenv('MONGODB_COLLECTION_NAME'),
-        })
-    if not db:
-        raise ValueError(f"Invalid DB_TYPE: {db_type}")
-    return db
+    return init_db_from_env(CONVERSATION_DB_PATH)
 
 
 def update_conversations():
     """
-    Update the side bar conversations from the database
+    Update the side bar conversations page from the database
+    """
+    # Taken before reading the page, so a write in between is seen as a
+    # change in the next refresh_conversations()
+    st.session_state.conversations_token = init_db().get_change_token()
+    page = st.session_state.get("conversations_page", 0)
+    # Get one extra conversation to know if there's a next page
+    conversations = get_conversations(
+        limit=CONVERSATIONS_PAGE_SIZE + 1,
+        skip=page * CONVERSATIONS_PAGE_SIZE, summary=True)
+    if not conversations and page > 0:
+        # The page became empty (e.g. its last conversation was deleted)
+        st.session_state.conversations_page = page - 1
+        return update_conversations()
+    st.session_state.conversations_has_more = \
+        len(conversations) > CONVERSATIONS_PAGE_SIZE
+    st.session_state.conversations = conversations[:CONVERSATIONS_PAGE_SIZE]
+
+
+def refresh_conversations():
+    """
+    Reload the side bar conversations page only if the database changed
+    since it was loaded (e.g. by other sessions or processes), according
+    to its change token. Without a change token, it's loaded once.
+    """
+    if "conversations" not in st.session_state:
+        return update_conversations()
+    token = init_db().get_change_token()
+    if token is not None and \
+       token != st.session_state.get("conversations_token"):
+        update_conversations()
+
+
+def is_conversations_page_stale(token) -> bool:
+    """
+    Returns True if the database changed (e.g. by other sessions) since
+    the side bar page was loaded. "token" is the change token taken
+    before this session's write.
+    """
+    return "conversations" not in st.session_state or \
+        token != st.session_state.get("conversations_token")
+
+
+def upsert_session_conversation(db, conversation: ConversationSummary,
+                                token=None):
+    """
+    Apply a saved conversation to the side bar page, instead of reloading
+    the page from the database. "token" is the database change token
+    taken before the save: if other writes happened since the page was
+    loaded, the page is reloaded, so they aren't taken as seen.
+    """
+    page = st.session_state.get("conversations_page", 0)
+    if page > 0 or is_conversations_page_stale(token):
+        # The new conversation shifts the items of the next pages
+        return update_conversations()
+    conversations = [item for item in st.session_state.conversations
+                     if item.id != conversation.id]
+    # Newest first
+    index = next((i for i, item in enumerate(conversations)
+                  if item.timestamp < conversation.timestamp),
+                 len(conversations))
+    if index == len(conversations) and \
+       st.session_state.get("conversations_has_more"):
+        # It could be after the next page first conversation
+        return update_conversations()
+    conversations.insert(index, conversation)
+    if len(conversations) > CONVERSATIONS_PAGE_SIZE:
+        conversations.pop()
+        st.session_state.conversations_has_more = True
+    st.session_state.conversations = conversations
+    st.session_state.conversations_token = db.get_change_token()
+
+
+def remove_session_conversation(db, id: str, token=None):
+    """
+    Apply a deleted conversation to the side bar page, getting only the
+    next page first conversation from the database to fill the gap.
+    "token" is the database change token taken before the delete, see
+    upsert_session_conversation().
+    """
+    if is_conversations_page_stale(token):
+        return update_conversations()
+    page = st.session_state.get("conversations_page", 0)
+    conversations = [item for item in st.session_state.conversations
+                     if item.id != id]
+    if len(conversations) == len(st.session_state.conversations):
+        # Not in this page
+        return update_conversations()
+    if st.session_state.get("conversations_has_more"):
+        # One extra conversation to know if there's still a next page
+        next_conversations = get_conversations(
+            limit=2, skip=(page + 1) * CONVERSATIONS_PAGE_SIZE - 1,
+            summary=True)
+        conversations.extend(next_conversations[:1])
+        st.session_state.conversations_has_more = \
+            len(next_conversations) > 1
+    if not conversations and page > 0:
+        # The page became empty
+        st.session_state.conversations_page = page - 1
+        return update_conversations()
+    st.session_state.conversations = conversations
+    st.session_state.conversations_token = db.get_change_token()
+
+
+def set_conversations_page(delta: int):
+    """
+    Move the side bar conversations to the previous or next page
+    """
+    page = st.session_state.get("conversations_page", 0) + delta
+    st.session_state.conversations_page = max(page, 0)
+    update_conversations()
+
+
+def select_conversation(id: str):
+    """
+    Side bar conversation button callback
+    """
+    st.session_state.selected_conversation_id = id
+
+
+def get_selected_conversation_id():
     """
-    st.session_state.conversations = get_conversations()
+    Returns the conversation selected in the side bar, if any, and resets
+    the selection, so it's processed only in the rerun after the click
+    """
+    id = st.session_state.get("selected_conversation_id")
+    st.session_state.selected_conversation_id = None
+    return id
 
 
 def get_new_item_id():
@@ -99,9 +236,12 @@ def get_new_item_id():
 
 def save_conversation(type: str, question: str, answer: str,
                       refined_prompt: str = None,
-                      ttv_response: dict = None, id: str = None):
+                      ttv_response: dict = None, id: str = None,
+                      llm_provider: str = None,
+                      semantic_cache_id: str = None):
     """
-    Save the conversation in the database
+    Save the conversation in the database. "semantic_cache_id" is the
+    conversation whose answer was reused, if any.
     """
     if not id:
         id = get_new_item_id()
@@ -112,38 +252,51 @@ def save_conversation(type: str, question: str, answer: str,
         "answer": answer,
         "ttv_response": ttv_response,
         "refined_prompt": refined_prompt,
+        "llm_provider": llm_provider,
         "timestamp": time.time(),
     }
+    if semantic_cache_id:
+        item["semantic_cache_id"] = semantic_cache_id
+    token = db.get_change_token()
     db.save_item(item, id)
-    update_conversations()
+    semantic_cache = get_semantic_cache()
+    if semantic_cache and type == "text" and answer:
+        semantic_cache.add(id, question)
+    upsert_session_conversation(db, ConversationSummary.from_dict(item, id),
+                                token)
+    st.session_state.semantic_offer = None
     recycle_suggestions()
     set_new_id(id)
     return id
 
 
-def get_conversations():
+def update_conversation(id: str, data: dict):
+    """
+    Update some attributes of a conversation, keeping the other ones
+    (and its timestamp) unchanged. The update is atomic, so it's safe
+    from the background threads (e.g. the video cache downloads).
+    """
+    if not init_db().update_item(id, data):
+        return None
+    return id
+
+
+def get_conversations(limit: int = None, skip: int = 0,
+                      filters: dict = None, summary: bool = False):
     """
-    Returns the conversations in the database
+    Returns the conversations in the database, newest first.
+    "limit" and "skip" allow to get just one page, and "summary" to get
+    ConversationSummary objects instead of ConversationRecord ones.
     """
     db = init_db()
-    conversations = db.get_list("timestamp", "desc")
-    # Add the date_time field to each conversation
-    for conversation in conversations:
-        conversation['date_time'] = get_date_time(conversation['timestamp'])
-    return conversations
+    return db.get_list("timestamp", "desc", limit, skip, filters, summary)
 
 
-def get_conversation(id: str):
+def get_conversation(id: str) -> ConversationRecord:
     """
     Returns the conversation in the database
     """
-    db = init_db()
-    conversation = db.get_item(id)
-    if conversation:
-        # Add the date_time field to the conversation
-        conversation['date_time'] = get_date_time(conversation['timestamp'])
-        return conversation
-    return None
+    return init_db().get_item(id)
 
 
 def delete_conversation(id: str):
@@ -151,8 +304,32 @@ def delete_conversation(id: str):
     Delete a conversation from the database
     """
     db = init_db()
+    token = db.get_change_token()
     db.delete_item(id)
-    update_conversations()
+    semantic_cache = get_semantic_cache()
+    if semantic_cache:
+        semantic_cache.remove(id)
+    remove_session_conversation(db, id, token)
+
+
+def get_video_source(conversation: ConversationRecord) -> str:
+    """
+    Returns the local cached copy of a conversation video, if available.
+    Otherwise returns the remote URL and schedules the download, so the
+    next views are served from the local disk.
+    """
+    video_cache = get_video_cache()
+    if not video_cache:
+        return conversation.answer
+    cached_path = video_cache.get_cached_path(conversation.video_cache_key)
+    if cached_path:
+        return cached_path
+    id = conversation.id
+    video_cache.fetch_in_background(
+        conversation.answer,
+        lambda cache_key: update_conversation(
+            id, {"video_cache_key": cache_key}))
+    return conversation.answer
 
 
 def get_suggestions_from_ai(prompt: str, qty: int = 4) -> dict:
@@ -199,17 +376,59 @@ def show_buttons():
     st.session_state.show_button = True
 
 
+@st.cache_resource(show_spinner=False)
+def get_suggestions_pool() -> PrefetchPool:
+    """
+    Returns the prefetched AI suggestions, shared by the sessions of the
+    process. The pool size comes from the SUGGESTIONS_POOL_SIZE env. var.
+    (0: no prefetching).
+    """
+    return PrefetchPool(
+        lambda: get_suggestions_from_ai(SUGGESTIONS_PROMPT_TEXT,
+                                        SUGGESTIONS_QTY),
+        int(os.environ.get("SUGGESTIONS_POOL_SIZE",
+                           DEFAULT_SUGGESTIONS_POOL_SIZE)))
+
+
 def recycle_suggestions():
     """
     Recycle the suggestions from the AI
     """
-    st.session_state.suggestion = get_suggestions_from_ai(
-        SUGGESTIONS_PROMPT_TEXT, SUGGESTIONS_QTY)
+    st.session_state.suggestion = get_suggestions_pool().get()
+
+
+def warm_up():
+    """
+    Start the process warm-up, if enabled by WARMUP_ENABLED. Streamlit
+    runs the script when a session connects, so it starts with the first
+    session and the next ones find the connections open.
+    """
+    if not is_warm_up_enabled() or get_warm_up("streamlit"):
+        return
+    start_warm_up("streamlit", get_warm_up_steps(
+        init_db(),
+        lambda: LlmProvider({"provider": os.environ.get("LLM_PROVIDER")}),
+        lambda: TextToVideoProvider({
+            "provider": os.environ.get("TEXT_TO_VIDEO_PROVIDER"),
+        }),
+        CONVERSATIONS_PAGE_SIZE,
+        get_suggestions_pool(),
+        get_semantic_cache()))
+
+
+def get_generation_deadline(env_var_name: str, default_timeout: int) -> float:
+    """
+    Returns the deadline of a text or video generation action. A timeout
+    of 0 means no deadline.
+    """
+    return get_deadline(float(os.environ.get(env_var_name, default_timeout)))
 
 
 def video_generation(result_container: st.container, question: str = None,
                      previous_response: dict = None):
     # hide_buttons()
+    deadline = get_generation_deadline("VIDEO_GENERATION_TIMEOUT",
+                                       VIDEO_GENERATION_TIMEOUT)
     ttv_model = TextToVideoProvider({
         "provider": os.environ.get("TEXT_TO_VIDEO_PROVIDER"),
     })
@@ -227,7 +446,8 @@ def video_generation(result_container: st.container, question: str = None,
             response = ttv_model.request(
                 question,
                 (REFINE_VIDEO_PROMPT_TEXT if
-                 st.session_state.prompt_enhancement_flag else None)
+                 st.session_state.prompt_enhancement_flag else None),
+                deadline,
             )
             if response['error']:
                 result_container.write(
@@ -251,7 +471,8 @@ def video_generation(result_container: st.container, question: str = None,
             id=video_id,
         )
 
-        response = ttv_model.generation_check(ttv_response)
+        response = ttv_model.generation_check(ttv_response,
+                                              deadline=deadline)
         if response['error']:
             result_container.write(
                 f"ERROR E-300: {response['error_message']}")
@@ -278,13 +499,84 @@ def video_generation(result_container: st.container, question: str = None,
         st.rerun()
 
 
-def text_generation(result_container: st.container, question: str = None):
+def find_similar_conversation(question: str):
+    """
+    Returns the (ConversationRecord, similarity) of the answered text
+    conversation whose question is most similar to the given one, if the
+    semantic cache is enabled and it's above its threshold, or None
+    """
+    semantic_cache = get_semantic_cache()
+    if not semantic_cache:
+        return None
+    with st.spinner("Looking for similar questions..."):
+        return semantic_cache.find_conversation(init_db(), question)
+
+
+def save_similar_answer(question: str, id: str):
+    """
+    Save a text conversation with the answer of a similar one, instead
+    of generating a new answer
+    """
+    conversation = get_conversation(id)
+    if not conversation:
+        return None
+    return save_conversation(
+        type="text",
+        question=question,
+        refined_prompt=conversation.refined_prompt,
+        answer=conversation.answer,
+        llm_provider=conversation.llm_provider,
+        semantic_cache_id=id,
+    )
+
+
+def show_semantic_offer(container: st.container):
+    """
+    Show the answer of the similar question found by the semantic cache
+    ("offer" mode), with the buttons to use it or generate a new one
+    """
+    offer = st.session_state.get("semantic_offer")
+    if not offer:
+        return
+    conversation = get_conversation(offer["id"])
+    if not conversation:
+        st.session_state.semantic_offer = None
+        return
+    with container.container():
+        st.info("A similar question was already answered "
+                f"({offer['similarity']:.0%} similar): "
+                f"{conversation.question}")
+        st.write(conversation.answer)
+        col1, col2 = st.columns(2)
+        col1.button("Use this answer", key="semantic_offer_accept")
+        col2.button("Generate a new answer", key="semantic_offer_decline")
+
+
+def text_generation(result_container: st.container, question: str = None,
+                    use_semantic_cache: bool = True):
     # hide_buttons()
     if not question:
         question = st.session_state.question
     if not validate_question(question):
         return
 
+    st.session_state.semantic_offer = None
+    if use_semantic_cache:
+        similar = find_similar_conversation(question)
+        if similar:
+            conversation, similarity = similar
+            if get_semantic_cache_mode() == "return":
+                save_similar_answer(question, conversation.id)
+            else:
+                st.session_state.semantic_offer = {
+                    "question": question,
+                    "id": conversation.id,
+                    "similarity": similarity,
+                }
+            st.rerun()
+
+    deadline = get_generation_deadline("TEXT_GENERATION_TIMEOUT",
+                                       TEXT_GENERATION_TIMEOUT)
     with st.spinner("Procesing text generation..."):
         # Generating answer
         llm_model = LlmProvider({
@@ -294,7 +586,8 @@ def text_generation(result_container: st.container, question: str = None):
         response = llm_model.query(
             prompt, question,
             (REFINE_LLM_PROMPT_TEXT if
-             st.session_state.prompt_enhancement_flag else None)
+             st.session_state.prompt_enhancement_flag else None),
+            deadline,
         )
         if response['error']:
             result_container.write(f"ERROR E-100: {response['error_message']}")
@@ -304,25 +597,113 @@ def text_generation(result_container: st.container, question: str = None):
             question=question,
             refined_prompt=response['refined_prompt'],
             answer=response['response'],
+            llm_provider=response.get('provider'),
         )
         # result_container.write(response['response'])
         # show_buttons()
         st.rerun()
 
 
-def get_video_urls():
+def get_gallery_videos():
     """
-    Returns a list of video URLs
+    Returns the videos of the current gallery page
     """
     response = get_default_resultset()
-    response['urls'] = []
-    for conversation in st.session_state.conversations:
-        if conversation['type'] == "video":
-            if conversation.get('answer'):
-                response['urls'].append(conversation['answer'])
+    page = st.session_state.get("gallery_page", 0)
+    # Get one extra video to know if there's a next page
+    videos = get_conversations(
+        limit=VIDEO_GALLERY_PAGE_SIZE + 1,
+        skip=page * VIDEO_GALLERY_PAGE_SIZE,
+        filters={"type": "video"})
+    response['has_more'] = len(videos) > VIDEO_GALLERY_PAGE_SIZE
+    # Videos still being generated don't have an URL yet
+    response['videos'] = [video for video
+                          in videos[:VIDEO_GALLERY_PAGE_SIZE]
+                          if video.answer]
     return response
 
 
+def get_video_poster_retry_time(video: ConversationRecord) -> float:
+    """
+    Returns the time when a failed poster extraction can be tried again,
+    after a delay doubled on each consecutive failure
+    """
+    failures = video.get("poster_failures", 1)
+    delay = min(VIDEO_POSTER_RETRY_DELAY * 2 ** (failures - 1),
+                VIDEO_POSTER_MAX_RETRY_DELAY)
+    return video.get("poster_failed_at", 0) + delay
+
+
+def needs_video_poster(video: ConversationRecord) -> bool:
+    """
+    Returns True if the poster of a video must be extracted: it wasn't
+    tried yet, the last extraction failed long enough ago (e.g. a
+    timeout, or the video wasn't ready yet), its file was removed, or
+    it's an inline data URI saved by a previous version (moved to a
+    file)
+    """
+    if video.poster is None:
+        return True
+    if not video.poster:
+        return time.time() >= get_video_poster_retry_time(video)
+    return video.poster.startswith("data:") or \
+        not os.path.exists(video.poster)
+
+
+def add_video_posters(videos: list):
+    """
+    Extract the poster frame of the videos that don't have one yet to a
+    file in the video cache directory, and save its path in the
+    conversation record, so it's done once per video
+    """
+    if not is_poster_extraction_available():
+        return
+    pending = [video for video in videos if needs_video_poster(video)]
+    if not pending:
+        return
+    poster_dir = get_video_poster_dir()
+    with st.spinner("Preparing the video thumbnails..."):
+        with ThreadPoolExecutor(max_workers=VIDEO_POSTER_WORKERS) as executor:
+            results = list(executor.map(
+                lambda video: get_video_poster(video.answer, poster_dir),
+                pending))
+    for video, result in zip(pending, results):
+        if not result['error']:
+            video.poster = result['poster']
+            update_conversation(video.id, {"poster": video.poster})
+            continue
+        # An empty poster means the extraction failed: it's tried again
+        # after a backoff, not on each rerun
+        failures = video.get("poster_failures", 0) + 1 \
+            if video.poster == "" else 1
+        data = {"poster": "", "poster_failures": failures,
+                "poster_failed_at": time.time()}
+        for key, value in data.items():
+            video[key] = value
+        update_conversation(video.id, data)
+
+
+def set_gallery_page(delta: int):
+    """
+    Move the video gallery to the previous or next page
+    """
+    page = st.session_state.get("gallery_page", 0) + delta
+    st.session_state.gallery_page = max(page, 0)
+
+
+def toggle_gallery_video(id: str):
+    """
+    Open or close a video player in the gallery
+    """
+    open_videos = st.session_state.get("gallery_open_videos", [])
+    if id in open_videos:
+        open_videos = [video_id for video_id in open_videos
+                       if video_id != id]
+    else:
+        open_videos = open_videos + [id]
+    st.session_state.gallery_open_videos = open_videos
+
+
 def show_conversations():
     """
     Show the conversations in the side bar
@@ -332,16 +713,37 @@ def show_conversations():
         col1, col2 = st.columns(2, gap="small")
         with col1:
             st.button(
-                conversation['question'][:CONVERSATION_TITLE_LENGTH],
-                key=f"{conversation['id']}",
-                help=f"{conversation['type'].capitalize()} generated on " +
-                     f"{conversation['date_time']}")
+                conversation.question[:CONVERSATION_TITLE_LENGTH],
+                key=f"{conversation.id}",
+                help=f"{conversation.type.capitalize()} generated on " +
+                     f"{conversation.date_time}",
+                on_click=select_conversation,
+                args=(conversation.id,))
         with col2:
             st.button(
                 "x",
-                key=f"del_{conversation['id']}",
+                key=f"del_{conversation.id}",
                 on_click=delete_conversation,
-                args=(conversation['id'],))
+                args=(conversation.id,))
+
+    # Pagination
+    page = st.session_state.get("conversations_page", 0)
+    if page > 0 or st.session_state.get("conversations_has_more"):
+        prev_col, next_col = st.columns(2, gap="small")
+        with prev_col:
+            st.button(
+                "< Newer",
+                key="conversations_prev_page",
+                disabled=page == 0,
+                on_click=set_conversations_page,
+                args=(-1,))
+        with next_col:
+            st.button(
+                "Older >",
+                key="conversations_next_page",
+                disabled=not st.session_state.get("conversations_has_more"),
+                on_click=set_conversations_page,
+                args=(1,))
 
 
 def show_conversation_content(
@@ -357,32 +759,32 @@ def show_conversation_content(
     if not conversation:
         container.write("ERROR E-600: Conversation not found")
         return
-    if conversation.get('refined_prompt'):
+    if conversation.refined_prompt:
         log_debug(
             "SHOW_CONVERSATION_CONTENT | " +
-            f"\n | conversation['question']: {conversation['question']}"
-            "\n | conversation['refined_prompt']: "
-            f"{conversation['refined_prompt']}"
+            f"\n | conversation.question: {conversation.question}"
+            "\n | conversation.refined_prompt: "
+            f"{conversation.refined_prompt}"
         )
         with additional_container.expander(
-             f"Enhanced Prompt for {conversation['type'].capitalize()}"):
-            st.write(conversation['refined_prompt'])
-    if conversation['type'] == "video":
-        if conversation.get('answer'):
-            container.video(conversation['answer'])
+             f"Enhanced Prompt for {conversation.type.capitalize()}"):
+            st.write(conversation.refined_prompt)
+    if conversation.type == "video":
+        if conversation.answer:
+            container.video(get_video_source(conversation))
         else:
             video_generation(
-                container, conversation['question'],
-                conversation['ttv_response'])
+                container, conversation.question,
+                conversation.ttv_response)
     else:
-        container.write(conversation['answer'])
+        container.write(conversation.answer)
 
 
 def show_conversation_question(id: str):
     if not id:
         return
     conversation = get_conversation(id)
-    st.session_state.question = conversation['question']
+    st.session_state.question = conversation.question
 
 
 def validate_question(question: str):
@@ -461,10 +863,10 @@ def page_1():
     # Show the siderbar selected conversarion's question and answer in the
     # main section
     # (must be done before the user input)
-    for conversation in st.session_state.conversations:
-        if st.session_state.get(conversation['id']):
-            show_conversation_question(conversation['id'])
-            break
+    selected_conversation_id = get_selected_conversation_id()
+    show_conversation_question(selected_conversation_id)
+    if selected_conversation_id:
+        st.session_state.semantic_offer = None
 
     # User input
     question = st.text_area(
@@ -496,6 +898,9 @@ def page_1():
                                   additional_result_container)
         st.session_state.new_id = None
 
+    # Show the similar question answer offered by the semantic cache
+    show_semantic_offer(result_container)
+
     # Sidebar
     with st.sidebar:
         st.sidebar.write(
@@ -519,13 +924,19 @@ def page_1():
     if st.session_state.get("generate_text"):
         text_generation(result_container, question)
 
+    # Process the semantic cache offer buttons pushed
+    offer = st.session_state.get("semantic_offer")
+    if offer and st.session_state.get("semantic_offer_accept"):
+        save_similar_answer(offer["question"], offer["id"])
+        st.rerun()
+    if offer and st.session_state.get("semantic_offer_decline"):
+        text_generation(result_container, offer["question"],
+                        use_semantic_cache=False)
+
     # Show the selected conversation's question and answer in the
     # main section
-    for conversation in st.session_state.conversations:
-        if st.session_state.get(conversation['id']):
-            show_conversation_content(conversation['id'], result_container,
-                                      additional_result_container)
-            break
+    show_conversation_content(selected_conversation_id, result_container,
+                              additional_result_container)
 
     # Footer
     add_footer()
@@ -549,20 +960,60 @@ def page_2():
             args=("page", "home"),
         )
 
-    # Define video URLs
-    video_urls = get_video_urls()
+    # Get the current page videos
+    page = st.session_state.get("gallery_page", 0)
+    gallery = get_gallery_videos()
 
-    log_debug("page_2 | video_urls: " + f"{video_urls}")
+    log_debug(f"page_2 | page: {page} | videos: {len(gallery['videos'])}")
 
-    if not video_urls['urls']:
+    if not gallery['videos'] and page == 0 and not gallery['has_more']:
         st.write("No videos found. Try again later.")
         return
 
-    # Display videos in a 3-column layout
+    add_video_posters(gallery['videos'])
+
+    # Display the videos in a 3-column layout. The players are created
+    # only for the videos opened by the user, the others show the poster.
+    open_videos = st.session_state.get("gallery_open_videos", [])
     cols = st.columns(VIDEO_GALLERY_COLUMNS)
-    for i, video_url in enumerate(video_urls['urls']):
+    for i, video in enumerate(gallery['videos']):
         with cols[i % VIDEO_GALLERY_COLUMNS]:
-            st.video(video_url)
+            if video.id in open_videos:
+                st.video(get_video_source(video), autoplay=True)
+                st.button(
+                    "Close",
+                    key=f"play_{video.id}",
+                    on_click=toggle_gallery_video,
+                    args=(video.id,))
+                continue
+            # The inline posters of the previous versions are still shown
+            if video.poster and (video.poster.startswith("data:") or
+                                 os.path.exists(video.poster)):
+                st.image(video.poster, use_column_width=True)
+            st.button(
+                ":arrow_forward: " +
+                video.question[:CONVERSATION_TITLE_LENGTH],
+                key=f"play_{video.id}",
+                help=f"Generated on {video.date_time}",
+                on_click=toggle_gallery_video,
+                args=(video.id,))
+
+    # Pagination
+    prev_col, next_col = st.columns(2, gap="small")
+    with prev_col:
+        st.button(
+            "< Newer",
+            key="gallery_prev_page",
+            disabled=page == 0,
+            on_click=set_gallery_page,
+            args=(-1,))
+    with next_col:
+        st.button(
+            "Older >",
+            key="gallery_next_page",
+            disabled=not gallery['has_more'],
+            on_click=set_gallery_page,
+            args=(1,))
 
     # Footer
     add_footer()
@@ -582,8 +1033,7 @@ def main():
         st.session_state.question = ""
     if "prompt_enhancement_flag" not in st.session_state:
         st.session_state.prompt_enhancement_flag = False
-    if "conversations" not in st.session_state:
-        update_conversations()
+    refresh_conversations()
 
     # Streamlit app code
     st.set_page_config(
@@ -593,6 +1043,9 @@ def main():
         initial_sidebar_state="auto",
     )
 
+    # After set_page_config, which must be the first Streamlit command
+    warm_up()
+
     # Query params to handle navigation
     page = st.query_params.get("page", "home")
     log_debug("main | page: " + f"{page}")
@@ -5,8 +5,20 @@
 
 CONVERSATION_DB_PATH = "./db/conversations.json"
 CONVERSATION_TITLE_LENGTH = 50
+CONVERSATIONS_PAGE_SIZE = 20
 
 VIDEO_GALLERY_COLUMNS = 3
+VIDEO_GALLERY_PAGE_SIZE = 9
+VIDEO_POSTER_WORKERS = 4
+# Seconds before extracting a poster again after a failure, doubled on
+# each failure up to the maximum
+VIDEO_POSTER_RETRY_DELAY = 60
+VIDEO_POSTER_MAX_RETRY_DELAY = 86400
+
+# Seconds for a text or video generation, overridden by the
+# TEXT_GENERATION_TIMEOUT and VIDEO_GENERATION_TIMEOUT env. vars.
+TEXT_GENERATION_TIMEOUT = 180
+VIDEO_GENERATION_TIMEOUT = 900
 
 DEFAULT_SUGGESTIONS = {
     "s1": "Step-by-step tutorial to make tea, presented in an animated"
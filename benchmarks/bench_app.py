@@ -0,0 +1,221 @@
+"""
+Streamlit app render-time benchmark
+
+Runs the app headless with Streamlit's AppTest and stubbed providers,
+seeds N conversations in a temporary JSON database and times a full
+main() rerun, a suggestion click, a sidebar conversation click and a
+gallery visit, so UI scalability regressions show up as numbers.
+
+Usage:
+    python -m benchmarks.bench_app --sizes 10,100,1000 --repeat 5
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from src import codegen_ai_utilities
+from src.codegen_utilities import get_default_resultset
+from benchmarks.bench_db import seed_json_db
+from benchmarks.bench_utilities import (
+    silence_debug_logs,
+    percentile,
+    print_report,
+    write_json_report,
+    parse_int_list,
+)
+from benchmarks.stub_servers import STUB_SUGGESTIONS
+
+APP_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "app_streamlit.py")
+
+REPORT_COLUMNS = ["size", "action", "count", "p50_ms", "p95_ms", "max_ms",
+                  "elements"]
+
+
+class StubLlmProvider:
+    """
+    LlmProvider stand-in that answers immediately
+    """
+    def __init__(self, params: dict):
+        self.params = params
+
+    def warm_up(self) -> dict:
+        return get_default_resultset()
+
+    def query(self, prompt: str, question: str,
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
+        response = get_default_resultset()
+        if "JSON output" in str(prompt):
+            response['response'] = json.dumps(STUB_SUGGESTIONS)
+        else:
+            response['response'] = f"Stub answer for: {question}"
+        response['refined_prompt'] = None
+        return response
+
+
+class StubTextToVideoProvider(StubLlmProvider):
+    """
+    TextToVideoProvider stand-in that generates videos immediately
+    """
+    def request(self, question: str,
+                prompt_enhancement_text: str = None,
+                deadline: float = None) -> dict:
+        response = get_default_resultset()
+        response['response'] = {"message": "success", "data": "stub"}
+        response['refined_prompt'] = None
+        return response
+
+    def generation_check(self, request_response: dict,
+                         wait_time: int = 60,
+                         deadline: float = None) -> dict:
+        response = get_default_resultset()
+        response['video_url'] = "https://example.com/videos/stub.mp4"
+        return response
+
+
+def stub_providers() -> None:
+    """
+    Replace the providers used by the app script, which imports them from
+    src.codegen_ai_utilities on each run
+    """
+    codegen_ai_utilities.LlmProvider = StubLlmProvider
+    codegen_ai_utilities.TextToVideoProvider = StubTextToVideoProvider
+
+
+def count_elements(at: AppTest) -> int:
+    """
+    Returns the number of elements in the rendered tree
+    """
+    def count(node) -> int:
+        children = getattr(node, "children", None) or {}
+        return 1 + sum(count(child) for child in children.values())
+    return count(at._tree)
+
+
+def get_first_conversation_id(db_path: str) -> str:
+    """
+    Returns the id of the newest conversation in the seeded database
+    """
+    with open(db_path) as f:
+        json_db = json.load(f)
+    return max(json_db.items(), key=lambda x: x[1]['timestamp'])[0]
+
+
+def time_action(at: AppTest, action) -> float:
+    start = time.perf_counter()
+    action(at)
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"App exception: {at.exception[0].message}")
+    return elapsed
+
+
+def bench_size(size: int, args, work_dir: str) -> list:
+    """
+    Seed "size" conversations and time the app actions
+    """
+    db_path = os.path.join(work_dir, f"conversations_{size}.json")
+    seed_json_db(db_path, size, args.answer_size, args.seed)
+    os.environ["DB_TYPE"] = "json"
+    os.environ["JSON_DB_PATH"] = db_path
+    conversation_id = get_first_conversation_id(db_path)
+
+    def new_app() -> AppTest:
+        return AppTest.from_file(APP_SCRIPT, default_timeout=args.timeout)
+
+    def first_run(at: AppTest):
+        at.run()
+
+    def rerun(at: AppTest):
+        at.run()
+
+    def suggestion_click(at: AppTest):
+        at.button(key="s1").click().run()
+
+    def sidebar_click(at: AppTest):
+        at.button(key=conversation_id).click().run()
+
+    def gallery_visit(at: AppTest):
+        at.query_params["page"] = "gallery"
+        at.run()
+        at.query_params["page"] = "home"
+
+    actions = [
+        ("first_run", first_run, True),
+        ("rerun", rerun, False),
+        ("suggestion_click", suggestion_click, False),
+        ("sidebar_click", sidebar_click, False),
+        ("gallery_visit", gallery_visit, False),
+    ]
+    results = []
+    for name, action, fresh_session in actions:
+        latencies = []
+        elements = 0
+        at = new_app()
+        if not fresh_session:
+            at.run()
+        for _ in range(args.repeat):
+            if fresh_session:
+                at = new_app()
+            latencies.append(time_action(at, action))
+            elements = count_elements(at)
+        results.append({
+            "size": size,
+            "action": name,
+            "count": len(latencies),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "max_ms": round(max(latencies) * 1000, 2),
+            "elements": elements,
+        })
+        print(f"{size} conversations | {name} | "
+              f"p50 {results[-1]['p50_ms']} ms")
+    os.remove(db_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Comma separated number of conversations")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Repetitions per action")
+    parser.add_argument("--answer-size", type=int, default=1000,
+                        help="Approximate text answer size in characters")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="AppTest timeout per run in seconds")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Random seed for the generated records")
+    parser.add_argument("--json", dest="json_output", default=None,
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    silence_debug_logs()
+    stub_providers()
+    work_dir = tempfile.mkdtemp(prefix="vitexbrain_bench_app_")
+    results = []
+    try:
+        for size in parse_int_list(args.sizes):
+            results.extend(bench_size(size, args, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("")
+    print_report(results, REPORT_COLUMNS)
+    if args.json_output:
+        write_json_report(results, args.json_output, {
+            "benchmark": "app",
+            "sizes": parse_int_list(args.sizes),
+            "repeat": args.repeat,
+        })
+
+
+if __name__ == "__main__":
+    main()
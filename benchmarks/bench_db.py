@@ -0,0 +1,390 @@
+"""
+Database backends benchmark
+
+Generates realistic conversation records (long answers, ttv_response
+blobs) and measures save_item, get_item, sorted get_list and delete_item
+latency and peak RSS for the JSON and MongoDB backends at several data
+sizes, with the CodegenDatabase item cache disabled. "get_item_twice"
+reads each item twice, like an app rerun does, with the item cache on.
+Each backend / size pair runs in its own process, so the peak RSS is not
+polluted by the previous runs.
+
+MongoDB uses the server given by --mongodb-uri (e.g. a local mongod) or,
+when it's not given, the in-process "mongomock" stand-in
+(pip install mongomock).
+
+Usage:
+    python -m benchmarks.bench_db --sizes 10000,100000,1000000 \\
+        --json bench_db.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import uuid
+
+from benchmarks.bench_utilities import (
+    silence_debug_logs,
+    percentile,
+    print_report,
+    write_json_report,
+    parse_int_list,
+)
+
+ALL_BACKENDS = ["json", "mongodb"]
+
+REPORT_COLUMNS = ["backend", "size", "operation", "count", "p50_ms",
+                  "p95_ms", "p99_ms", "mean_ms", "peak_rss_mb",
+                  "truncated"]
+
+WORDS = (
+    "video scene camera light tomato fruit mountain river city night "
+    "explain step tutorial animation character color motion sound sky "
+    "ocean forest robot future history science garden music dance"
+).split()
+
+
+def generate_conversation(rng: random.Random, answer_size: int,
+                          now: float) -> dict:
+    """
+    Returns a realistic conversation record, half text and half video
+    """
+    question = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 25)))
+    timestamp = now - rng.uniform(0, 365 * 24 * 3600)
+    if rng.random() < 0.5:
+        answer_words = max(1, answer_size // 6)
+        return {
+            "type": "text",
+            "question": question,
+            "answer": " ".join(rng.choice(WORDS)
+                               for _ in range(rng.randint(answer_words // 2,
+                                                          answer_words))),
+            "ttv_response": None,
+            "refined_prompt": question + " " + " ".join(
+                rng.choice(WORDS) for _ in range(40)),
+            "timestamp": timestamp,
+        }
+    request_id = uuid.UUID(int=rng.getrandbits(128)).hex
+    refined_prompt = " ".join(rng.choice(WORDS) for _ in range(120))
+    return {
+        "type": "video",
+        "question": question,
+        "answer": f"https://example.com/videos/{request_id}.mp4",
+        "ttv_response": {
+            "resultset": {},
+            "error_message": "",
+            "error": False,
+            "response": {
+                "code": 0,
+                "message": "success",
+                "data": request_id,
+            },
+            "refined_prompt": refined_prompt,
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        },
+        "refined_prompt": refined_prompt,
+        "timestamp": timestamp,
+    }
+
+
+def generate_ids(size: int, seed: int):
+    """
+    Yields "size" conversation ids, reproducible by "seed"
+    """
+    rng = random.Random(seed)
+    for _ in range(size):
+        yield str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+def generate_conversations(size: int, answer_size: int, seed: int):
+    """
+    Yields "size" (id, conversation) pairs, reproducible by "seed", with
+    their large fields compressed like CodegenDatabase saves them
+    (DB_COMPRESSION)
+    """
+    from src.codegen_db_compression import compress_item
+
+    rng = random.Random(seed + 1)
+    now = time.time()
+    for id in generate_ids(size, seed):
+        yield id, compress_item(generate_conversation(rng, answer_size, now))
+
+
+def seed_json_db(db_path: str, size: int, answer_size: int, seed: int):
+    """
+    Write the JSON database file in one pass, streaming the records, so
+    seeding doesn't cost one full file rewrite per record
+    """
+    with open(db_path, 'w') as f:
+        f.write("{")
+        for i, (id, item) in enumerate(
+                generate_conversations(size, answer_size, seed)):
+            if i:
+                f.write(", ")
+            f.write(json.dumps(id))
+            f.write(": ")
+            f.write(json.dumps(item))
+        f.write("}")
+
+
+def seed_mongodb(collection, size: int, answer_size: int, seed: int,
+                 batch_size: int = 5000):
+    """
+    Bulk insert the records in the MongoDB collection
+    """
+    collection.delete_many({})
+    batch = []
+    for id, item in generate_conversations(size, answer_size, seed):
+        item['_id'] = id
+        batch.append(item)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    collection.create_index("timestamp")
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the current process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    if os.uname().sysname == "Darwin":
+        return round(peak / (1024 * 1024), 2)
+    return round(peak / 1024, 2)
+
+
+def time_operation(func, args_list: list, max_seconds: float) -> tuple:
+    """
+    Run "func" for each args tuple until the list or the time budget is
+    exhausted. Returns the latencies and whether the run was truncated.
+    """
+    latencies = []
+    budget_start = time.perf_counter()
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+        if time.perf_counter() - budget_start > max_seconds:
+            break
+    return latencies, len(latencies) < len(args_list)
+
+
+def summarize_operation(backend: str, size: int, operation: str,
+                        latencies: list, truncated: bool) -> dict:
+    return {
+        "backend": backend,
+        "size": size,
+        "operation": operation,
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3)
+        if latencies else 0.0,
+        "truncated": truncated,
+    }
+
+
+def run_operations(db, cached_db, backend: str, size: int,
+                   existing_ids: list, args) -> list:
+    """
+    Measure the CodegenDatabase operations over an already seeded backend
+    """
+    rng = random.Random(args.seed + 2)
+    now = time.time()
+    new_items = [(generate_conversation(rng, args.answer_size, now),
+                  str(uuid.uuid4())) for _ in range(args.ops)]
+    results = []
+
+    latencies, truncated = time_operation(
+        db.save_item, new_items, args.max_op_seconds)
+    results.append(summarize_operation(backend, size, "save_item",
+                                       latencies, truncated))
+    saved_ids = [id for _, id in new_items[:len(latencies)]]
+
+    lookup_ids = [(rng.choice(existing_ids),) for _ in range(args.ops)]
+    latencies, truncated = time_operation(
+        db.get_item, lookup_ids, args.max_op_seconds)
+    results.append(summarize_operation(backend, size, "get_item",
+                                       latencies, truncated))
+
+    def get_item_twice(id: str):
+        cached_db.get_item(id)
+        cached_db.get_item(id)
+    latencies, truncated = time_operation(
+        get_item_twice, lookup_ids, args.max_op_seconds)
+    results.append(summarize_operation(backend, size, "get_item_twice",
+                                       latencies, truncated))
+
+    latencies, truncated = time_operation(
+        db.get_list, [("timestamp", "desc")] * args.list_ops,
+        args.max_op_seconds)
+    results.append(summarize_operation(backend, size, "get_list_sorted",
+                                       latencies, truncated))
+
+    latencies, truncated = time_operation(
+        db.delete_item, [(id,) for id in saved_ids], args.max_op_seconds)
+    results.append(summarize_operation(backend, size, "delete_item",
+                                       latencies, truncated))
+    return results
+
+
+def sample_ids(size: int, args, count: int = 1000) -> list:
+    """
+    Returns a sample of the seeded ids, regenerated from the seed
+    """
+    ids = []
+    step = max(1, size // count)
+    for i, id in enumerate(generate_ids(size, args.seed)):
+        if i % step == 0:
+            ids.append(id)
+    return ids
+
+
+def bench_json(size: int, args, work_dir: str) -> list:
+    from src.codegen_db import CodegenDatabase
+
+    db_path = os.path.join(work_dir, f"conversations_{size}.json")
+    seed_process = multiprocessing.Process(
+        target=seed_json_db,
+        args=(db_path, size, args.answer_size, args.seed))
+    seed_process.start()
+    seed_process.join()
+    file_size_mb = round(os.path.getsize(db_path) / (1024 * 1024), 2)
+    existing_ids = sample_ids(size, args)
+
+    config = {"JSON_DB_PATH": db_path}
+    results = run_operations(
+        CodegenDatabase("json", config, item_cache_size=0),
+        CodegenDatabase("json", config), "json", size, existing_ids, args)
+    for result in results:
+        result["storage_mb"] = file_size_mb
+    os.remove(db_path)
+    return results
+
+
+def bench_mongodb(size: int, args) -> list:
+    from src import codegen_db_mongodb
+    from src.codegen_db import CodegenDatabase
+
+    uri = args.mongodb_uri
+    if not uri:
+        import mongomock
+        codegen_db_mongodb.MongoClient = mongomock.MongoClient
+        uri = "mongodb://localhost:27017"
+    db_name = "vitexbrain_bench"
+    collection_name = f"conversations_{size}"
+    config = {
+        "MONGODB_URI": uri,
+        "MONGODB_DB_NAME": db_name,
+        "MONGODB_COLLECTION_NAME": collection_name,
+    }
+    db = CodegenDatabase("mongodb", config, item_cache_size=0)
+    collection = db.db.collection
+    seed_mongodb(collection, size, args.answer_size, args.seed)
+    existing_ids = sample_ids(size, args)
+    results = run_operations(db, CodegenDatabase("mongodb", config),
+                             "mongodb", size, existing_ids, args)
+    collection.drop()
+    return results
+
+
+def run_backend(backend: str, size: int, args, work_dir: str, queue):
+    """
+    Child process entry point: run one backend / size pair and report the
+    results with the process peak RSS
+    """
+    silence_debug_logs()
+    try:
+        if backend == "json":
+            results = bench_json(size, args, work_dir)
+        else:
+            results = bench_mongodb(size, args)
+        peak_rss_mb = get_peak_rss_mb()
+        for result in results:
+            result["peak_rss_mb"] = peak_rss_mb
+        queue.put({"results": results})
+    except Exception as e:
+        queue.put({"error": f"{backend} / {size}: {e}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--backends", default=",".join(ALL_BACKENDS),
+                        help="Comma separated backends: " +
+                        ", ".join(ALL_BACKENDS))
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="Comma separated number of conversations")
+    parser.add_argument("--ops", type=int, default=20,
+                        help="Number of save_item, get_item and delete_item"
+                        " calls per run")
+    parser.add_argument("--list-ops", type=int, default=3,
+                        help="Number of sorted get_list calls per run")
+    parser.add_argument("--answer-size", type=int, default=3000,
+                        help="Approximate text answer size in characters")
+    parser.add_argument("--max-op-seconds", type=float, default=60.0,
+                        help="Time budget per operation series. Series"
+                        " that exceed it are reported as truncated")
+    parser.add_argument("--compression", default="zlib",
+                        choices=["zlib", "none"],
+                        help="Large fields compression (DB_COMPRESSION)")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Random seed for the generated records")
+    parser.add_argument("--mongodb-uri", default=os.environ.get(
+                        "BENCH_MONGODB_URI"),
+                        help="MongoDB server URI. Defaults to the"
+                        " in-process mongomock stand-in")
+    parser.add_argument("--json", dest="json_output", default=None,
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+    # Inherited by the backend processes
+    os.environ["DB_COMPRESSION"] = args.compression
+
+    context = multiprocessing.get_context("spawn")
+    work_dir = tempfile.mkdtemp(prefix="vitexbrain_bench_db_")
+    results = []
+    try:
+        for backend in args.backends.split(","):
+            backend = backend.strip()
+            if backend not in ALL_BACKENDS:
+                raise ValueError(f"Invalid backend: {backend}")
+            for size in parse_int_list(args.sizes):
+                print(f"{backend} | {size} conversations...")
+                queue = context.Queue()
+                process = context.Process(
+                    target=run_backend,
+                    args=(backend, size, args, work_dir, queue))
+                process.start()
+                outcome = queue.get()
+                process.join()
+                if outcome.get("error"):
+                    print(f"ERROR: {outcome['error']}")
+                    continue
+                results.extend(outcome["results"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("")
+    print_report(results, REPORT_COLUMNS)
+    if args.json_output:
+        write_json_report(results, args.json_output, {
+            "benchmark": "db",
+            "sizes": parse_int_list(args.sizes),
+            "ops": args.ops,
+            "answer_size": args.answer_size,
+            "seed": args.seed,
+            "compression": args.compression,
+            "mongodb": args.mongodb_uri and "server" or "mongomock",
+        })
+
+
+if __name__ == "__main__":
+    main()
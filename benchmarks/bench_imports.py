@@ -0,0 +1,134 @@
+"""
+Import time benchmark
+
+Measures the cold-start cost of the database and provider layers: each
+scenario runs in a fresh Python process, timing its imports and reporting
+the heavy third-party libraries it loaded. The "_eager" scenarios import
+every implementation up front, like the hard-coded dispatch did, to show
+the gain of the lazy registries.
+
+Usage:
+    python -m benchmarks.bench_imports --repeat 10 --json bench_imports.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_utilities import (
+    percentile,
+    print_report,
+    write_json_report,
+)
+
+HEAVY_MODULES = ["pymongo", "openai", "httpx", "requests", "tornado",
+                 "numpy"]
+
+SCENARIOS = {
+    "db_json": """
+from src.codegen_db import CodegenDatabase
+CodegenDatabase("json", {"JSON_DB_PATH": JSON_DB_PATH})
+""",
+    "db_json_eager": """
+import src.codegen_db_json
+import src.codegen_db_mongodb
+from src.codegen_db import CodegenDatabase
+CodegenDatabase("json", {"JSON_DB_PATH": JSON_DB_PATH})
+""",
+    "llm_provider": """
+from src.codegen_ai_utilities import LlmProvider
+""",
+    "llm_provider_eager": """
+import src.codegen_ai_provider_rhymes
+import src.codegen_ai_provider_openai
+from src.codegen_ai_utilities import LlmProvider
+""",
+    "llm_provider_first_use": """
+from src.codegen_ai_utilities import LlmProvider
+LlmProvider({"provider": "rhymes"})
+""",
+    "app_streamlit": """
+import app_streamlit
+""",
+}
+
+# Runs the scenario code and prints its import time and loaded modules
+RUNNER = """
+import json, sys, time
+JSON_DB_PATH = sys.argv[1]
+start = time.perf_counter()
+exec(compile(sys.argv[2], "scenario", "exec"))
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(
+    name for name in sys.argv[3].split(",") if name in sys.modules)}))
+"""
+
+REPORT_COLUMNS = ["name", "runs", "p50_ms", "p95_ms", "min_ms",
+                  "process_p50_ms", "heavy_modules"]
+
+
+def run_scenario(name: str, repeat: int, json_db_path: str) -> dict:
+    """
+    Run a scenario "repeat" times, each one in a new process
+    """
+    import_times = []
+    process_times = []
+    modules = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", RUNNER, json_db_path, SCENARIOS[name],
+             ",".join(HEAVY_MODULES)],
+            capture_output=True, text=True, check=True,
+            env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"))
+        process_times.append(time.perf_counter() - start)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        import_times.append(result["elapsed"])
+        modules = result["modules"]
+    return {
+        "name": name,
+        "runs": repeat,
+        "p50_ms": round(percentile(import_times, 50) * 1000, 2),
+        "p95_ms": round(percentile(import_times, 95) * 1000, 2),
+        "min_ms": round(min(import_times) * 1000, 2),
+        "process_p50_ms": round(percentile(process_times, 50) * 1000, 2),
+        "heavy_modules": ",".join(modules) or "-",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Processes per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Comma separated scenarios to run: " +
+                        ", ".join(SCENARIOS))
+    parser.add_argument("--json", dest="json_output", default=None,
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_db_path = os.path.join(tmp_dir, "conversations.json")
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise ValueError(f"Invalid scenario: {name}")
+            result = run_scenario(name, args.repeat, json_db_path)
+            results.append(result)
+            print(f"{name} | p50 {result['p50_ms']} ms | "
+                  f"{result['heavy_modules']}")
+    print("")
+    print_report(results, REPORT_COLUMNS)
+    if args.json_output:
+        write_json_report(results, args.json_output, {
+            "benchmark": "imports",
+            "python": sys.version.split()[0],
+        })
+
+
+if __name__ == "__main__":
+    main()
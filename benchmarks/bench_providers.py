@@ -0,0 +1,235 @@
+"""
+Provider layer benchmark
+
+Starts the local stub servers and drives LlmProvider, TextToVideoProvider
+and get_suggestions_from_ai at different concurrency levels, reporting
+p50/p95/p99 latency and requests per second.
+
+Usage:
+    python -m benchmarks.bench_providers --concurrency 1,4,16 --requests 64
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+from benchmarks.bench_utilities import (
+    silence_debug_logs,
+    percentile,
+    run_concurrently,
+    summarize_latencies,
+    print_report,
+    write_json_report,
+    parse_int_list,
+)
+from benchmarks.stub_servers import StubApiServer
+
+ALL_SCENARIOS = [
+    "aria_query",
+    "openai_query",
+    "enhanced_query",
+    "suggestions",
+    "video",
+    "openai_stream",
+]
+
+REPORT_COLUMNS = ["name", "concurrency", "requests", "errors", "rps",
+                  "p50_ms", "p95_ms", "p99_ms", "max_ms", "ttft_p50_ms"]
+
+
+def point_aria_to_endpoints(stubs: list) -> None:
+    """
+    Serve the Aria requests with an endpoint pool of stub servers
+    """
+    os.environ["LLM_ENDPOINTS"] = json.dumps({
+        "rhymes/*": [{"base_url": stub.base_url, "provider": f"stub{i}"}
+                     for i, stub in enumerate(stubs)],
+    })
+
+
+def point_providers_to_stub(stub: StubApiServer) -> None:
+    """
+    Configure the providers through the environment, the same way the app
+    does, but pointing them to the local stub server
+    """
+    os.environ["LLM_PROVIDER"] = "rhymes"
+    os.environ["TEXT_TO_VIDEO_PROVIDER"] = "rhymes"
+    os.environ["RHYMES_ARIA_API_KEY"] = "stub-aria-key"
+    os.environ["RHYMES_ALLEGRO_API_KEY"] = "stub-allegro-key"
+    os.environ["RHYMES_ARIA_BASE_URL"] = stub.base_url
+    os.environ["RHYMES_ALLEGRO_BASE_URL"] = stub.base_url
+    os.environ["OPENAI_API_KEY"] = "stub-openai-key"
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+
+
+def get_scenarios(args) -> dict:
+    """
+    Returns the benchmark scenarios as zero-argument callables
+    """
+    # Imported here so the environment is already set up
+    from src.codegen_ai_utilities import LlmProvider, TextToVideoProvider
+    from app_streamlit import get_suggestions_from_ai
+    from app_streamlit_contants import (
+        SUGGESTIONS_PROMPT_TEXT,
+        SUGGESTIONS_QTY,
+        REFINE_LLM_PROMPT_TEXT,
+    )
+
+    question = "Explain why a tomato is a fruit"
+    # Unique questions, so the single-flight layer doesn't coalesce them
+    request_number = itertools.count()
+
+    def aria_query():
+        return LlmProvider({"provider": "rhymes"}).query(
+            "{question}", f"{question} #{next(request_number)}")
+
+    def openai_query():
+        return LlmProvider({
+            "provider": "openai",
+            "model_name": "stub-model",
+        }).query("{question}", f"{question} #{next(request_number)}")
+
+    def enhanced_query():
+        return LlmProvider({"provider": "rhymes"}).query(
+            "{question}", question, REFINE_LLM_PROMPT_TEXT)
+
+    def suggestions():
+        return get_suggestions_from_ai(SUGGESTIONS_PROMPT_TEXT,
+                                       SUGGESTIONS_QTY)
+
+    def video():
+        ttv_model = TextToVideoProvider({"provider": "rhymes"})
+        response = ttv_model.request(question)
+        if response['error']:
+            return response
+        return ttv_model.generation_check(response, args.poll_interval)
+
+    return {
+        "aria_query": aria_query,
+        "openai_query": openai_query,
+        "enhanced_query": enhanced_query,
+        "suggestions": suggestions,
+        "video": video,
+    }
+
+
+def run_stream_scenario(stub: StubApiServer, total: int,
+                        concurrency: int) -> dict:
+    """
+    Measure total latency and time-to-first-token of streamed completions
+    """
+    client = OpenAI(base_url=stub.base_url, api_key="stub-openai-key")
+
+    def timed_stream(_):
+        start = time.perf_counter()
+        first_token = None
+        try:
+            stream = client.chat.completions.create(
+                model="stub-model",
+                messages=[{"role": "user", "content": "Hello"}],
+                stream=True,
+            )
+            for chunk in stream:
+                if first_token is None and chunk.choices and \
+                   chunk.choices[0].delta.content:
+                    first_token = time.perf_counter() - start
+        except Exception:
+            return time.perf_counter() - start, None, True
+        return time.perf_counter() - start, first_token, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_stream, range(total)))
+    elapsed = time.perf_counter() - start
+    ttfts = [ttft for _, ttft, _ in results if ttft is not None]
+    return summarize_latencies(
+        "openai_stream",
+        [latency for latency, _, _ in results],
+        elapsed,
+        sum(1 for _, _, failed in results if failed),
+        {
+            "concurrency": concurrency,
+            "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 2),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--concurrency", default="1,4,16",
+                        help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32,
+                        help="Requests per scenario and concurrency level")
+    parser.add_argument("--scenarios", default=",".join(ALL_SCENARIOS),
+                        help="Comma separated scenarios to run: " +
+                        ", ".join(ALL_SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Stub server fixed latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02,
+                        help="Stub server mean exponential jitter in seconds")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.005,
+                        help="Delay between streamed chunks in seconds")
+    parser.add_argument("--video-completion-time", type=float, default=1.0,
+                        help="Seconds until a stub video is ready")
+    parser.add_argument("--capacity", type=int, default=None,
+                        help="Requests each stub server serves at the same"
+                        " time. Unlimited by default")
+    parser.add_argument("--endpoints", type=int, default=1,
+                        help="Stub servers in the Aria endpoint pool")
+    parser.add_argument("--poll-interval", type=float, default=0.25,
+                        help="Video generation check wait time in seconds")
+    parser.add_argument("--json", dest="json_output", default=None,
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    silence_debug_logs()
+    stubs = [StubApiServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        stream_chunk_delay=args.stream_chunk_delay,
+        video_completion_time=args.video_completion_time,
+        capacity=args.capacity,
+    ).start() for _ in range(max(1, args.endpoints))]
+    stub = stubs[0]
+    point_providers_to_stub(stub)
+    if len(stubs) > 1:
+        point_aria_to_endpoints(stubs)
+
+    try:
+        scenarios = get_scenarios(args)
+        results = []
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in ALL_SCENARIOS:
+                raise ValueError(f"Invalid scenario: {name}")
+            for concurrency in parse_int_list(args.concurrency):
+                if name == "openai_stream":
+                    result = run_stream_scenario(stub, args.requests,
+                                                 concurrency)
+                else:
+                    result = run_concurrently(name, scenarios[name],
+                                              args.requests, concurrency)
+                results.append(result)
+                print(f"{name} | concurrency {concurrency} | "
+                      f"{result['rps']} req/s | p95 {result['p95_ms']} ms")
+        print("")
+        print_report(results, REPORT_COLUMNS)
+        if args.json_output:
+            write_json_report(results, args.json_output, {
+                "benchmark": "providers",
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "video_completion_time": args.video_completion_time,
+                "capacity": args.capacity,
+                "endpoints": len(stubs),
+            })
+    finally:
+        for stub in stubs:
+            stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark utilities
+"""
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import codegen_utilities
+
+
+def silence_debug_logs() -> None:
+    """
+    Disable the debug messages, so they don't distort the measurements
+    """
+    codegen_utilities.DEBUG = False
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Returns the nearest-rank percentile of a list of values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize_latencies(name: str, latencies: list, elapsed: float,
+                        errors: int = 0, extra: dict = None) -> dict:
+    """
+    Returns the summary of a benchmark run: p50/p95/p99 latency in
+    milliseconds and requests per second
+    """
+    summary = {
+        "name": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+    if extra:
+        summary.update(extra)
+    return summary
+
+
+def run_concurrently(name: str, func, total: int, concurrency: int,
+                     extra: dict = None) -> dict:
+    """
+    Run "func" "total" times with "concurrency" workers and return the
+    latency summary. "func" returns a resultset, so the runs with
+    "error" are counted as errors.
+    """
+    def timed_call(_):
+        start = time.perf_counter()
+        try:
+            result = func()
+            failed = bool(isinstance(result, dict) and result.get("error"))
+        except Exception:
+            failed = True
+        return time.perf_counter() - start, failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, failed in results if failed)
+    summary = {"concurrency": concurrency}
+    summary.update(extra or {})
+    return summarize_latencies(name, latencies, elapsed, errors, summary)
+
+
+def print_report(results: list, columns: list = None) -> None:
+    """
+    Print the benchmark results as a plain text table
+    """
+    if not results:
+        print("No results")
+        return
+    if not columns:
+        columns = list(results[0].keys())
+    widths = {
+        col: max(len(col), *(len(str(row.get(col, ""))) for row in results))
+        for col in columns
+    }
+    print("  ".join(col.ljust(widths[col]) for col in columns))
+    for row in results:
+        print("  ".join(str(row.get(col, "")).ljust(widths[col])
+                        for col in columns))
+
+
+def write_json_report(results: list, output_path: str,
+                      metadata: dict = None) -> None:
+    """
+    Write the benchmark results as machine-readable JSON
+    """
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "metadata": metadata or {},
+        "results": results,
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def parse_int_list(value: str) -> list:
+    """
+    Parse a comma separated list of integers (e.g. "1,4,16")
+    """
+    return [int(v) for v in value.split(",") if v.strip()]
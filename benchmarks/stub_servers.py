@@ -0,0 +1,220 @@
+"""
+Local stand-ins for the OpenAI-compatible and Allegro APIs, so the
+provider layer can be benchmarked without spending API credits
+"""
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+STUB_SUGGESTIONS = {
+    "s1": "A timelapse of a city skyline from dusk to night",
+    "s2": "Explain how a rainbow is formed",
+    "s3": "A paper boat sailing down a rainy street",
+    "s4": "Give me a weekly workout plan for beginners",
+}
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the stub OpenAI-compatible and Allegro endpoints
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output clean
+        pass
+
+    def send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path.endswith("/chat/completions"):
+            return self.chat_completions(self.read_json())
+        if path.endswith("/generateVideoSyn"):
+            return self.generate_video(self.read_json())
+        self.send_json({"error": f"Unknown endpoint {path}"}, 404)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path.endswith("/videoQuery"):
+            request_id = parse_qs(parsed.query).get("requestId", [""])[0]
+            return self.video_query(request_id)
+        if parsed.path.endswith("/models"):
+            return self.send_json({"object": "list", "data": []})
+        self.send_json({"error": f"Unknown endpoint {parsed.path}"}, 404)
+
+    def chat_completions(self, payload: dict):
+        self.server.sleep_latency()
+        prompt = ""
+        if payload.get("messages"):
+            prompt = payload["messages"][-1].get("content", "")
+        if '"refined_prompt"' in prompt:
+            content = json.dumps({
+                "refined_prompt": "Explain step-by-step the question",
+                "response": self.server.completion_text,
+            })
+        elif "JSON output" in prompt:
+            content = json.dumps(STUB_SUGGESTIONS)
+        else:
+            content = self.server.completion_text
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if payload.get("stream"):
+            return self.stream_completion(completion_id, payload, content)
+        self.send_json({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4,
+            },
+        })
+
+    def stream_completion(self, completion_id: str, payload: dict,
+                          content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else f" {word}"},
+                    "finish_reason": None,
+                }],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            if self.server.stream_chunk_delay:
+                time.sleep(self.server.stream_chunk_delay)
+        self.write_chunk("data: [DONE]\n\n")
+        self.write_chunk("")
+
+    def write_chunk(self, data: str):
+        encoded = data.encode("utf-8")
+        self.wfile.write(f"{len(encoded):X}\r\n".encode("ascii"))
+        self.wfile.write(encoded + b"\r\n")
+        self.wfile.flush()
+
+    def generate_video(self, payload: dict):
+        self.server.sleep_latency()
+        request_id = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.video_requests[request_id] = time.monotonic()
+        self.send_json({"message": "success", "data": request_id})
+
+    def video_query(self, request_id: str):
+        self.server.sleep_latency()
+        with self.server.lock:
+            requested_at = self.server.video_requests.get(request_id)
+        if requested_at is None:
+            return self.send_json({"message": "requestId not found",
+                                   "data": ""})
+        if time.monotonic() - requested_at < \
+           self.server.video_completion_time:
+            return self.send_json({"message": "processing", "data": ""})
+        self.send_json({
+            "message": "success",
+            "data": f"{self.server.base_url}/videos/{request_id}.mp4",
+        })
+
+
+class StubApiServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with the stub API configuration
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.05, jitter: float = 0.0,
+                 stream_chunk_delay: float = 0.0,
+                 video_completion_time: float = 1.0,
+                 completion_text: str = None, capacity: int = None):
+        super().__init__((host, port), StubApiHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunk_delay = stream_chunk_delay
+        self.video_completion_time = video_completion_time
+        self.completion_text = completion_text or (
+            "This is a stub answer generated by the local benchmark "
+            "server. " * 8).strip()
+        self.video_requests = {}
+        self.lock = threading.Lock()
+        # Requests served at the same time, like a model server slots
+        self.capacity = threading.BoundedSemaphore(capacity) \
+            if capacity else None
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def sleep_latency(self):
+        """
+        Simulate the upstream latency: a fixed part plus an exponential
+        jitter, so the tail percentiles are not flat
+        """
+        delay = self.latency
+        if self.jitter:
+            delay += random.expovariate(1 / self.jitter)
+        if delay <= 0:
+            return
+        if not self.capacity:
+            time.sleep(delay)
+            return
+        with self.capacity:
+            time.sleep(delay)
+
+    def handle_error(self, request, client_address):
+        """
+        Clients that give up (e.g. by a deadline) are expected
+        """
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self) -> "StubApiServer":
+        """
+        Start serving in a background thread
+        """
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving and release the socket
+        """
+        self.shutdown()
+        self.server_close()
@@ -1,9 +1,79 @@
 """
 LLM provider abstract class
 """
+import os
+import json
+
 from src.codegen_utilities import get_default_resultset
 from src.codegen_utilities import log_debug
-from src.codegen_ai_abstracts_constants import DEFAULT_PROMPT_ENHANCEMENT_TEXT
+from src.codegen_ai_abstracts_constants import (
+    DEFAULT_PROMPT_ENHANCEMENT_TEXT,
+    FUSED_PROMPT_ENHANCEMENT_TEXT,
+)
+from src.codegen_singleflight import SingleFlight, get_request_key
+from src.codegen_deadlines import (
+    get_remaining_time,
+    is_deadline_exceeded,
+    get_deadline_exceeded_resultset,
+)
+
+# Identical in-flight LLM requests are sent upstream just once
+llm_single_flight = SingleFlight()
+
+# "two_calls": prompt enhancement, then the answer. "fused" (opt-in): the
+# refined prompt and the answer in one request, followed by at most one
+# more request if it can't be parsed
+DEFAULT_PROMPT_ENHANCEMENT_MODE = "two_calls"
+
+
+def clean_refined_prompt(refined_prompt: str) -> str:
+    """
+    Remove the line breaks, labels and quotes the LLM adds to a refined
+    prompt
+    """
+    refined_prompt = refined_prompt.replace("\n", " ")
+    refined_prompt = refined_prompt.replace("\r", " ")
+    refined_prompt = refined_prompt.replace("Refined Prompt:", "")
+    refined_prompt = refined_prompt.replace("Enhanced Prompt (Output):",
+                                            "")
+    refined_prompt = refined_prompt.replace("Enhanced Prompt:", "")
+    refined_prompt = refined_prompt.replace("**Enhanced Prompt**:", "")
+    refined_prompt = refined_prompt.replace("**Enhanced Prompt**", "")
+    refined_prompt = refined_prompt.strip()
+    refined_prompt = refined_prompt.replace('"', '')
+    return refined_prompt
+
+
+def parse_fused_response(text: str) -> tuple:
+    """
+    Returns the (refined_prompt, response) of a fused prompt enhancement
+    and answer response, each one None if it's missing or empty, or None
+    if it can't be parsed
+    """
+    if not text:
+        return None
+    text = text.strip()
+    text = text.replace('```json', '')
+    text = text.replace('```', '')
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return None
+    refined_prompt = data.get("refined_prompt")
+    answer = data.get("response")
+    if isinstance(refined_prompt, str):
+        refined_prompt = clean_refined_prompt(refined_prompt) or None
+    else:
+        refined_prompt = None
+    if not isinstance(answer, str) or not answer.strip():
+        answer = None
+    return refined_prompt, answer
 
 
 class LlmProviderAbstract:
@@ -22,15 +92,38 @@ class LlmProviderAbstract:
         """
         pass
 
+    def warm_up(self) -> dict:
+        """
+        Open the provider connections before the first request
+        """
+        return get_default_resultset()
+
     def query(self, prompt: str, question: str,
-              prompt_enhancement_text: str = None) -> dict:
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
         """
-        Abstract method for querying the LLM
+        Abstract method for querying the LLM. "deadline" is the
+        time.monotonic() value when the request must be done.
         """
         raise NotImplementedError
 
+    def query_stream(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None,
+                     deadline: float = None):
+        """
+        Query the LLM yielding {"delta": text} dicts with the answer
+        chunks, and finally the resultset. Providers without streaming
+        support yield the whole answer at once.
+        """
+        response = self.query(prompt, question, prompt_enhancement_text,
+                              deadline)
+        if not response['error']:
+            yield {"delta": response['response']}
+        yield response
+
     def request(self, question: str,
-                prompt_enhancement_text: str = None) -> dict:
+                prompt_enhancement_text: str = None,
+                deadline: float = None) -> dict:
         """
         Abstract method for video or other llm/model type request
         """
@@ -39,38 +132,79 @@ class LlmProviderAbstract:
     def generation_check(
         self,
         request_response: dict,
-        wait_time: int = 60
+        wait_time: int = 60,
+        deadline: float = None,
     ):
         """
         Perform a video or other llm/model type generation request check
         """
         raise NotImplementedError
 
+    def get_prompt_enhancement_mode(self) -> str:
+        return self.params.get(
+            "prompt_enhancement_mode",
+            os.environ.get("LLM_PROMPT_ENHANCEMENT_MODE",
+                           DEFAULT_PROMPT_ENHANCEMENT_MODE))
+
+    def fused_query(self, question: str, prompt_enhancement_text: str,
+                    deadline: float = None) -> dict:
+        """
+        Enhance the prompt and answer it in a single request. If the
+        response can't be parsed, "fused" is False and "response" is
+        None: the caller answers the "refined_prompt" in one more
+        request if the response had one, otherwise it enhances the prompt
+        and answers it in two requests.
+        """
+        fused_prompt = FUSED_PROMPT_ENHANCEMENT_TEXT.replace(
+            "{prompt_enhancement_text}", prompt_enhancement_text)
+        response = self.query(fused_prompt, question, deadline=deadline)
+        if response['error']:
+            return response
+        refined_prompt, answer = \
+            parse_fused_response(response['response']) or (None, None)
+        response['refined_prompt'] = refined_prompt
+        response['fused'] = bool(refined_prompt and answer)
+        if not response['fused']:
+            log_debug("fused_query | Invalid response, falling back to "
+                      f"{'its refined prompt' if refined_prompt else 'two'}"
+                      " requests")
+            answer = None
+        response['response'] = answer
+        return response
+
     def prompt_enhancer(self, question: str,
-                        prompt_enhancement_text: str = None) -> dict:
+                        prompt_enhancement_text: str = None,
+                        deadline: float = None) -> dict:
+        """
+        Perform a prompt enhancement request, coalescing the identical
+        concurrent requests
+        """
+        try:
+            return llm_single_flight.do(
+                get_request_key("prompt_enhancer", self.provider,
+                                self.model_name, question,
+                                prompt_enhancement_text),
+                lambda: self.enhance_prompt(question, prompt_enhancement_text,
+                                            deadline),
+                get_remaining_time(deadline), retry=is_deadline_exceeded)
+        except TimeoutError:
+            return get_deadline_exceeded_resultset("prompt enhancement")
+
+    def enhance_prompt(self, question: str,
+                       prompt_enhancement_text: str = None,
+                       deadline: float = None) -> dict:
         """
-        Perform a prompt enhancement request
+        Perform the prompt enhancement LLM request
         """
         response = get_default_resultset()
         if not prompt_enhancement_text:
             prompt_enhancement_text = DEFAULT_PROMPT_ENHANCEMENT_TEXT
         log_debug("PROMPT_ENHANCER | prompt_enhancement_text: " +
                   f"{prompt_enhancement_text}")
-        llm_response = self.query(prompt_enhancement_text, question)
+        llm_response = self.query(prompt_enhancement_text, question,
+                                  deadline=deadline)
         log_debug("PROMPT_ENHANCER | llm_response: " + f"{llm_response}")
         if llm_response['error']:
             return llm_response
-        refined_prompt = llm_response['response']
-        # Clean the refined prompt
-        refined_prompt = refined_prompt.replace("\n", " ")
-        refined_prompt = refined_prompt.replace("\r", " ")
-        refined_prompt = refined_prompt.replace("Refined Prompt:", "")
-        refined_prompt = refined_prompt.replace("Enhanced Prompt (Output):",
-                                                "")
-        refined_prompt = refined_prompt.replace("Enhanced Prompt:", "")
-        refined_prompt = refined_prompt.replace("**Enhanced Prompt**:", "")
-        refined_prompt = refined_prompt.replace("**Enhanced Prompt**", "")
-        refined_prompt = refined_prompt.strip()
-        refined_prompt = refined_prompt.replace('"', '')
-        response['response'] = refined_prompt
+        response['response'] = clean_refined_prompt(llm_response['response'])
         return response
@@ -34,3 +34,19 @@ An enhanced version of the prompt with:
 - When enhancing the prompt, ensure reasoning precedes any conclusion or answer.
 - Always define how the output should be structured (e.g., format length or elements).
 """
+
+# Single round trip prompt enhancement and answer. The
+# "{prompt_enhancement_text}" placeholder is replaced by the enhancement
+# text, which has the "{question}" placeholder.
+FUSED_PROMPT_ENHANCEMENT_TEXT = """
+Follow the *PROMPT ENHANCEMENT INSTRUCTIONS* to enhance the *USER PROMPT*, then answer the enhanced prompt.
+
+# Output Format
+
+Give me just a JSON object with two string attributes, no other text:
+- "refined_prompt": the enhanced prompt.
+- "response": the complete answer to the enhanced prompt, in Markdown.
+
+*PROMPT ENHANCEMENT INSTRUCTIONS*
+{prompt_enhancement_text}
+"""
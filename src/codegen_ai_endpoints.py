@@ -0,0 +1,225 @@
+"""
+Latency-aware load balancing across OpenAI-compatible endpoints
+
+A provider / model can be served by a pool of endpoints, configured with
+the LLM_ENDPOINTS environment variable, a JSON object whose keys are
+"provider/model_name", "provider/*" or "*" (like LLM_RATE_LIMITS):
+
+    LLM_ENDPOINTS='{"rhymes/aria": [
+        {"base_url": "https://api.rhymes.ai/v1"},
+        {"base_url": "http://localhost:8000/v1", "model": "rhymes-ai/Aria",
+         "api_key": "none", "provider": "vllm"}]}'
+
+Each endpoint can set "base_url", "api_key" (or "api_key_env", the
+environment variable with the API key), "model" and "provider" (the
+rate limits key). The missing ones are taken from the request.
+
+Each request goes to the endpoint with the lowest EWMA latency weighted
+by its in-flight requests. Endpoints that fail "eject_after" consecutive
+requests are ejected for "eject_time" seconds (passive health checks).
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from src.codegen_utilities import log_debug
+
+DEFAULT_EWMA_ALPHA = 0.3
+DEFAULT_INITIAL_LATENCY = 1.0
+DEFAULT_EJECT_AFTER = 3
+DEFAULT_EJECT_TIME = 30
+MAX_EJECT_TIME = 300
+
+
+class Endpoint:
+    """
+    One OpenAI-compatible endpoint with its latency and health stats
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self.name = config.get("name") or config.get("base_url") or "default"
+        self.ewma_latency = None
+        self.in_flight = 0
+        self.consecutive_errors = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def get_score(self, default_latency: float) -> float:
+        """
+        Expected wait of a new request: lower is better
+        """
+        latency = self.ewma_latency if self.ewma_latency is not None \
+            else default_latency
+        return latency * (self.in_flight + 1)
+
+    def apply(self, model_params: dict) -> dict:
+        """
+        Returns the request parameters to send it to this endpoint
+        """
+        model_params = dict(model_params)
+        for key in ["base_url", "api_key", "model", "provider"]:
+            if self.config.get(key):
+                model_params[key] = self.config[key]
+        if self.config.get("api_key_env"):
+            model_params["api_key"] = \
+                os.environ.get(self.config["api_key_env"])
+        return model_params
+
+
+class EndpointPool:
+    """
+    Routes the requests to the endpoint with the best EWMA latency and
+    lowest in-flight count, ejecting the failing ones
+    """
+    def __init__(self, name: str, endpoints: list,
+                 ewma_alpha: float = DEFAULT_EWMA_ALPHA,
+                 eject_after: int = DEFAULT_EJECT_AFTER,
+                 eject_time: float = DEFAULT_EJECT_TIME):
+        self.name = name
+        self.endpoints = [Endpoint(config) for config in endpoints]
+        self.ewma_alpha = ewma_alpha
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.lock = threading.Lock()
+
+    def get_default_latency(self) -> float:
+        """
+        Latency assumed for the endpoints without samples: the best known
+        one, so new endpoints get traffic right away
+        """
+        latencies = [endpoint.ewma_latency for endpoint in self.endpoints
+                     if endpoint.ewma_latency is not None]
+        return min(latencies) if latencies else DEFAULT_INITIAL_LATENCY
+
+    def choose(self, exclude: list = None) -> Endpoint:
+        """
+        Returns the endpoint for the next request, counting it in-flight.
+        If all endpoints are ejected, the one that recovers first is used.
+        """
+        exclude = exclude or []
+        with self.lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude] or self.endpoints
+            healthy = [endpoint for endpoint in candidates
+                       if not endpoint.is_ejected(now)]
+            if healthy:
+                default_latency = self.get_default_latency()
+                endpoint = min(healthy, key=lambda e:
+                               e.get_score(default_latency))
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def report(self, endpoint: Endpoint, latency: float,
+               error: bool) -> None:
+        """
+        Record a request result, ejecting the endpoint after too many
+        consecutive errors
+        """
+        with self.lock:
+            endpoint.in_flight -= 1
+            if not error:
+                endpoint.consecutive_errors = 0
+                endpoint.ejections = 0
+                if endpoint.ewma_latency is None:
+                    endpoint.ewma_latency = latency
+                else:
+                    endpoint.ewma_latency += self.ewma_alpha * \
+                        (latency - endpoint.ewma_latency)
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_errors += 1
+            if endpoint.consecutive_errors < self.eject_after:
+                return
+            # Exponential backoff for the endpoints that keep failing
+            eject_time = min(self.eject_time * 2 ** endpoint.ejections,
+                             MAX_EJECT_TIME)
+            endpoint.ejections += 1
+            endpoint.consecutive_errors = 0
+            endpoint.ejected_until = time.monotonic() + eject_time
+        log_debug(f"EndpointPool | {self.name} | {endpoint.name} ejected"
+                  f" for {eject_time}s")
+
+    @contextmanager
+    def use(self, exclude: list = None):
+        """
+        Context manager that yields the chosen endpoint and a result dict.
+        Set result["error"] to report a failed request.
+        """
+        endpoint = self.choose(exclude)
+        result = {"error": False}
+        start = time.perf_counter()
+        try:
+            yield endpoint, result
+        except Exception:
+            result["error"] = True
+            raise
+        finally:
+            self.report(endpoint, time.perf_counter() - start,
+                        result["error"])
+
+    def get_stats(self) -> list:
+        with self.lock:
+            now = time.monotonic()
+            return [{
+                "name": endpoint.name,
+                "ewma_latency": endpoint.ewma_latency,
+                "in_flight": endpoint.in_flight,
+                "requests": endpoint.requests,
+                "errors": endpoint.errors,
+                "ejected": endpoint.is_ejected(now),
+            } for endpoint in self.endpoints]
+
+
+_endpoint_pools = {}
+_endpoints_config = None
+_endpoint_pools_lock = threading.Lock()
+
+
+def set_endpoints(config: dict) -> None:
+    """
+    Set the endpoints configuration, replacing the LLM_ENDPOINTS one
+    """
+    global _endpoints_config
+    with _endpoint_pools_lock:
+        _endpoints_config = config or {}
+        _endpoint_pools.clear()
+
+
+def get_endpoints_config() -> dict:
+    global _endpoints_config
+    if _endpoints_config is None:
+        try:
+            _endpoints_config = json.loads(
+                os.environ.get("LLM_ENDPOINTS") or "{}")
+        except Exception as e:
+            log_debug(f"get_endpoints_config | Invalid LLM_ENDPOINTS: {e}")
+            _endpoints_config = {}
+    return _endpoints_config
+
+
+def get_endpoint_pool(provider: str, model_name: str) -> EndpointPool:
+    """
+    Returns the endpoint pool of a provider / model, or None if there are
+    no endpoints configured for it
+    """
+    with _endpoint_pools_lock:
+        config = get_endpoints_config()
+        for key in [f"{provider}/{model_name}", f"{provider}/*", "*"]:
+            if config.get(key):
+                break
+        else:
+            return None
+        if key not in _endpoint_pools:
+            _endpoint_pools[key] = EndpointPool(key, config[key])
+        return _endpoint_pools[key]
@@ -0,0 +1,144 @@
+"""
+Hedged LLM requests
+
+If the primary provider hasn't answered by a deadline (a percentile of
+its recent latencies), the same request is sent to a secondary provider
+and the first successful answer wins. If the primary fails, the secondary
+is used as failover.
+"""
+import time
+import threading
+from collections import deque
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+
+from src.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+)
+from src.codegen_deadlines import (
+    get_timeout,
+    get_deadline_exceeded_resultset,
+)
+
+HEDGE_MAX_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_WORKERS = 32
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS,
+                               thread_name_prefix="llm_hedge")
+
+
+class LatencyTracker:
+    """
+    Keeps the recent successful latencies of each provider
+    """
+    def __init__(self, max_samples: int = HEDGE_MAX_SAMPLES,
+                 min_samples: int = HEDGE_MIN_SAMPLES):
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, latency: float) -> None:
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.max_samples)
+            self.samples[name].append(latency)
+
+    def get_percentile(self, name: str, pct: float) -> float:
+        """
+        Returns the latency percentile of a provider, or None if there
+        are not enough samples yet
+        """
+        with self.lock:
+            samples = sorted(self.samples.get(name, []))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 *
+                                                (len(samples) - 1))))
+        return samples[index]
+
+
+latency_tracker = LatencyTracker()
+
+
+def get_hedge_delay(name: str, pct: float, default_delay: float) -> float:
+    """
+    Returns how long to wait for the primary provider before hedging
+    """
+    delay = latency_tracker.get_percentile(name, pct)
+    if delay is None:
+        return default_delay
+    return delay
+
+
+def timed_call(name: str, latency_key: str, func) -> dict:
+    """
+    Run a provider call, recording its latency when it succeeds and the
+    provider that served the answer
+    """
+    start = time.monotonic()
+    try:
+        response = func()
+    except Exception as e:
+        response = get_default_resultset()
+        response['error'] = True
+        response['error_message'] = str(e)
+    if not response['error']:
+        latency_tracker.record(latency_key, time.monotonic() - start)
+    response['provider'] = name
+    return response
+
+
+def hedged_call(primary: tuple, secondary: tuple, pct: float,
+                default_delay: float, latency_suffix: str = "",
+                deadline: float = None) -> dict:
+    """
+    Perform a hedged request. "primary" and "secondary" are
+    (provider name, zero-argument callable) tuples. No answer is waited
+    for past the "deadline".
+    """
+    primary_name, primary_func = primary
+    secondary_name, secondary_func = secondary
+    primary_key = f"{primary_name}{latency_suffix}"
+    secondary_key = f"{secondary_name}{latency_suffix}"
+    delay = get_hedge_delay(primary_key, pct, default_delay)
+
+    primary_future = _executor.submit(timed_call, primary_name,
+                                      primary_key, primary_func)
+    done, _ = wait([primary_future], timeout=get_timeout(deadline, delay))
+    if done:
+        response = primary_future.result()
+        if not response['error']:
+            return response
+        log_debug(f"hedged_call | {primary_name} failed, failover to " +
+                  f"{secondary_name}: {response['error_message']}")
+        return timed_call(secondary_name, secondary_key, secondary_func)
+
+    if get_timeout(deadline) == 0:
+        return get_deadline_exceeded_resultset("hedged LLM request")
+    log_debug(f"hedged_call | {primary_name} didn't answer in " +
+              f"{delay:.2f}s, hedging with {secondary_name}")
+    secondary_future = _executor.submit(timed_call, secondary_name,
+                                        secondary_key, secondary_func)
+    pending = {primary_future, secondary_future}
+    response = None
+    while pending:
+        done, pending = wait(pending, timeout=get_timeout(deadline),
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            return get_deadline_exceeded_resultset("hedged LLM request")
+        for future in done:
+            response = future.result()
+            if not response['error']:
+                # The loser is cancelled if it hasn't started, otherwise
+                # its answer is discarded when it arrives
+                for loser in pending:
+                    loser.cancel()
+                response['hedged'] = True
+                return response
+    return response
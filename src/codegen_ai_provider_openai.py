@@ -2,35 +2,97 @@
 OpenAI API
 """
 import os
-from openai import OpenAI
+import time
+import threading
+from openai import OpenAI, RateLimitError, APIConnectionError
 
 from src.codegen_utilities import (
     log_debug,
     get_default_resultset,
 )
 from src.codegen_ai_abstracts import LlmProviderAbstract
+from src.codegen_ai_rate_limits import get_rate_limiter, estimate_tokens
+from src.codegen_ai_endpoints import get_endpoint_pool
+from src.codegen_deadlines import (
+    is_expired,
+    get_timeout,
+    get_deadline_exceeded_resultset,
+)
 
+# Retries of the requests with a deadline (the client retries the other
+# ones): exponential backoff from INITIAL_RETRY_DELAY seconds
+INITIAL_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 8.0
+RETRY_STATUS_CODES = (408, 409, 429)
 
-def get_openai_api_response(model_params: dict) -> dict:
+# OpenAI clients by (base_url, api_key): each one keeps its own pool of
+# HTTP connections, reused by the following requests
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+
+def get_openai_client(client_config: dict) -> OpenAI:
+    """
+    Returns the pooled OpenAI client for a client configuration
+    """
+    key = (client_config.get("base_url"), client_config.get("api_key"))
+    with _openai_clients_lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            client = OpenAI(**client_config)
+            _openai_clients[key] = client
+    return client
+
+
+def warm_up_openai_api(model_params: dict) -> dict:
     """
-    Returns the OpenAI API response for a LLM request
+    Open the pooled HTTP connections (DNS, TCP and TLS) to the provider /
+    model endpoints, with a models list request
     """
     response = get_default_resultset()
+    endpoint_pool = get_endpoint_pool(model_params.get('provider'),
+                                      model_params.get('model'))
+    endpoints_params = [model_params] if not endpoint_pool else \
+        [endpoint.apply(model_params) for endpoint in endpoint_pool.endpoints]
+    errors = []
+    for endpoint_params in endpoints_params:
+        client_config, _ = get_openai_request_config(endpoint_params)
+        try:
+            get_openai_client(client_config).with_options(
+                max_retries=0, timeout=10).models.list()
+        except APIConnectionError as e:
+            errors.append(f"{client_config.get('base_url')}: {e}")
+        except Exception:
+            # Any HTTP response means the connection is open
+            pass
+    if errors:
+        response['error'] = True
+        response['error_message'] = "; ".join(errors)
+    return response
+
+
+def get_retry_after(error: Exception, default: float = 1.0) -> float:
+    """
+    Returns the seconds to wait from a rate limit error response headers
+    """
+    try:
+        return float(error.response.headers.get("retry-after", default))
+    except Exception:
+        return default
+
+
+def get_openai_request_config(model_params: dict) -> tuple:
+    """
+    Returns the OpenAI client and chat completion configurations for a
+    LLM request
+    """
     naming = {
         "model_name": "model",
     }
-    # Initialize the OpenAI client
     client_config = {}
     for key in ["base_url", "api_key"]:
         if model_params.get(key):
             client_config[naming.get(key, key)] = model_params[key]
-    try:
-        client = OpenAI(**client_config)
-    except Exception as e:
-        response['error'] = True
-        response['error_message'] = str(e)
-        return response
-    # Prepare the OpenAI API request
     model_config = {}
     for key in ["model", "model_name", "messages", "stop"]:
         if model_params.get(key):
@@ -41,8 +103,149 @@ def get_openai_api_response(model_params: dict) -> dict:
     for key in ["top_p", "max_tokens"]:
         if model_params.get(key):
             model_config[naming.get(key, key)] = int(model_params[key])
+    return client_config, model_config
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Returns True if the client would retry a request error: connection
+    errors, timeouts, rate limits and server errors
+    """
+    if isinstance(error, APIConnectionError):
+        return True
+    status_code = getattr(error, 'status_code', None) or 0
+    return status_code in RETRY_STATUS_CODES or status_code >= 500
+
+
+def create_chat_completion(client: OpenAI, model_config: dict,
+                           deadline: float = None):
+    """
+    Perform the chat completion request. Without a deadline, the client
+    retries it. With a deadline, each attempt gets the remaining time as
+    timeout and the client retries are made here, as long as their
+    backoff ends before the deadline.
+    """
+    if deadline is None:
+        return client.chat.completions.create(**model_config)
+    attempt_client = client.with_options(max_retries=0)
+    for attempt in range(client.max_retries + 1):
+        try:
+            return attempt_client.chat.completions.create(
+                **dict(model_config, timeout=get_timeout(deadline)))
+        except Exception as e:
+            if attempt == client.max_retries or not is_retryable_error(e):
+                raise
+            delay = min(INITIAL_RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY)
+            if isinstance(e, RateLimitError):
+                delay = max(delay, get_retry_after(e, delay))
+            if delay >= get_timeout(deadline):
+                raise
+            log_debug(f"create_chat_completion | retrying in {delay}s:"
+                      f" {e}")
+            time.sleep(delay)
+
+
+def is_endpoint_failure(response: dict) -> bool:
+    """
+    Returns True if an error response is due to the endpoint (connection
+    errors, rate limits and server errors), not to the request itself
+    """
+    if not response['error'] or response.get('deadline_exceeded'):
+        return False
+    status_code = response.get('status_code')
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def get_openai_api_response(model_params: dict) -> dict:
+    """
+    Returns the OpenAI API response for a LLM request. If the provider /
+    model has an endpoint pool, the request is sent to the best endpoint,
+    and retried once in another one if it fails.
+    """
+    endpoint_pool = get_endpoint_pool(model_params.get('provider'),
+                                      model_params.get('model'))
+    if not endpoint_pool:
+        return get_openai_endpoint_response(model_params)
+    tried = []
+    for _ in range(min(2, len(endpoint_pool.endpoints))):
+        if tried and is_expired(model_params.get("deadline")):
+            break
+        with endpoint_pool.use(exclude=tried) as (endpoint, result):
+            response = get_openai_endpoint_response(
+                endpoint.apply(model_params))
+            result['error'] = is_endpoint_failure(response)
+        if not result['error']:
+            break
+        tried.append(endpoint)
+        log_debug(f"get_openai_api_response | {endpoint.name} failed:"
+                  f" {response['error_message']}")
+    response['endpoint'] = endpoint.name
+    return response
+
+
+def get_openai_endpoint_response(model_params: dict) -> dict:
+    """
+    Returns the OpenAI API response for a LLM request to one endpoint
+    """
+    response = get_default_resultset()
+    deadline = model_params.get("deadline")
+    if is_expired(deadline):
+        return get_deadline_exceeded_resultset("LLM request")
+    client_config, model_config = get_openai_request_config(model_params)
+    # Initialize the OpenAI client
+    try:
+        client = get_openai_client(client_config)
+    except Exception as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+        return response
+    # Wait for the provider / model rate limits, if any
+    rate_limiter = get_rate_limiter(model_params.get('provider'),
+                                    model_config.get('model'))
+    if not rate_limiter:
+        return get_openai_completion(client, model_config, model_params,
+                                     response)
+    estimated_tokens = estimate_tokens(model_config.get('messages'),
+                                       model_config.get('max_tokens'))
+    with rate_limiter.limit(estimated_tokens, get_timeout(
+            deadline, rate_limiter.max_wait)) as rate_limit:
+        if rate_limit['error']:
+            return rate_limit
+        response = get_openai_completion(client, model_config, model_params,
+                                         response)
+        rate_limit['used_tokens'] = response.get('total_tokens')
+        if response.get('retry_after'):
+            rate_limiter.pause(response['retry_after'])
+    return response
+
+
+def get_openai_completion(client: OpenAI, model_config: dict,
+                          model_params: dict, response: dict) -> dict:
+    """
+    Perform the OpenAI API chat completion request
+    """
+    deadline = model_params.get("deadline")
+    if is_expired(deadline):
+        return get_deadline_exceeded_resultset("LLM request")
     # Process the question and text
-    llm_response = client.chat.completions.create(**model_config)
+    try:
+        # Each attempt gets the remaining budget, after waiting for the
+        # rate limits
+        llm_response = create_chat_completion(client, model_config,
+                                              deadline)
+    except RateLimitError as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+        response['retry_after'] = get_retry_after(e)
+        response['status_code'] = 429
+        return response
+    except Exception as e:
+        if is_expired(deadline):
+            return get_deadline_exceeded_resultset("LLM request")
+        response['error'] = True
+        response['error_message'] = str(e)
+        response['status_code'] = getattr(e, 'status_code', None)
+        return response
     log_debug("get_openai_api_response | " +
               f"{model_params.get('provider', 'N/A')} " +
               f" LLM response: {llm_response}")
@@ -51,28 +254,170 @@ def get_openai_api_response(model_params: dict) -> dict:
     except Exception as e:
         response['error'] = True
         response['error_message'] = str(e)
+    if getattr(llm_response, "usage", None):
+        response['total_tokens'] = llm_response.usage.total_tokens
     return response
 
 
+def get_openai_api_stream(model_params: dict):
+    """
+    Yields the OpenAI API streamed response for a LLM request: a
+    {"delta": text} dict per chunk, and finally the resultset with the
+    whole "response"
+    """
+    endpoint_pool = get_endpoint_pool(model_params.get('provider'),
+                                      model_params.get('model'))
+    if not endpoint_pool:
+        yield from get_openai_endpoint_stream(model_params)
+        return
+    with endpoint_pool.use() as (endpoint, result):
+        for event in get_openai_endpoint_stream(
+                endpoint.apply(model_params)):
+            if "error" in event:
+                result['error'] = is_endpoint_failure(event)
+                event['endpoint'] = endpoint.name
+            yield event
+
+
+def get_openai_endpoint_stream(model_params: dict):
+    """
+    Yields the OpenAI API streamed response for a LLM request to one
+    endpoint
+    """
+    response = get_default_resultset()
+    deadline = model_params.get("deadline")
+    if is_expired(deadline):
+        yield get_deadline_exceeded_resultset("LLM request")
+        return
+    client_config, model_config = get_openai_request_config(model_params)
+    model_config['stream'] = True
+    try:
+        client = get_openai_client(client_config)
+    except Exception as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+        yield response
+        return
+    # Wait for the provider / model rate limits, if any
+    rate_limiter = get_rate_limiter(model_params.get('provider'),
+                                    model_config.get('model'))
+    estimated_tokens = estimate_tokens(model_config.get('messages'),
+                                       model_config.get('max_tokens'))
+    if rate_limiter:
+        rate_limit = rate_limiter.acquire(
+            estimated_tokens, get_timeout(deadline, rate_limiter.max_wait))
+        if rate_limit['error']:
+            yield rate_limit
+            return
+    content = []
+    try:
+        # Only the request is retried, before the first chunk
+        stream = create_chat_completion(client, model_config, deadline)
+        for chunk in stream:
+            if is_expired(deadline):
+                stream.close()
+                response = get_deadline_exceeded_resultset("LLM request")
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                content.append(chunk.choices[0].delta.content)
+                yield {"delta": chunk.choices[0].delta.content}
+    except RateLimitError as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+        response['status_code'] = 429
+        if rate_limiter:
+            rate_limiter.pause(get_retry_after(e))
+    except Exception as e:
+        if is_expired(deadline):
+            response = get_deadline_exceeded_resultset("LLM request")
+        else:
+            response['error'] = True
+            response['error_message'] = str(e)
+            response['status_code'] = getattr(e, 'status_code', None)
+    finally:
+        if rate_limiter:
+            rate_limiter.release(estimated_tokens)
+    response['response'] = "".join(content)
+    yield response
+
+
 class OpenaiLlm(LlmProviderAbstract):
     """
     OpenAI LLM class
     """
     def query(self, prompt: str, question: str,
-              prompt_enhancement_text: str = None) -> dict:
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
         """
         Perform a OpenAI request
         """
         refined_prompt = None
+        if prompt_enhancement_text and \
+           self.get_prompt_enhancement_mode() == "fused":
+            response = self.fused_query(question, prompt_enhancement_text,
+                                        deadline)
+            if response['error'] or response['fused']:
+                return response
+            # Unparsed answer: if the response had a usable refined
+            # prompt, one more request answers it. Otherwise, the two
+            # calls path (prompt_enhancer, then the answer).
+            if response['refined_prompt']:
+                refined_prompt = prompt = response['refined_prompt']
+                prompt_enhancement_text = None
+
         if prompt_enhancement_text:
             llm_response = self.prompt_enhancer(
-                question, prompt_enhancement_text)
+                question, prompt_enhancement_text, deadline)
             if llm_response['error']:
                 return llm_response
             refined_prompt = llm_response['response']
             prompt = refined_prompt
 
-        model_params = {
+        model_params = self.get_model_params(prompt, question)
+        model_params['deadline'] = deadline
+
+        # Get the OpenAI API response
+        log_debug("openai_query | " +
+                  f"model_params: {model_params}")
+        response = get_openai_api_response(model_params)
+        response['refined_prompt'] = refined_prompt
+        log_debug("openai_query | " +
+                  f"response: {response}")
+        return response
+
+    def query_stream(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None,
+                     deadline: float = None):
+        """
+        Perform a OpenAI request, yielding the answer chunks
+        """
+        refined_prompt = None
+        if prompt_enhancement_text:
+            llm_response = self.prompt_enhancer(
+                question, prompt_enhancement_text, deadline)
+            if llm_response['error']:
+                yield llm_response
+                return
+            refined_prompt = llm_response['response']
+            prompt = refined_prompt
+            yield {"refined_prompt": refined_prompt}
+
+        model_params = self.get_model_params(prompt, question)
+        model_params['deadline'] = deadline
+        for event in get_openai_api_stream(model_params):
+            if "error" in event:
+                event['refined_prompt'] = refined_prompt
+            yield event
+
+    def warm_up(self) -> dict:
+        return warm_up_openai_api(self.get_model_params("", ""))
+
+    def get_model_params(self, prompt: str, question: str) -> dict:
+        """
+        Returns the OpenAI API request parameters
+        """
+        return {
+            "provider": "openai",
             "model": self.model_name,
             "api_key": self.api_key or os.environ.get("OPENAI_API_KEY"),
             "messages": [
@@ -85,12 +430,3 @@ class OpenaiLlm(LlmProviderAbstract):
             "top_p": self.params.get("top_p", 1),
             "max_tokens": self.params.get("max_tokens"),
         }
-
-        # Get the OpenAI API response
-        log_debug("openai_query | " +
-                  f"model_params: {model_params}")
-        response = get_openai_api_response(model_params)
-        response['refined_prompt'] = refined_prompt
-        log_debug("openai_query | " +
-                  f"response: {response}")
-        return response
@@ -4,16 +4,57 @@ Rhymes APIs
 """
 import os
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 
 from src.codegen_utilities import (
     log_debug,
     get_default_resultset,
 )
-from src.codegen_ai_provider_openai import get_openai_api_response
+from src.codegen_ai_provider_openai import (
+    get_openai_api_response,
+    get_openai_api_stream,
+    warm_up_openai_api,
+)
 from src.codegen_ai_abstracts import LlmProviderAbstract
+from src.codegen_ai_rate_limits import get_rate_limiter
+from src.codegen_deadlines import (
+    is_expired,
+    get_timeout,
+    get_deadline_exceeded_resultset,
+)
 
 RHYMES_SUCCESS_RESPONSES = ["success", "Success", '成功']
+RHYMES_DEFAULT_BASE_URL = "https://api.rhymes.ai/v1"
+RHYMES_HTTP_POOL_SIZE = 32
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by the Allegro requests, which keeps
+    the connections open between requests
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4,
+                                  pool_maxsize=RHYMES_HTTP_POOL_SIZE)
+            _http_session.mount("http://", adapter)
+            _http_session.mount("https://", adapter)
+        return _http_session
+
+
+def get_rhymes_base_url(env_var_name: str) -> str:
+    """
+    Returns the Rhymes API base URL, allowing to point the providers to
+    other OpenAI-compatible or Allegro-compatible servers (e.g. local stubs)
+    """
+    return os.environ.get(env_var_name, RHYMES_DEFAULT_BASE_URL).rstrip("/")
 
 
 class AriaLlm(LlmProviderAbstract):
@@ -21,23 +62,82 @@ class AriaLlm(LlmProviderAbstract):
     Aria LLM class
     """
     def query(self, prompt: str, question: str,
-              prompt_enhancement_text: str = None) -> dict:
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
         """
         Perform a Aria request
         """
         refined_prompt = None
+        if prompt_enhancement_text and \
+           self.get_prompt_enhancement_mode() == "fused":
+            response = self.fused_query(question, prompt_enhancement_text,
+                                        deadline)
+            if response['error'] or response['fused']:
+                return response
+            # Unparsed answer: if the response had a usable refined
+            # prompt, one more request answers it. Otherwise, the two
+            # calls path (prompt_enhancer, then the answer).
+            if response['refined_prompt']:
+                refined_prompt = prompt = response['refined_prompt']
+                prompt_enhancement_text = None
+
         if prompt_enhancement_text:
             llm_response = self.prompt_enhancer(
-                question, prompt_enhancement_text)
+                question, prompt_enhancement_text, deadline)
             if llm_response['error']:
                 return llm_response
             refined_prompt = llm_response['response']
             prompt = refined_prompt
 
-        model_params = {
+        model_params = self.get_model_params(prompt, question)
+        model_params['deadline'] = deadline
+
+        # Get the OpenAI API response
+        log_debug("aria_query | " +
+                  f"model_params: {model_params}")
+        response = get_openai_api_response(model_params)
+        response['refined_prompt'] = refined_prompt
+
+        log_debug("aria_query | " +
+                  f"response: {response}")
+        return response
+
+    def query_stream(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None,
+                     deadline: float = None):
+        """
+        Perform a Aria request, yielding the answer chunks
+        """
+        refined_prompt = None
+        if prompt_enhancement_text:
+            llm_response = self.prompt_enhancer(
+                question, prompt_enhancement_text, deadline)
+            if llm_response['error']:
+                yield llm_response
+                return
+            refined_prompt = llm_response['response']
+            prompt = refined_prompt
+            yield {"refined_prompt": refined_prompt}
+
+        model_params = self.get_model_params(prompt, question)
+        model_params['deadline'] = deadline
+        for event in get_openai_api_stream(model_params):
+            if "error" in event:
+                event['refined_prompt'] = refined_prompt
+            yield event
+
+    def warm_up(self) -> dict:
+        return warm_up_openai_api(self.get_model_params("", ""))
+
+    def get_model_params(self, prompt: str, question: str) -> dict:
+        """
+        Returns the Aria OpenAI-compatible API request parameters
+        """
+        return {
+            "provider": "rhymes",
             "model": "aria",
             "api_key": os.environ.get("RHYMES_ARIA_API_KEY"),
-            "base_url": "https://api.rhymes.ai/v1",
+            "base_url": get_rhymes_base_url("RHYMES_ARIA_BASE_URL"),
             "stop": ["<|im_end|>"],
             "messages": [
                 {
@@ -50,40 +150,48 @@ class AriaLlm(LlmProviderAbstract):
             # "max_tokens": 2048,
         }
 
-        # Get the OpenAI API response
-        log_debug("aria_query | " +
-                  f"model_params: {model_params}")
-        response = get_openai_api_response(model_params)
-        response['refined_prompt'] = refined_prompt
-
-        log_debug("aria_query | " +
-                  f"response: {response}")
-        return response
-
 
 class AllegroLlm(LlmProviderAbstract):
     """
     Allegro text-to-video LLM class
     """
     def request(self, question: str,
-                prompt_enhancement_text: str = None) -> dict:
+                prompt_enhancement_text: str = None,
+                deadline: float = None) -> dict:
         """
         Perform a Allegro video generation request
         """
-        return self.allegro_request_video(question, prompt_enhancement_text)
+        return self.allegro_request_video(question, prompt_enhancement_text,
+                                          deadline)
 
     def generation_check(
         self,
         request_response: dict,
-        wait_time: int = 60
+        wait_time: int = 60,
+        deadline: float = None,
     ):
         """
         Perform a Allegro video generation request check
         """
-        return self.allegro_check_video_generation(request_response, wait_time)
+        return self.allegro_check_video_generation(request_response, wait_time,
+                                                   deadline)
+
+    def warm_up(self) -> dict:
+        """
+        Open the pooled HTTP connection to the Allegro API
+        """
+        response = get_default_resultset()
+        try:
+            get_http_session().head(
+                get_rhymes_base_url('RHYMES_ALLEGRO_BASE_URL'), timeout=10)
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = str(e)
+        return response
 
     def query(self, prompt: str, question: str,
-              prompt_enhancement_text: str = None) -> dict:
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
         """
         Perform a Aria request
         """
@@ -91,7 +199,7 @@ class AllegroLlm(LlmProviderAbstract):
             "provider": os.environ.get("LLM_PROVIDER"),
         })
         return llm_model.query(prompt, question,
-                               prompt_enhancement_text)
+                               prompt_enhancement_text, deadline)
 
     def allegro_query(self, model_params: dict) -> dict:
         """
@@ -106,7 +214,9 @@ class AllegroLlm(LlmProviderAbstract):
         query = model_params.get("query", {})
         payload = model_params.get("payload", {})
         rhymes_endpoint = model_params.get(
-            "base_url", "https://api.rhymes.ai/v1/generateVideoSyn")
+            "base_url",
+            f"{get_rhymes_base_url('RHYMES_ALLEGRO_BASE_URL')}"
+            "/generateVideoSyn")
 
         query_string = "&".join([f"{key}={value}" for key, value
                                 in query.items()])
@@ -120,19 +230,52 @@ class AllegroLlm(LlmProviderAbstract):
                   f"\nAPI headers: {headers}" +
                   f"\nAPI payload: {payload}"
                   f"\nAPI method: {model_params.get('method', 'POST')}")
+
+        deadline = model_params.get("deadline")
+        if is_expired(deadline):
+            return get_deadline_exceeded_resultset("Allegro request")
+
+        # Wait for the Allegro rate limits, if any
+        rate_limiter = get_rate_limiter("rhymes", "allegro")
+        if not rate_limiter:
+            return self.allegro_http_request(api_url, headers, payload,
+                                             model_params, response)
+        with rate_limiter.limit(1, get_timeout(
+                deadline, rate_limiter.max_wait)) as rate_limit:
+            if rate_limit['error']:
+                return rate_limit
+            response = self.allegro_http_request(api_url, headers, payload,
+                                                 model_params, response)
+            if response.get('status_code') == 429:
+                rate_limiter.pause(1)
+        return response
+
+    def allegro_http_request(self, api_url: str, headers: dict,
+                             payload: dict, model_params: dict,
+                             response: dict) -> dict:
+        """
+        Perform the Allegro API HTTP request
+        """
+        deadline = model_params.get("deadline")
+        if is_expired(deadline):
+            return get_deadline_exceeded_resultset("Allegro request")
         try:
             if model_params.get("method", "POST") == "POST":
-                model_response = requests.post(
+                model_response = get_http_session().post(
                     api_url, headers=headers,
-                    json=payload)
+                    json=payload, timeout=get_timeout(deadline))
             else:
-                model_response = requests.get(api_url, headers=headers)
+                model_response = get_http_session().get(
+                    api_url, headers=headers, timeout=get_timeout(deadline))
         except Exception as e:
+            if is_expired(deadline):
+                return get_deadline_exceeded_resultset("Allegro request")
             response['error'] = True
             response['error_message'] = str(e)
             return response
 
         if model_response.status_code != 200:
+            response['status_code'] = model_response.status_code
             response['error'] = True
             response['error_message'] = \
                 "Request failed with status " \
@@ -145,7 +288,8 @@ class AllegroLlm(LlmProviderAbstract):
         return response
 
     def allegro_request_video(self, question: str,
-                              prompt_enhancement_text: str):
+                              prompt_enhancement_text: str,
+                              deadline: float = None):
         """
         Perform a Allegro video generation request
         """
@@ -153,7 +297,7 @@ class AllegroLlm(LlmProviderAbstract):
 
         if prompt_enhancement_text:
             prompt_enhancer_result = self.prompt_enhancer(
-                question, prompt_enhancement_text)
+                question, prompt_enhancement_text, deadline)
             if prompt_enhancer_result['error']:
                 return prompt_enhancer_result
             refined_prompt = prompt_enhancer_result['response']
@@ -172,7 +316,8 @@ class AllegroLlm(LlmProviderAbstract):
                 "num_step": 50,
                 "rand_seed": rand_seed,
                 "cfg_scale": 7.5,
-            }
+            },
+            "deadline": deadline,
         }
 
         log_debug("allegro_request_video | GENERATE VIDEO | " +
@@ -201,7 +346,8 @@ class AllegroLlm(LlmProviderAbstract):
     def allegro_check_video_generation(
         self,
         allegro_response: dict,
-        wait_time: int = 60
+        wait_time: int = 60,
+        deadline: float = None,
     ):
         """
         Perform a Allegro video generation request check
@@ -212,11 +358,14 @@ class AllegroLlm(LlmProviderAbstract):
 
         model_params = {
             "api_key": os.environ.get("RHYMES_ALLEGRO_API_KEY"),
-            "base_url": 'https://api.rhymes.ai/v1/videoQuery',
+            "base_url":
+                f"{get_rhymes_base_url('RHYMES_ALLEGRO_BASE_URL')}"
+                "/videoQuery",
             "query": {
                 "requestId": request_id,
             },
             "method": "GET",
+            "deadline": deadline,
         }
         log_debug("allegro_check_video_generation | WAIT FOR VIDEO | " +
                   f"model_params: {model_params}")
@@ -233,7 +382,10 @@ class AllegroLlm(LlmProviderAbstract):
                and response["response"].get('data'):
                 video_url = response["response"]['data']
                 break
-            time.sleep(wait_time)
+            if is_expired(deadline):
+                return get_deadline_exceeded_resultset(
+                    "video generation check")
+            time.sleep(get_timeout(deadline, wait_time))
 
         if not video_url:
             response["error"] = True
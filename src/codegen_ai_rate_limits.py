@@ -0,0 +1,235 @@
+"""
+Client-side rate limiting and concurrency control per provider / model
+
+The limits are configured with the LLM_RATE_LIMITS environment variable,
+a JSON object whose keys are "provider/model_name", "provider/*" or "*":
+
+    LLM_RATE_LIMITS='{"rhymes/aria": {"rpm": 60, "tpm": 100000,
+        "concurrency": 4, "max_queue": 100, "max_wait": 120}}'
+
+rpm: requests per minute, tpm: tokens per minute, concurrency: maximum
+requests in flight, max_queue: maximum requests waiting (back-pressure),
+max_wait: maximum seconds waiting for a slot.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from src.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+)
+
+DEFAULT_MAX_WAIT = 120
+DEFAULT_COMPLETION_TOKENS = 512
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at "rate_per_minute", with a one minute burst
+    """
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = float(rate_per_minute) / 60
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait_time(self, amount: float) -> float:
+        """
+        Returns the seconds until "amount" tokens are available
+        """
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """
+        Give back (positive) or take (negative) tokens once the actual
+        usage is known. The bucket can go into debt.
+        """
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class RateLimiter:
+    """
+    Requests and tokens per minute buckets plus a concurrency limit, with
+    a bounded waiting queue
+    """
+    def __init__(self, name: str, rpm: float = None, tpm: float = None,
+                 concurrency: int = None, max_queue: int = None,
+                 max_wait: float = DEFAULT_MAX_WAIT):
+        self.name = name
+        self.requests_bucket = TokenBucket(rpm) if rpm else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm else None
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def get_wait_time(self, tokens: float) -> float:
+        """
+        Returns the seconds until a request with "tokens" can be sent, or
+        0 if it can be sent now. Must be called with the condition held.
+        """
+        wait_time = max(0.0, self.paused_until - time.monotonic())
+        if self.requests_bucket:
+            wait_time = max(wait_time, self.requests_bucket.get_wait_time(1))
+        if self.tokens_bucket:
+            wait_time = max(wait_time,
+                            self.tokens_bucket.get_wait_time(tokens))
+        if self.concurrency and self.in_flight >= self.concurrency:
+            # Woken up by release()
+            wait_time = max(wait_time, self.max_wait)
+        return wait_time
+
+    def acquire(self, tokens: float = 1, max_wait: float = None) -> dict:
+        """
+        Wait for a request slot. Returns an error resultset if the queue
+        is full or the slot isn't available in "max_wait" seconds.
+        """
+        response = get_default_resultset()
+        if max_wait is None:
+            max_wait = self.max_wait
+        deadline = time.monotonic() + max_wait
+        with self.condition:
+            if self.max_queue is not None and \
+               self.waiting >= self.max_queue:
+                response['error'] = True
+                response['error_message'] = \
+                    f"Rate limit queue for {self.name} is full"
+                return response
+            self.waiting += 1
+            try:
+                while True:
+                    wait_time = self.get_wait_time(tokens)
+                    if wait_time <= 0:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        response['error'] = True
+                        response['error_message'] = \
+                            f"Rate limit wait for {self.name} timed out"
+                        return response
+                    self.condition.wait(min(wait_time, remaining))
+                if self.requests_bucket:
+                    self.requests_bucket.consume(1)
+                if self.tokens_bucket:
+                    self.tokens_bucket.consume(tokens)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+        return response
+
+    def release(self, estimated_tokens: float = 1,
+                used_tokens: float = None) -> None:
+        """
+        Release the request slot, adjusting the tokens bucket with the
+        actual usage when it's known
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if self.tokens_bucket and used_tokens is not None:
+                self.tokens_bucket.adjust(estimated_tokens - used_tokens)
+            self.condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop sending requests for some seconds (e.g. after a 429 error)
+        """
+        with self.condition:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+        log_debug(f"RateLimiter | {self.name} paused for {seconds}s")
+
+    @contextmanager
+    def limit(self, tokens: float = 1, max_wait: float = None):
+        """
+        Context manager that yields the acquire() resultset. The slot is
+        released on exit if it was acquired. The "used_tokens" attribute
+        of the resultset can be set to adjust the tokens bucket.
+        """
+        response = self.acquire(tokens, max_wait)
+        try:
+            yield response
+        finally:
+            if not response['error']:
+                self.release(tokens, response.get('used_tokens'))
+
+
+_rate_limiters = {}
+_rate_limits_config = None
+_rate_limiters_lock = threading.Lock()
+
+
+def set_rate_limits(config: dict) -> None:
+    """
+    Set the rate limits configuration, replacing the LLM_RATE_LIMITS one
+    """
+    global _rate_limits_config
+    with _rate_limiters_lock:
+        _rate_limits_config = config or {}
+        _rate_limiters.clear()
+
+
+def get_rate_limits_config() -> dict:
+    global _rate_limits_config
+    if _rate_limits_config is None:
+        try:
+            _rate_limits_config = json.loads(
+                os.environ.get("LLM_RATE_LIMITS") or "{}")
+        except Exception as e:
+            log_debug(f"get_rate_limits_config | Invalid LLM_RATE_LIMITS: {e}")
+            _rate_limits_config = {}
+    return _rate_limits_config
+
+
+def get_rate_limiter(provider: str, model_name: str) -> RateLimiter:
+    """
+    Returns the rate limiter for a provider / model, or None if there are
+    no limits configured for it
+    """
+    with _rate_limiters_lock:
+        config = get_rate_limits_config()
+        for key in [f"{provider}/{model_name}", f"{provider}/*", "*"]:
+            if key in config:
+                break
+        else:
+            return None
+        if key not in _rate_limiters:
+            limits = config[key]
+            _rate_limiters[key] = RateLimiter(
+                key,
+                rpm=limits.get("rpm"),
+                tpm=limits.get("tpm"),
+                concurrency=limits.get("concurrency"),
+                max_queue=limits.get("max_queue"),
+                max_wait=limits.get("max_wait", DEFAULT_MAX_WAIT),
+            )
+        return _rate_limiters[key]
+
+
+def estimate_tokens(messages: list, max_tokens: int = None) -> int:
+    """
+    Returns a rough token estimate of a chat completion request: ~4
+    characters per prompt token plus the expected completion tokens
+    """
+    prompt_chars = sum(len(str(message.get("content", "")))
+                       for message in messages or [])
+    return prompt_chars // 4 + int(max_tokens or DEFAULT_COMPLETION_TOKENS)
@@ -1,9 +1,85 @@
 """
 AI utilities
 """
-from src.codegen_ai_abstracts import LlmProviderAbstract
-from src.codegen_ai_provider_rhymes import AriaLlm, AllegroLlm
-from src.codegen_ai_provider_openai import OpenaiLlm
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+)
+from src.codegen_ai_abstracts import LlmProviderAbstract, llm_single_flight
+from src.codegen_singleflight import get_request_key
+from src.codegen_ai_hedging import hedged_call
+from src.codegen_registry import Registry
+from src.codegen_deadlines import (
+    get_remaining_time,
+    is_deadline_exceeded,
+    get_deadline_exceeded_resultset,
+)
+
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_DELAY = 10
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# Provider implementations, imported on first use (with openai, requests,
+# etc.)
+llm_registry = Registry("LLM provider", "vitexbrain.llm_providers", {
+    "rhymes": "src.codegen_ai_provider_rhymes:AriaLlm",
+    "openai": "src.codegen_ai_provider_openai:OpenaiLlm",
+})
+text_to_video_registry = Registry(
+    "text-to-video provider", "vitexbrain.text_to_video_providers", {
+        "rhymes": "src.codegen_ai_provider_rhymes:AllegroLlm",
+    })
+
+
+def run_many(func, items: list, concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+             on_progress=None) -> list:
+    """
+    Run func(item) for each item in a bounded thread pool. Returns the
+    resultsets in the input order. An exception only affects its own
+    item, which gets an error resultset. on_progress(done, total), if
+    given, is called after each item.
+    """
+    total = len(items)
+    results = [None] * total
+    done = [0]
+    lock = threading.Lock()
+
+    def run_item(index: int):
+        try:
+            result = func(items[index])
+        except Exception as e:
+            result = get_default_resultset()
+            result['error'] = True
+            result['error_message'] = str(e)
+        results[index] = result
+        with lock:
+            done[0] += 1
+            done_count = done[0]
+        log_debug(f"run_many | {done_count}/{total} done")
+        if on_progress:
+            on_progress(done_count, total)
+
+    if total:
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(concurrency, total)),
+                thread_name_prefix="llm_batch") as executor:
+            list(executor.map(run_item, range(total)))
+    return results
+
+
+def get_llm_instance(params: dict) -> LlmProviderAbstract:
+    """
+    Returns the LLM class instance for the params "provider"
+    """
+    try:
+        llm_class = llm_registry.get(params.get("provider"))
+    except LookupError:
+        raise ValueError("Invalid LLM provider")
+    return llm_class(params)
 
 
 class LlmProvider(LlmProviderAbstract):
@@ -12,24 +88,155 @@ class LlmProvider(LlmProviderAbstract):
     """
     def __init__(self, params: str):
         self.params = params
-        self.llm = None
-        if self.params.get("provider") == "rhymes":
-            self.llm = AriaLlm(self.params)
-        elif self.params.get("provider") == "openai":
-            self.llm = OpenaiLlm(self.params)
-        else:
-            raise ValueError("Invalid LLM provider")
+        self.llm = get_llm_instance(self.params)
+        self.init_hedging()
         self.init_llm()
 
+    def init_hedging(self):
+        """
+        Initialize the secondary LLM used to hedge the requests, if
+        "hedge_provider" (or LLM_HEDGE_PROVIDER) is configured
+        """
+        self.hedge_llm = None
+        hedge_provider = self.params.get(
+            "hedge_provider", os.environ.get("LLM_HEDGE_PROVIDER"))
+        if not hedge_provider or \
+           hedge_provider == self.params.get("provider"):
+            return
+        self.hedge_llm = get_llm_instance({
+            "provider": hedge_provider,
+            "model_name": self.params.get(
+                "hedge_model_name", os.environ.get("LLM_HEDGE_MODEL_NAME")),
+        })
+        self.hedge_percentile = float(self.params.get(
+            "hedge_percentile", os.environ.get("LLM_HEDGE_PERCENTILE",
+                                               DEFAULT_HEDGE_PERCENTILE)))
+        self.hedge_delay = float(self.params.get(
+            "hedge_delay", os.environ.get("LLM_HEDGE_DELAY",
+                                          DEFAULT_HEDGE_DELAY)))
+
+    def warm_up(self) -> dict:
+        """
+        Open the connections of the provider, and the hedge provider
+        """
+        response = self.llm.warm_up()
+        if self.hedge_llm:
+            hedge_response = self.hedge_llm.warm_up()
+            if hedge_response['error']:
+                return hedge_response
+        return response
+
+    def get_query_key(self, prompt: str, question: str,
+                      prompt_enhancement_text: str = None) -> str:
+        """
+        Returns the single-flight key of a query request
+        """
+        return get_request_key(
+            "query", self.params.get("provider"),
+            self.params.get("model_name"),
+            self.hedge_llm.provider if self.hedge_llm else None,
+            prompt, question, prompt_enhancement_text)
+
     def query(self, prompt: str, question: str,
-              prompt_enhancement_text: str = None) -> dict:
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
         """
-        Abstract method for querying the LLM
+        Abstract method for querying the LLM. The response "provider"
+        attribute has the provider that served the answer.
+        Identical concurrent queries are sent upstream just once.
         """
-        llm_response = self.llm.query(
-            prompt, question,
-            prompt_enhancement_text)
-        return llm_response
+        try:
+            return llm_single_flight.do(
+                self.get_query_key(prompt, question,
+                                   prompt_enhancement_text),
+                lambda: self.run_query(prompt, question,
+                                       prompt_enhancement_text, deadline),
+                get_remaining_time(deadline), retry=is_deadline_exceeded)
+        except TimeoutError:
+            return get_deadline_exceeded_resultset("LLM query")
+
+    async def query_async(self, prompt: str, question: str,
+                          prompt_enhancement_text: str = None,
+                          deadline: float = None) -> dict:
+        """
+        Async version of query(), sharing the in-flight requests with the
+        sync callers
+        """
+        try:
+            return await llm_single_flight.do_async(
+                self.get_query_key(prompt, question,
+                                   prompt_enhancement_text),
+                lambda: self.run_query(prompt, question,
+                                       prompt_enhancement_text, deadline),
+                get_remaining_time(deadline), retry=is_deadline_exceeded)
+        except TimeoutError:
+            return get_deadline_exceeded_resultset("LLM query")
+
+    def query_stream(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None,
+                     deadline: float = None):
+        """
+        Query the LLM yielding {"delta": text} dicts with the answer
+        chunks ({"refined_prompt": text} first, if the prompt is
+        enhanced), and finally the resultset
+        """
+        for event in self.llm.query_stream(prompt, question,
+                                           prompt_enhancement_text,
+                                           deadline):
+            if "error" in event:
+                event['provider'] = self.params.get("provider")
+            yield event
+
+    def query_many(self, prompts: list,
+                   concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+                   prompt_enhancement_text: str = None,
+                   on_progress=None, deadline: float = None) -> list:
+        """
+        Perform many queries in a bounded thread pool. Each prompt can be
+        a question (sent as is) or a dict with "question" and optionally
+        "prompt" and "prompt_enhancement_text". Returns the resultsets in
+        the input order, each one with its own error attributes. The
+        provider rate limits apply to each query, and the "deadline" to
+        the whole batch.
+        """
+        def query_one(item) -> dict:
+            if not isinstance(item, dict):
+                item = {"question": item}
+            return self.query(
+                item.get("prompt", "{question}"),
+                item["question"],
+                item.get("prompt_enhancement_text",
+                         prompt_enhancement_text),
+                deadline)
+        return run_many(query_one, prompts, concurrency, on_progress)
+
+    def run_query(self, prompt: str, question: str,
+                  prompt_enhancement_text: str = None,
+                  deadline: float = None) -> dict:
+        """
+        Perform the LLM query, hedged if a hedge provider is configured
+        """
+        if not self.hedge_llm:
+            llm_response = self.llm.query(
+                prompt, question,
+                prompt_enhancement_text, deadline)
+            llm_response['provider'] = self.params.get("provider")
+            return llm_response
+        # Enhanced queries make two calls, so their latencies are
+        # tracked apart
+        return hedged_call(
+            (self.params.get("provider"),
+             lambda: self.llm.query(prompt, question,
+                                    prompt_enhancement_text, deadline)),
+            (self.hedge_llm.provider,
+             lambda: self.hedge_llm.query(prompt, question,
+                                          prompt_enhancement_text,
+                                          deadline)),
+            self.hedge_percentile,
+            self.hedge_delay,
+            ":enhanced" if prompt_enhancement_text else "",
+            deadline,
+        )
 
 
 class TextToVideoProvider(LlmProviderAbstract):
@@ -38,37 +245,69 @@ class TextToVideoProvider(LlmProviderAbstract):
     """
     def __init__(self, params: str):
         self.params = params
-        self.llm = None
-        if self.params.get("provider") == "rhymes":
-            self.llm = AllegroLlm(self.params)
-        elif self.params.get("provider") == "openai":
-            raise NotImplementedError
-        else:
+        try:
+            llm_class = text_to_video_registry.get(self.params.get("provider"))
+        except LookupError:
+            if self.params.get("provider") == "openai":
+                raise NotImplementedError
             raise ValueError("Invalid LLM provider")
+        self.llm = llm_class(self.params)
         self.init_llm()
 
+    def warm_up(self) -> dict:
+        return self.llm.warm_up()
+
     def query(self, prompt: str, question: str,
-              prompt_enhancement_text: str = None) -> dict:
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
         """
         Perform a LLM query request
         """
         return self.llm.query(
             prompt, question,
-            prompt_enhancement_text)
+            prompt_enhancement_text, deadline)
 
     def request(self, question: str,
-                prompt_enhancement_text: str = None) -> dict:
+                prompt_enhancement_text: str = None,
+                deadline: float = None) -> dict:
         """
         Perform a video generation request
         """
-        return self.llm.request(question, prompt_enhancement_text)
+        return self.llm.request(question, prompt_enhancement_text, deadline)
 
     def generation_check(
         self,
         request_response: dict,
-        wait_time: int = 60
+        wait_time: int = 60,
+        deadline: float = None,
     ):
         """
         Perform a video generation request check
         """
-        return self.llm.generation_check(request_response, wait_time)
+        return self.llm.generation_check(request_response, wait_time,
+                                         deadline)
+
+    def request_many(self, questions: list,
+                     concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+                     prompt_enhancement_text: str = None,
+                     wait_for_video: bool = False,
+                     wait_time: int = 60,
+                     on_progress=None, deadline: float = None) -> list:
+        """
+        Perform many video generation requests in a bounded thread pool.
+        With "wait_for_video", each request is followed by its generation
+        check, and the resultset has the "video_url". Returns the
+        resultsets in the input order, each one with its own error
+        attributes. The "deadline" applies to the whole batch.
+        """
+        def request_one(question: str) -> dict:
+            response = self.request(question, prompt_enhancement_text,
+                                    deadline)
+            if response['error'] or not wait_for_video:
+                return response
+            check_response = self.generation_check(response, wait_time,
+                                                   deadline)
+            check_response['refined_prompt'] = response.get('refined_prompt')
+            check_response['request_response'] = response
+            return check_response
+        return run_many(request_one, questions, concurrency, on_progress)
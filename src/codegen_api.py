@@ -0,0 +1,575 @@
+"""
+Async HTTP API
+
+Text generation (with optional NDJSON streaming), video generation
+submission and status, and paginated conversations listing over the
+LlmProvider, TextToVideoProvider and CodegenDatabase layers. The
+blocking provider and database calls run in a thread pool, so one
+process serves many concurrent requests.
+"""
+import os
+import hmac
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+from src.codegen_utilities import log_debug, get_default_resultset
+from src.codegen_ai_utilities import LlmProvider, TextToVideoProvider
+from src.codegen_deadlines import get_deadline
+from src.codegen_semantic_cache import (
+    get_semantic_cache,
+    get_semantic_cache_mode,
+)
+
+DEFAULT_API_WORKERS = 100
+DEFAULT_API_VIDEO_WORKERS = 20
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_VIDEO_TASKS = 10000
+
+
+def to_json_value(value):
+    """
+    Returns the JSON representation of the values json.dumps() doesn't
+    serialize, like the conversation records
+    """
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return str(value)
+
+
+class ApiContext:
+    """
+    Resources shared by the API handlers
+    """
+    def __init__(self, params: dict):
+        self.db = params["db"]
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(params.get("workers", DEFAULT_API_WORKERS)),
+            thread_name_prefix="api")
+        # The video generation checks wait for minutes: they have their
+        # own threads, so they can't starve the requests
+        self.video_executor = ThreadPoolExecutor(
+            max_workers=int(params.get("video_workers",
+                                       DEFAULT_API_VIDEO_WORKERS)),
+            thread_name_prefix="api_video")
+        # Required in the "Authorization: Bearer" header, if set
+        self.api_key = params.get("api_key")
+        self.llm_prompt_enhancement_text = \
+            params.get("llm_prompt_enhancement_text")
+        self.video_prompt_enhancement_text = \
+            params.get("video_prompt_enhancement_text")
+        self.video_wait_time = int(params.get("video_wait_time", 60))
+        # Default seconds for a text or video generation (0: no deadline)
+        self.text_timeout = params.get("text_timeout")
+        self.video_timeout = params.get("video_timeout")
+        # Video generation checks running in this process, updated by
+        # the video threads and read by the IOLoop
+        self.video_tasks = OrderedDict()
+        self.video_tasks_lock = threading.Lock()
+        # Process WarmUp, None if it's disabled
+        self.warm_up = params.get("warm_up")
+
+    def set_video_task(self, id: str, status: dict) -> None:
+        with self.video_tasks_lock:
+            self.video_tasks[id] = status
+            self.video_tasks.move_to_end(id)
+            while len(self.video_tasks) > MAX_VIDEO_TASKS:
+                self.video_tasks.popitem(last=False)
+
+    def get_video_task(self, id: str) -> dict:
+        with self.video_tasks_lock:
+            return self.video_tasks.get(id, {})
+
+    def get_llm_model(self) -> LlmProvider:
+        return LlmProvider({
+            "provider": os.environ.get("LLM_PROVIDER"),
+        })
+
+    def get_ttv_model(self) -> TextToVideoProvider:
+        return TextToVideoProvider({
+            "provider": os.environ.get("TEXT_TO_VIDEO_PROVIDER"),
+        })
+
+    def save_conversation(self, type: str, question: str, answer: str,
+                          refined_prompt: str = None,
+                          ttv_response: dict = None, id: str = None,
+                          llm_provider: str = None,
+                          semantic_cache_id: str = None) -> str:
+        """
+        Save the conversation in the database, like the Streamlit app
+        """
+        item = {
+            "type": type,
+            "question": question,
+            "answer": answer,
+            "ttv_response": ttv_response,
+            "refined_prompt": refined_prompt,
+            "llm_provider": llm_provider,
+            "timestamp": time.time(),
+        }
+        if semantic_cache_id:
+            item["semantic_cache_id"] = semantic_cache_id
+        id = self.db.save_item(item, id or str(uuid.uuid4()))
+        semantic_cache = get_semantic_cache()
+        if semantic_cache and type == "text" and answer:
+            semantic_cache.add(id, question)
+        return id
+
+    def find_similar_conversation(self, question: str):
+        """
+        Returns the (ConversationRecord, similarity) of the most similar
+        answered text conversation found by the semantic cache, or None
+        """
+        semantic_cache = get_semantic_cache()
+        if not semantic_cache:
+            return None
+        return semantic_cache.find_conversation(self.db, question)
+
+    def delete_conversation(self, id: str) -> None:
+        self.db.delete_item(id)
+        semantic_cache = get_semantic_cache()
+        if semantic_cache:
+            semantic_cache.remove(id)
+
+
+class BaseApiHandler(tornado.web.RequestHandler):
+    """
+    Base API handler: JSON requests and responses
+    """
+    # The health checks don't need the API key
+    auth_required = True
+
+    def initialize(self, context: ApiContext):
+        self.context = context
+
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json")
+
+    def prepare(self):
+        """
+        Check the API key, if the context has one
+        """
+        if not self.auth_required or not self.context.api_key:
+            return
+        authorization = self.request.headers.get("Authorization", "")
+        scheme, _, api_key = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(
+                api_key.strip().encode("utf-8"),
+                self.context.api_key.encode("utf-8")):
+            raise tornado.web.HTTPError(401, reason="Invalid API key")
+
+    def get_json_body(self) -> dict:
+        if not self.request.body:
+            return {}
+        try:
+            body = json.loads(self.request.body)
+        except Exception:
+            raise tornado.web.HTTPError(400, reason="Invalid JSON body")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Invalid JSON body")
+        return body
+
+    def get_request_deadline(self, body: dict,
+                             default_timeout: float) -> float:
+        """
+        Returns the request deadline from its "timeout" seconds
+        """
+        try:
+            return get_deadline(float(body.get("timeout", default_timeout)
+                                      or 0))
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason="Invalid timeout")
+
+    def write_json(self, data: dict, status: int = 200) -> None:
+        self.set_status(status)
+        self.finish(json.dumps(data, default=to_json_value))
+
+    def write_error(self, status_code: int, **kwargs):
+        self.finish(json.dumps({
+            "error": True,
+            "error_message": self._reason,
+        }))
+
+    async def run_blocking(self, func, *args):
+        """
+        Run a blocking call in the API thread pool
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.context.executor, func, *args)
+
+
+class HealthHandler(BaseApiHandler):
+    """
+    GET /api/health
+    """
+    auth_required = False
+
+    def get(self):
+        self.write_json({"status": "ok"})
+
+
+class ReadyHandler(BaseApiHandler):
+    """
+    GET /api/ready: 503 until the process warm-up is done
+    """
+    auth_required = False
+
+    def get(self):
+        warm_up = self.context.warm_up
+        if warm_up is None:
+            self.write_json({"ready": True, "warm_up": None})
+            return
+        ready = warm_up.is_ready()
+        self.write_json({"ready": ready, "warm_up": warm_up.get_status()},
+                        200 if ready else 503)
+
+
+class TextHandler(BaseApiHandler):
+    """
+    POST /api/text {"question": str, "enhance": bool, "stream": bool,
+                    "save": bool, "timeout": seconds,
+                    "semantic_cache": bool}
+    """
+    def initialize(self, context: ApiContext):
+        super().initialize(context)
+        self.stream_started = False
+
+    async def post(self):
+        try:
+            await self.answer()
+        except Exception as e:
+            if not self.stream_started:
+                raise
+            # The status was sent with the first event: end the stream
+            # with an error event instead
+            log_debug(f"TextHandler.post | ERROR after streaming: {e}")
+            try:
+                await self.write_stream_event({
+                    "error": True,
+                    "error_message": str(e),
+                })
+                self.finish()
+            except StreamClosedError:
+                pass
+
+    async def answer(self):
+        """
+        Answer the question, from the semantic cache or the LLM
+        """
+        body = self.get_json_body()
+        question = body.get("question")
+        if not question:
+            raise tornado.web.HTTPError(400, reason="Missing question")
+        if body.get("semantic_cache", True) and \
+           await self.answer_from_semantic_cache(body, question):
+            return
+        enhancement_text = self.context.llm_prompt_enhancement_text \
+            if body.get("enhance") else None
+        deadline = self.get_request_deadline(body, self.context.text_timeout)
+        llm_model = self.context.get_llm_model()
+        if body.get("stream"):
+            response = await self.stream_answer(
+                llm_model, question, enhancement_text, deadline)
+        else:
+            response = await llm_model.query_async(
+                "{question}", question, enhancement_text, deadline)
+        if not response or response['error']:
+            if not body.get("stream"):
+                self.write_json(response, 502)
+            return
+        if body.get("save", True):
+            response['id'] = await self.run_blocking(
+                lambda: self.context.save_conversation(
+                    type="text",
+                    question=question,
+                    refined_prompt=response.get('refined_prompt'),
+                    answer=response['response'],
+                    llm_provider=response.get('provider'),
+                ))
+        if body.get("stream"):
+            await self.write_stream_event({"id": response.get('id'),
+                                           "done": True})
+            self.finish()
+            return
+        self.write_json(response)
+
+    async def answer_from_semantic_cache(self, body: dict,
+                                         question: str) -> bool:
+        """
+        Answer with a similar question answer, if the semantic cache finds
+        one: in "return" mode it's the response (saved as a new
+        conversation), and in "offer" mode the similar conversation is
+        returned without generating an answer, so the client can resend
+        the question with "semantic_cache": false. Returns False if
+        there's no similar question.
+        """
+        similar = await self.run_blocking(
+            self.context.find_similar_conversation, question)
+        if not similar:
+            return False
+        conversation, similarity = similar
+        semantic_cache = {"id": conversation.id, "similarity": similarity}
+        if get_semantic_cache_mode() == "offer":
+            self.write_json({
+                "error": False,
+                "offered": True,
+                "semantic_cache": semantic_cache,
+                "conversation": conversation,
+            })
+            return True
+        response = get_default_resultset()
+        response.update({
+            "response": conversation.answer,
+            "refined_prompt": conversation.refined_prompt,
+            "provider": conversation.llm_provider,
+            "semantic_cache": semantic_cache,
+        })
+        if body.get("save", True):
+            response['id'] = await self.run_blocking(
+                lambda: self.context.save_conversation(
+                    type="text",
+                    question=question,
+                    refined_prompt=conversation.refined_prompt,
+                    answer=conversation.answer,
+                    llm_provider=conversation.llm_provider,
+                    semantic_cache_id=conversation.id,
+                ))
+        if body.get("stream"):
+            self.set_header("Content-Type", "application/x-ndjson")
+            await self.write_stream_event(response)
+            await self.write_stream_event({"id": response.get('id'),
+                                           "done": True})
+            self.finish()
+            return True
+        self.write_json(response)
+        return True
+
+    async def write_stream_event(self, event: dict) -> None:
+        self.stream_started = True
+        self.write(json.dumps(event, default=str) + "\n")
+        await self.flush()
+
+    async def stream_answer(self, llm_model: LlmProvider, question: str,
+                            enhancement_text: str,
+                            deadline: float = None) -> dict:
+        """
+        Stream the answer chunks as NDJSON. Returns the final resultset,
+        or None if the client disconnected.
+        """
+        self.set_header("Content-Type", "application/x-ndjson")
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        client_gone = [False]
+
+        def produce():
+            try:
+                for event in llm_model.query_stream(
+                        "{question}", question, enhancement_text,
+                        deadline):
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+                    if client_gone[0]:
+                        break
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        producer = loop.run_in_executor(self.context.executor, produce)
+        response = None
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            if "error" in event:
+                response = event
+            try:
+                await self.write_stream_event(event)
+            except StreamClosedError:
+                client_gone[0] = True
+                response = None
+                break
+        await producer
+        if response and response['error']:
+            self.finish()
+        return response
+
+
+class VideoHandler(BaseApiHandler):
+    """
+    POST /api/video {"question": str, "enhance": bool, "timeout": seconds}
+    """
+    async def post(self):
+        body = self.get_json_body()
+        question = body.get("question")
+        if not question:
+            raise tornado.web.HTTPError(400, reason="Missing question")
+        enhancement_text = self.context.video_prompt_enhancement_text \
+            if body.get("enhance") else None
+        deadline = self.get_request_deadline(body,
+                                             self.context.video_timeout)
+        ttv_model = self.context.get_ttv_model()
+        response = await self.run_blocking(
+            ttv_model.request, question, enhancement_text, deadline)
+        if response['error']:
+            self.write_json(response, 502)
+            return
+        video_id = str(uuid.uuid4())
+        ttv_response = response.copy()
+        ttv_response['id'] = video_id
+        # Preliminary conversation with the follow-up data
+        await self.run_blocking(
+            lambda: self.context.save_conversation(
+                type="video",
+                question=question,
+                refined_prompt=ttv_response.get('refined_prompt'),
+                answer=None,
+                ttv_response=ttv_response,
+                id=video_id,
+            ))
+        self.context.set_video_task(video_id, {"status": "processing"})
+        asyncio.get_running_loop().run_in_executor(
+            self.context.video_executor, self.check_video_generation,
+            ttv_model, question, ttv_response, video_id, deadline)
+        self.write_json({"id": video_id, "status": "processing"}, 202)
+
+    def check_video_generation(self, ttv_model: TextToVideoProvider,
+                               question: str, ttv_response: dict,
+                               video_id: str, deadline: float = None) -> None:
+        """
+        Wait for the video in the background and save the result
+        """
+        try:
+            response = ttv_model.generation_check(
+                ttv_response, self.context.video_wait_time, deadline)
+            if response['error'] or not response.get("video_url"):
+                self.context.set_video_task(video_id, {
+                    "status": "error",
+                    "error_message": response['error_message'] or
+                    "No video URL",
+                })
+                return
+            self.context.save_conversation(
+                type="video",
+                question=question,
+                refined_prompt=ttv_response.get('refined_prompt'),
+                answer=response["video_url"],
+                ttv_response=ttv_response,
+                id=video_id,
+            )
+            self.context.set_video_task(video_id, {"status": "done"})
+        except Exception as e:
+            log_debug(f"check_video_generation | ERROR: {e}")
+            self.context.set_video_task(video_id, {
+                "status": "error",
+                "error_message": str(e),
+            })
+
+
+class VideoStatusHandler(BaseApiHandler):
+    """
+    GET /api/video/<id>
+    """
+    async def get(self, id: str):
+        conversation = await self.run_blocking(self.context.db.get_item, id)
+        if not conversation or conversation.type != "video":
+            raise tornado.web.HTTPError(404, reason="Video not found")
+        task = self.context.get_video_task(id)
+        status = {"id": id, "question": conversation.question}
+        if conversation.answer:
+            status.update({"status": "done",
+                           "video_url": conversation.answer})
+        elif task.get("status") == "error":
+            status.update(task)
+        else:
+            status["status"] = "processing"
+        self.write_json(status)
+
+
+class ConversationsHandler(BaseApiHandler):
+    """
+    GET /api/conversations?limit=20&skip=0&type=video
+    """
+    async def get(self):
+        try:
+            limit = min(int(self.get_argument("limit", DEFAULT_PAGE_SIZE)),
+                        MAX_PAGE_SIZE)
+            skip = max(int(self.get_argument("skip", 0)), 0)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Invalid limit or skip")
+        filters = {}
+        if self.get_argument("type", None):
+            filters["type"] = self.get_argument("type")
+        # One extra item to know if there's a next page
+        conversations = await self.run_blocking(
+            self.context.db.get_list, "timestamp", "desc", limit + 1, skip,
+            filters)
+        self.write_json({
+            "conversations": conversations[:limit],
+            "limit": limit,
+            "skip": skip,
+            "has_more": len(conversations) > limit,
+        })
+
+
+class ConversationsSearchHandler(BaseApiHandler):
+    """
+    GET /api/conversations/search?q=tomato&limit=20
+    """
+    async def get(self):
+        text = self.get_argument("q", "").strip()
+        if not text:
+            raise tornado.web.HTTPError(400, reason="Missing q")
+        try:
+            limit = min(int(self.get_argument("limit", DEFAULT_PAGE_SIZE)),
+                        MAX_PAGE_SIZE)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Invalid limit")
+        conversations = await self.run_blocking(
+            self.context.db.search, text, limit)
+        self.write_json({"conversations": conversations, "limit": limit})
+
+
+class ConversationHandler(BaseApiHandler):
+    """
+    GET /api/conversations/<id>
+    DELETE /api/conversations/<id>
+    """
+    async def get(self, id: str):
+        conversation = await self.run_blocking(self.context.db.get_item, id)
+        if not conversation:
+            raise tornado.web.HTTPError(404, reason="Conversation not found")
+        self.write_json(conversation)
+
+    async def delete(self, id: str):
+        await self.run_blocking(self.context.delete_conversation, id)
+        self.write_json({"id": id, "deleted": True})
+
+
+def make_api_app(params: dict) -> tornado.web.Application:
+    """
+    Returns the API tornado application. "params" has the "db"
+    (CodegenDatabase) and optionally "workers", "video_workers" (for the
+    video generation checks), the "api_key", the prompt enhancement
+    texts, "video_wait_time", the default "text_timeout" and
+    "video_timeout" seconds, and the process "warm_up".
+    """
+    context = ApiContext(params)
+    handler_params = {"context": context}
+    return tornado.web.Application([
+        (r"/api/health", HealthHandler, handler_params),
+        (r"/api/ready", ReadyHandler, handler_params),
+        (r"/api/text", TextHandler, handler_params),
+        (r"/api/video", VideoHandler, handler_params),
+        (r"/api/video/([^/]+)", VideoStatusHandler, handler_params),
+        (r"/api/conversations", ConversationsHandler, handler_params),
+        (r"/api/conversations/search", ConversationsSearchHandler,
+         handler_params),
+        (r"/api/conversations/([^/]+)", ConversationHandler,
+         handler_params),
+    ], api_context=context)
@@ -0,0 +1,262 @@
+"""
+Batch text and video generation
+
+Reads the prompts as a stream (one per line: a JSON object or a plain
+question), generates the answers with a bounded number of concurrent
+requests and writes the results as NDJSON in the input order. Only a
+window of prompts is held in memory, whatever the input size.
+"""
+import os
+import json
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+)
+from src.codegen_ai_utilities import LlmProvider, TextToVideoProvider
+from src.codegen_deadlines import get_deadline
+
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_DB_BATCH_SIZE = 50
+DEFAULT_CHECKPOINT_EVERY = 50
+
+
+def iter_prompts(input_stream, default_type: str = "text",
+                 skip_lines: int = 0):
+    """
+    Yields (line_number, prompt) for each non empty input line, skipping
+    the first "skip_lines". Each line is a JSON object with "question" and
+    optionally "type" ("text" or "video"), "enhance", "id" and "timeout"
+    (seconds), or a plain question.
+    """
+    for line_number, line in enumerate(input_stream, start=1):
+        if line_number <= skip_lines:
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                prompt = json.loads(line)
+            except Exception as e:
+                prompt = {"error_message": f"Invalid JSON line: {e}"}
+        else:
+            prompt = {"question": line}
+        prompt.setdefault("type", default_type)
+        yield line_number, prompt
+
+
+class BatchProcessor:
+    """
+    Batch text and video generation processor
+    """
+    def __init__(self, params: dict):
+        self.params = params
+        self.concurrency = int(params.get("concurrency",
+                                          DEFAULT_BATCH_CONCURRENCY))
+        self.db = params.get("db")
+        self.db_batch_size = int(params.get("db_batch_size",
+                                            DEFAULT_DB_BATCH_SIZE))
+        self.checkpoint_path = params.get("checkpoint_path")
+        self.checkpoint_every = int(params.get("checkpoint_every",
+                                               DEFAULT_CHECKPOINT_EVERY))
+        self.enhance = params.get("enhance", False)
+        self.wait_time = params.get("wait_time", 60)
+        # Seconds for each prompt (0 or None: no deadline)
+        self.timeout = params.get("timeout")
+        self.llm_prompt_enhancement_text = \
+            params.get("llm_prompt_enhancement_text")
+        self.video_prompt_enhancement_text = \
+            params.get("video_prompt_enhancement_text")
+        self.llm_model = LlmProvider({
+            "provider": params.get("llm_provider",
+                                   os.environ.get("LLM_PROVIDER")),
+        })
+        self.ttv_model = None
+        self.pending_items = []
+        self.stats = {"processed": 0, "errors": 0}
+
+    def get_ttv_model(self) -> TextToVideoProvider:
+        if not self.ttv_model:
+            self.ttv_model = TextToVideoProvider({
+                "provider": self.params.get(
+                    "ttv_provider",
+                    os.environ.get("TEXT_TO_VIDEO_PROVIDER")),
+            })
+        return self.ttv_model
+
+    def read_checkpoint(self) -> int:
+        """
+        Returns the number of input lines already processed
+        """
+        if not self.checkpoint_path or \
+           not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as f:
+            return json.load(f).get("processed_lines", 0)
+
+    def write_checkpoint(self, processed_lines: int) -> None:
+        if not self.checkpoint_path:
+            return
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "processed_lines": processed_lines,
+                "timestamp": time.time(),
+            }, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def generate_text(self, prompt: dict, deadline: float = None) -> dict:
+        enhance = prompt.get("enhance", self.enhance)
+        response = self.llm_model.query(
+            "{question}", prompt["question"],
+            self.llm_prompt_enhancement_text if enhance else None,
+            deadline)
+        result = {
+            "answer": response.get("response"),
+            "refined_prompt": response.get("refined_prompt"),
+            "llm_provider": response.get("provider"),
+            "ttv_response": None,
+        }
+        return response, result
+
+    def generate_video(self, prompt: dict, deadline: float = None) -> dict:
+        enhance = prompt.get("enhance", self.enhance)
+        ttv_model = self.get_ttv_model()
+        response = ttv_model.request(
+            prompt["question"],
+            self.video_prompt_enhancement_text if enhance else None,
+            deadline)
+        if response['error']:
+            return response, {}
+        ttv_response = response.copy()
+        ttv_response['id'] = prompt["id"]
+        check_response = ttv_model.generation_check(ttv_response,
+                                                    self.wait_time, deadline)
+        result = {
+            "answer": check_response.get("video_url"),
+            "refined_prompt": ttv_response.get("refined_prompt"),
+            "ttv_response": ttv_response,
+        }
+        return check_response, result
+
+    def process_prompt(self, line_number: int, prompt: dict) -> dict:
+        """
+        Generate the answer of one prompt. Returns the output record.
+        """
+        prompt.setdefault("id", str(uuid.uuid4()))
+        record = {
+            "line": line_number,
+            "id": prompt["id"],
+            "type": prompt.get("type"),
+            "question": prompt.get("question"),
+        }
+        response = get_default_resultset()
+        result = {}
+        deadline = get_deadline(prompt.get("timeout", self.timeout))
+        try:
+            if prompt.get("error_message"):
+                response['error'] = True
+                response['error_message'] = prompt["error_message"]
+            elif not prompt.get("question"):
+                response['error'] = True
+                response['error_message'] = "Missing question"
+            elif prompt["type"] == "text":
+                response, result = self.generate_text(prompt, deadline)
+            elif prompt["type"] == "video":
+                response, result = self.generate_video(prompt, deadline)
+            else:
+                response['error'] = True
+                response['error_message'] = \
+                    f"Invalid type: {prompt['type']}"
+        except Exception as e:
+            response = get_default_resultset()
+            response['error'] = True
+            response['error_message'] = str(e)
+        record.update(result)
+        record["timestamp"] = time.time()
+        record["error"] = response['error']
+        record["error_message"] = response['error_message']
+        return record
+
+    def save_record(self, record: dict) -> None:
+        """
+        Queue a successful record to be saved in the database
+        """
+        if not self.db or record["error"]:
+            return
+        item = {
+            "type": record["type"],
+            "question": record["question"],
+            "answer": record.get("answer"),
+            "ttv_response": record.get("ttv_response"),
+            "refined_prompt": record.get("refined_prompt"),
+            "timestamp": record["timestamp"],
+        }
+        if record.get("llm_provider"):
+            item["llm_provider"] = record["llm_provider"]
+        self.pending_items.append((item, record["id"]))
+
+    def flush(self, processed_lines: int) -> None:
+        """
+        Save the queued records and write the checkpoint
+        """
+        if self.pending_items:
+            self.db.save_items(self.pending_items)
+            self.pending_items = []
+        self.write_checkpoint(processed_lines)
+
+    def run(self, input_stream, output_stream) -> dict:
+        """
+        Process the input stream prompts, writing one NDJSON result per
+        prompt in the input order. Resumes from the checkpoint, if any.
+        """
+        skip_lines = self.read_checkpoint()
+        if skip_lines:
+            log_debug(f"BatchProcessor.run | resuming after line {skip_lines}")
+        window = deque()
+        # Bounded window: memory doesn't depend on the input size
+        max_window = self.concurrency * 4
+        last_line = skip_lines
+        since_checkpoint = 0
+
+        def emit(future_and_line) -> None:
+            nonlocal last_line, since_checkpoint
+            future, line_number = future_and_line
+            record = future.result()
+            output_stream.write(json.dumps(record) + "\n")
+            output_stream.flush()
+            self.stats["processed"] += 1
+            if record["error"]:
+                self.stats["errors"] += 1
+            self.save_record(record)
+            last_line = line_number
+            since_checkpoint += 1
+            # The checkpoint is written every "checkpoint_every" lines,
+            # saving the queued records first, even if the database batch
+            # isn't full
+            if len(self.pending_items) >= self.db_batch_size or \
+               since_checkpoint >= self.checkpoint_every:
+                self.flush(last_line)
+                since_checkpoint = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                thread_name_prefix="batch") as executor:
+            for line_number, prompt in iter_prompts(
+                    input_stream, self.params.get("default_type", "text"),
+                    skip_lines):
+                if len(window) >= max_window:
+                    emit(window.popleft())
+                window.append((executor.submit(
+                    self.process_prompt, line_number, prompt), line_number))
+            while window:
+                emit(window.popleft())
+        if self.db:
+            self.flush(last_line)
+        else:
+            self.write_checkpoint(last_line)
+        return self.stats
@@ -1,61 +1,565 @@
 """
 Generic database
 """
-from src.codegen_db_json import JsonFileDatabase
-from src.codegen_db_mongodb import MongoDBDatabase
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from src.codegen_utilities import log_debug
+from src.codegen_registry import Registry
+from src.codegen_db_compression import compress_item
+from src.codegen_db_export import (
+    DEFAULT_IMPORT_BATCH_SIZE,
+    from_ndjson_line,
+    get_item_data,
+    item_matches,
+    merge_items,
+    to_ndjson_line,
+)
+from src.codegen_db_records import (
+    ConversationRecord,
+    ConversationSummary,
+    SUMMARY_FIELDS,
+)
+
+DEFAULT_ITEM_CACHE_SIZE = 256
+DEFAULT_ITEM_CACHE_TTL = 30
+DEFAULT_ARCHIVE_BATCH_SIZE = 500
+DEFAULT_ARCHIVE_INTERVAL = 3600
+DEFAULT_SEARCH_LIMIT = 20
+
+# Database backends by db_type, imported on first use. Each one has a
+# from_config(other_data) class method, and optionally an
+# archive_from_config(other_data) one that returns its cold store.
+db_registry = Registry("db_type", "vitexbrain.databases", {
+    "json": "src.codegen_db_json:JsonFileDatabase",
+    "mongodb": "src.codegen_db_mongodb:MongoDBDatabase",
+})
+
+
+# Shared CodegenDatabase instances by configuration, see init_db_from_env()
+_shared_dbs = {}
+_shared_dbs_lock = threading.Lock()
+
+
+class ItemCache:
+    """
+    Bounded, thread-safe LRU cache of items by id. The entries expire
+    after "ttl" seconds, so the writes made by other processes are seen
+    eventually. A "size" of 0 disables it.
+    """
+    def __init__(self, size: int = DEFAULT_ITEM_CACHE_SIZE,
+                 ttl: float = DEFAULT_ITEM_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        # id -> (expiration time, item)
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id: str):
+        """
+        Returns a copy of the cached record, or None
+        """
+        with self.lock:
+            entry = self.items.get(id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.items[id]
+                self.misses += 1
+                return None
+            self.items.move_to_end(id)
+            self.hits += 1
+            return entry[1].copy()
+
+    def set(self, id: str, item: ConversationRecord) -> None:
+        if not self.size or item is None:
+            return
+        with self.lock:
+            # The copy keeps the fields not read yet compressed
+            self.items[id] = (time.monotonic() + self.ttl, item.copy())
+            self.items.move_to_end(id)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, id: str) -> None:
+        with self.lock:
+            self.items.pop(id, None)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.items),
+                "max_size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
 
 
 class CodegenDatabase:
     """
     Generic database class
     """
-    def __init__(self, db_type, other_data=None):
+    def __init__(self, db_type, other_data=None, item_cache_size=None,
+                 item_cache_ttl=None, mirror_db=None):
         """
-        Initialize the appropriate database based on db_type
+        Initialize the appropriate database based on db_type.
+        The large fields are saved compressed (see
+        codegen_db_compression) and the items are read as
+        ConversationRecord objects (see codegen_db_records).
+        get_item() reads through an item cache of "item_cache_size" items
+        (DB_ITEM_CACHE_SIZE env. var., 0 to disable) for
+        "item_cache_ttl" seconds (DB_ITEM_CACHE_TTL env. var.), updated
+        by the writes made through this instance.
+        With DB_ARCHIVE_MAX_AGE_DAYS and / or DB_ARCHIVE_KEEP_NEWEST, the
+        old items are moved to the backend cold store in the background,
+        at most once each DB_ARCHIVE_INTERVAL seconds.
+        The saves and deletes are also applied to "mirror_db", another
+        CodegenDatabase (dual-write during a migration cutover, see
+        codegen_db_migrate).
         """
         if other_data is None:
             other_data = {}
         self.other_data = other_data
-        self.db = None
-        if db_type == 'json':
-            db_path = self.other_data.get('JSON_DB_PATH')
-            if not db_path:
-                raise ValueError("Invalid JSON_DB_PATH in other_data")
-            self.db = JsonFileDatabase(db_path)
-        elif db_type == 'mongodb':
-            uri = self.other_data.get('MONGODB_URI')
-            db_name = self.other_data.get('MONGODB_DB_NAME')
-            collection_name = self.other_data.get('MONGODB_COLLECTION_NAME')
-            if not uri or not db_name or not collection_name:
-                raise ValueError("Invalid MONGODB_URI, MONGODB_DB_NAME or "
-                                 "MONGODB_COLLECTION_NAME in other_data")
-            self.db = MongoDBDatabase(uri, db_name, collection_name)
-        else:
-            raise ValueError("Invalid db_type. Must be 'json' or 'mongodb'")
+        try:
+            db_class = db_registry.get(db_type)
+        except LookupError:
+            raise ValueError("Invalid db_type. Must be one of: " +
+                             ", ".join(db_registry.get_names()))
+        self.db = db_class.from_config(self.other_data)
+        if item_cache_size is None:
+            item_cache_size = int(os.environ.get("DB_ITEM_CACHE_SIZE",
+                                                 DEFAULT_ITEM_CACHE_SIZE))
+        if item_cache_ttl is None:
+            item_cache_ttl = float(os.environ.get("DB_ITEM_CACHE_TTL",
+                                                  DEFAULT_ITEM_CACHE_TTL))
+        self.item_cache = ItemCache(item_cache_size, item_cache_ttl)
+        self.mirror_db = mirror_db
+        self.init_archive(db_class)
+
+    def init_archive(self, db_class) -> None:
+        """
+        Initialize the archival policy and the cold store. Without a
+        policy, the cold store is only used if it's configured or it
+        already has items (archived before), so the hot store misses
+        don't cost another lookup.
+        """
+        max_age_days = os.environ.get("DB_ARCHIVE_MAX_AGE_DAYS")
+        keep_newest = os.environ.get("DB_ARCHIVE_KEEP_NEWEST")
+        self.archive_max_age_days = float(max_age_days) \
+            if max_age_days else None
+        self.archive_keep_newest = int(keep_newest) if keep_newest else None
+        self.archive_from_config = getattr(db_class, "archive_from_config",
+                                           None)
+        self.cold_db = None
+        if self.archive_from_config:
+            self.cold_db = self.archive_from_config(
+                self.other_data,
+                create=self.archive_max_age_days is not None or
+                self.archive_keep_newest is not None)
+        self.archive_interval = float(os.environ.get(
+            "DB_ARCHIVE_INTERVAL", DEFAULT_ARCHIVE_INTERVAL))
+        self.archive_lock = threading.Lock()
+        self.archive_running = False
+        self.next_archive_time = 0
+
+    def archive_old_items(self, max_age_days: float = None,
+                          keep_newest: int = None,
+                          batch_size: int = DEFAULT_ARCHIVE_BATCH_SIZE
+                          ) -> int:
+        """
+        Move the items older than "max_age_days", or beyond the newest
+        "keep_newest", to the cold store in batches. Each batch is saved
+        in the cold store before it's deleted from the hot one, so the
+        items are always reachable. The items updated in between (their
+        "updated_at" changed, see update_item) aren't deleted from the
+        hot store, and their stale copy is deleted from the cold one: the
+        next batch archives them again. Returns the number of archived
+        items.
+        """
+        if max_age_days is None and keep_newest is None:
+            return 0
+        if self.cold_db is None and self.archive_from_config:
+            self.cold_db = self.archive_from_config(self.other_data,
+                                                    create=True)
+        if self.cold_db is None:
+            return 0
+        cutoff = time.time() - max_age_days * 86400 \
+            if max_age_days is not None else None
+        archived = 0
+        while True:
+            # id -> item, as stored (the compressed fields stay compressed)
+            batch = {}
+            if keep_newest is not None:
+                for item in self.db.get_list("timestamp", "desc",
+                                             batch_size, keep_newest):
+                    batch[item['id']] = item
+            if cutoff is not None and len(batch) < batch_size:
+                for item in self.db.get_list("timestamp", "asc",
+                                             batch_size):
+                    if item.get('timestamp', 0) >= cutoff:
+                        break
+                    batch.setdefault(item['id'], item)
+            if not batch:
+                break
+            self.cold_db.save_items([(get_item_data(item), id)
+                                     for id, item in batch.items()])
+            changed = self.delete_archived_items(batch)
+            for id in changed:
+                self.cold_db.delete_item(id)
+            archived += len(batch) - len(changed)
+            log_debug(f"CodegenDatabase | archived {archived} items")
+        return archived
+
+    def schedule_archival(self) -> None:
+        """
+        Run the configured archival policy in a background thread, if it
+        didn't run in the last DB_ARCHIVE_INTERVAL seconds
+        """
+        if self.archive_max_age_days is None and \
+           self.archive_keep_newest is None:
+            return
+        with self.archive_lock:
+            if self.archive_running or \
+               time.monotonic() < self.next_archive_time:
+                return
+            self.archive_running = True
+            self.next_archive_time = time.monotonic() + self.archive_interval
+
+        def run():
+            try:
+                self.archive_old_items(self.archive_max_age_days,
+                                       self.archive_keep_newest)
+            except Exception as e:
+                log_debug(f"CodegenDatabase | archival error: {e}")
+            finally:
+                with self.archive_lock:
+                    self.archive_running = False
+        threading.Thread(target=run, name="db_archival",
+                         daemon=True).start()
+
+    def get_cache_stats(self) -> dict:
+        """
+        Returns the item cache size, hits, misses, evictions and hit rate
+        """
+        return self.item_cache.get_stats()
+
+    def ping(self):
+        """
+        Connect to the database and check it answers. Raises an exception
+        if it doesn't. Backends without ping() are just skipped.
+        """
+        if hasattr(self.db, "ping"):
+            self.db.ping()
+
+    def get_change_token(self):
+        """
+        Returns a value that changes when the items list changes, so the
+        callers can tell if their copy is stale without reading it. None
+        if the backend doesn't have get_change_token().
+        """
+        if not hasattr(self.db, "get_change_token"):
+            return None
+        return self.db.get_change_token()
+
+    def mirror_write(self, method: str, *args) -> None:
+        """
+        Apply a write to the mirror database, if any. Its errors are
+        logged, not raised, so the mirror never breaks the app: the
+        migration catch-up passes and verify() find the missed writes.
+        """
+        if self.mirror_db is None:
+            return
+        try:
+            getattr(self.mirror_db, method)(*args)
+        except Exception as e:
+            log_debug(f"CodegenDatabase | mirror {method} error: {e}")
 
     def save_item(self, item_data: dict, id: str = None):
         """
         Save the item in the database
         """
-        return self.db.save_item(item_data, id)
+        item = compress_item(item_data)
+        id = self.db.save_item(item, id)
+        self.item_cache.set(id, ConversationRecord.from_dict(item, id))
+        self.mirror_write("save_item", item, id)
+        self.schedule_archival()
+        return id
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def save_items(self, items: list):
         """
-        Returns the items in the database
+        Save many items in one backend write. "items" is a list of
+        (item_data, id) tuples. Returns the ids.
         """
-        return self.db.get_list(sort_attr, sort_order)
+        items = [(compress_item(item_data), id) for item_data, id in items]
+        ids = self.db.save_items(items)
+        for (item, _), id in zip(items, ids):
+            self.item_cache.set(id, ConversationRecord.from_dict(item, id))
+        self.mirror_write("save_items",
+                          [(item, id) for (item, _), id in zip(items, ids)])
+        self.schedule_archival()
+        return ids
+
+    def update_item(self, id: str, data: dict) -> bool:
+        """
+        Set some attributes of an item, keeping the other ones (and its
+        timestamp), so concurrent updates of different attributes don't
+        overwrite each other. The backends without update_item() get a
+        read and a full save instead, which isn't atomic. An archived
+        item is moved back to the hot store with the update. The
+        "updated_at" attribute is set to the update time, for the
+        migration catch-up passes (see codegen_db_migrate). Returns False
+        if the item doesn't exist.
+        """
+        data = compress_item(dict(data, updated_at=time.time()))
+        if hasattr(self.db, "update_item"):
+            updated = self.db.update_item(id, data)
+        else:
+            item = self.db.get_item(id)
+            if item is not None:
+                item.update(data)
+                self.db.save_item(get_item_data(item), id)
+            updated = item is not None
+        if not updated and self.cold_db is not None:
+            item = self.cold_db.get_item(id)
+            if item is not None:
+                item.update(data)
+                # Saved in the hot store before it's deleted from the
+                # cold one, so it's always reachable
+                self.db.save_item(get_item_data(item), id)
+                self.cold_db.delete_item(id)
+                updated = True
+        self.item_cache.invalidate(id)
+        if updated:
+            self.mirror_write("update_item", id, data)
+        return updated
+
+    def get_list(self, sort_attr: str = None, sort_order: str = "desc",
+                 limit: int = None, skip: int = 0, filters: dict = None,
+                 summary: bool = False):
+        """
+        Returns the items in the database as ConversationRecord objects,
+        or ConversationSummary ones with "summary", which are read from
+        the backend with just their summary attributes. "limit" and
+        "skip" allow to get just one page of the sorted items, and
+        "filters" to get only the items whose attributes are equal to
+        the given values. The archived items aren't listed.
+        """
+        if summary:
+            return [ConversationSummary.from_dict(item)
+                    for item in self.db.get_list(
+                        sort_attr, sort_order, limit, skip, filters,
+                        fields=SUMMARY_FIELDS)]
+        return [ConversationRecord.from_dict(item)
+                for item in self.db.get_list(
+                    sort_attr, sort_order, limit, skip, filters)]
 
     def get_item(self, id: str):
         """
-        Returns the item in the database
+        Returns the item in the database, from the item cache if it's
+        there, or from the cold store if it was archived. The callers get
+        their own copy of the item.
         """
-        return self.db.get_item(id)
+        item = self.item_cache.get(id)
+        if item is not None:
+            return item
+        item = self.db.get_item(id)
+        if item is None and self.cold_db is not None:
+            item = self.cold_db.get_item(id)
+        if item is None:
+            return None
+        item = ConversationRecord.from_dict(item, id)
+        self.item_cache.set(id, item)
+        return item
 
     def delete_item(self, id: str):
         """
         Delete an item from the database
         """
-        return self.db.delete_item(id)
+        response = self.db.delete_item(id)
+        if self.cold_db is not None:
+            self.cold_db.delete_item(id)
+        self.item_cache.invalidate(id)
+        self.mirror_write("delete_item", id)
+        return response
+
+    def delete_hot_items(self, ids: list):
+        """
+        Delete many items from the hot store, with one backend write if
+        it has delete_items()
+        """
+        if hasattr(self.db, "delete_items"):
+            return self.db.delete_items(ids)
+        for id in ids:
+            self.db.delete_item(id)
+
+    def delete_archived_items(self, items: dict) -> list:
+        """
+        Delete the archived items (id -> item as read) from the hot store,
+        except the ones updated since they were read, if the backend has
+        delete_unchanged_items(). Returns the ids of the updated ones.
+        """
+        if not hasattr(self.db, "delete_unchanged_items"):
+            self.delete_hot_items(list(items))
+            return []
+        return self.db.delete_unchanged_items({
+            id: item.get('updated_at') for id, item in items.items()})
+
+    def search(self, text: str, limit: int = DEFAULT_SEARCH_LIMIT,
+               include_archive: bool = True):
+        """
+        Returns the newest items whose question contains the text (case
+        insensitive), including the archived ones unless
+        "include_archive" is False
+        """
+        if hasattr(self.db, "search"):
+            items = self.db.search(text, limit)
+        else:
+            text_lower = text.lower()
+            items = [item for item in self.db.get_list("timestamp", "desc")
+                     if text_lower in str(item.get('question', '')).lower()]
+        if include_archive and self.cold_db is not None:
+            hot_ids = {item['id'] for item in items}
+            items += [item for item in self.cold_db.search(text, limit)
+                      if item['id'] not in hot_ids]
+        items.sort(key=lambda item: item.get('timestamp', 0), reverse=True)
+        return [ConversationRecord.from_dict(item) for item in items[:limit]]
+
+    def iter_items(self, filters: dict = None, since: float = None,
+                   until: float = None, after: tuple = None,
+                   include_archive: bool = True):
+        """
+        Yields the items as they are stored (the compressed fields stay
+        compressed) sorted by (timestamp, id), with the archived ones
+        unless "include_archive" is False. "filters" selects the items
+        whose attributes are equal to the given values, "since" and
+        "until" the [since, until) timestamp range, and "after" the
+        items after a (timestamp, id) key, to resume an export.
+        """
+        if hasattr(self.db, "iter_items"):
+            hot_items = self.db.iter_items(filters, since, until, after)
+        else:
+            hot_items = (item for item in self.db.get_list(
+                             "timestamp", "asc", filters=filters)
+                         if item_matches(item, None, since, until, after))
+        if not include_archive or self.cold_db is None:
+            yield from hot_items
+            return
+        yield from merge_items(
+            hot_items,
+            self.cold_db.iter_items(filters, since, until, after))
+
+    def export_ndjson(self, filters: dict = None, since: float = None,
+                      until: float = None, after: tuple = None,
+                      include_archive: bool = True):
+        """
+        Yields the iter_items() items as NDJSON lines, "id" first (see
+        codegen_db_export)
+        """
+        for item in self.iter_items(filters, since, until, after,
+                                    include_archive):
+            yield to_ndjson_line(item)
+
+    def import_ndjson(self, lines, batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+                      skip_lines: int = 0):
+        """
+        Save the items of the NDJSON lines (e.g. an export_ndjson() file)
+        with one save_items() write each "batch_size" items, after
+        skipping the first "skip_lines" lines. Yields the number of lines
+        processed after each write, so the callers can save their
+        progress and resume with "skip_lines". Raises ValueError on the
+        first invalid line, after writing the previous items.
+        """
+        batch = []
+        line_number = 0
+        for line_number, line in enumerate(lines, 1):
+            if line_number <= skip_lines or not line.strip():
+                continue
+            try:
+                batch.append(from_ndjson_line(line))
+            except ValueError as e:
+                if batch:
+                    self.save_items(batch)
+                    yield line_number - 1
+                raise ValueError(f"Invalid line {line_number}: {e}")
+            if len(batch) >= batch_size:
+                self.save_items(batch)
+                batch = []
+                yield line_number
+        if batch:
+            self.save_items(batch)
+        if line_number > skip_lines:
+            yield line_number
+
+
+def get_shared_db(db_type: str, other_data: dict,
+                  mirror: tuple = None) -> CodegenDatabase:
+    """
+    Returns the process CodegenDatabase instance for the configuration,
+    so all its callers share the item cache. "mirror" is the (db_type,
+    other_data) of the database its writes are mirrored to, if any.
+    """
+    mirror_db = get_shared_db(*mirror) if mirror else None
+    key = (db_type, tuple(sorted(other_data.items())),
+           (mirror[0], tuple(sorted(mirror[1].items()))) if mirror else None)
+    with _shared_dbs_lock:
+        if key not in _shared_dbs:
+            _shared_dbs[key] = CodegenDatabase(db_type, other_data,
+                                               mirror_db=mirror_db)
+        return _shared_dbs[key]
+
+
+def get_db_config_from_env(db_type: str,
+                           default_json_db_path: str) -> dict:
+    """
+    Returns the "other_data" of a database type from the JSON_DB_PATH,
+    JSON_ARCHIVE_DIR, MONGODB_URI, MONGODB_DB_NAME,
+    MONGODB_COLLECTION_NAME and MONGODB_ARCHIVE_COLLECTION_NAME
+    environment variables. The plugin backends get all the environment
+    variables.
+    """
+    if db_type == 'json':
+        return {
+            "JSON_DB_PATH": os.getenv('JSON_DB_PATH', default_json_db_path),
+            "JSON_ARCHIVE_DIR": os.getenv('JSON_ARCHIVE_DIR'),
+        }
+    if db_type == 'mongodb':
+        return {
+            "MONGODB_URI": os.getenv('MONGODB_URI'),
+            "MONGODB_DB_NAME": os.getenv('MONGODB_DB_NAME'),
+            "MONGODB_COLLECTION_NAME": os.getenv('MONGODB_COLLECTION_NAME'),
+            "MONGODB_ARCHIVE_COLLECTION_NAME":
+                os.getenv('MONGODB_ARCHIVE_COLLECTION_NAME'),
+        }
+    return dict(os.environ)
+
+
+def init_db_from_env(default_json_db_path: str) -> CodegenDatabase:
+    """
+    Returns the database configured by the DB_TYPE environment variable
+    and the backend ones (see get_db_config_from_env). With
+    DB_MIRROR_TYPE, the writes are also applied to a database of that
+    type (dual-write during a migration cutover). The instance is reused
+    by the next calls with the same configuration.
+    """
+    db_type = os.getenv('DB_TYPE')
+    if not db_type:
+        raise ValueError(f"Invalid DB_TYPE: {db_type}")
+    mirror_type = os.getenv('DB_MIRROR_TYPE')
+    if mirror_type == db_type:
+        raise ValueError("DB_MIRROR_TYPE must be different from DB_TYPE")
+    mirror = (mirror_type, get_db_config_from_env(
+        mirror_type, default_json_db_path)) if mirror_type else None
+    return get_shared_db(
+        db_type, get_db_config_from_env(db_type, default_json_db_path),
+        mirror)
 
 
 # Example usage:
@@ -0,0 +1,165 @@
+"""
+Conversations cold store
+
+The archived conversations of the JSON database are written in batches
+to gzip compressed NDJSON segments (one line per item, "id" first), with
+an index file that maps each id to its segment. The segments are never
+rewritten: a deleted item is just removed from the index, and an item
+archived again points the index to its newest segment.
+"""
+import os
+import gzip
+import json
+import time
+import heapq
+import tempfile
+
+from src.codegen_db_json import get_write_lock
+from src.codegen_db_export import get_export_key, item_matches
+
+INDEX_FILE_NAME = "index.json"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+
+class NdjsonArchive:
+    """
+    Compressed NDJSON segments cold store
+    """
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        self.index_path = os.path.join(archive_dir, INDEX_FILE_NAME)
+        self.write_lock = get_write_lock(self.index_path)
+        # id -> segment file name
+        self.index = {}
+        self.index_token = None
+
+    def get_index(self) -> dict:
+        """
+        Returns the index, read again only if the file changed (e.g.
+        written by another process)
+        """
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return {}
+        token = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if token != self.index_token:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+            self.index_token = token
+        return self.index
+
+    def write_file(self, path: str, write) -> None:
+        """
+        Write a file atomically, calling write(file)
+        """
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=self.archive_dir,
+                                            suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write_index(self, index: dict) -> None:
+        self.write_file(self.index_path,
+                        lambda f: f.write(json.dumps(index).encode("utf-8")))
+
+    def save_items(self, items: list) -> list:
+        """
+        Write the (item_data, id) items to a new segment. Returns the ids.
+        """
+        if not items:
+            return []
+        os.makedirs(self.archive_dir, exist_ok=True)
+        segment = f"{SEGMENT_PREFIX}{time.time_ns()}{SEGMENT_SUFFIX}"
+
+        def write_segment(f):
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                for item_data, id in items:
+                    line = json.dumps({"id": id, **item_data})
+                    gz.write(line.encode("utf-8") + b"\n")
+
+        self.write_file(os.path.join(self.archive_dir, segment),
+                        write_segment)
+        with self.write_lock:
+            index = dict(self.get_index())
+            for _, id in items:
+                index[id] = segment
+            self.write_index(index)
+        return [id for _, id in items]
+
+    def read_segment(self, segment: str):
+        """
+        Yields the raw lines of a segment
+        """
+        with gzip.open(os.path.join(self.archive_dir, segment), 'rt',
+                       encoding="utf-8") as f:
+            yield from f
+
+    def get_item(self, id: str):
+        """
+        Returns the archived item, or None
+        """
+        segment = self.get_index().get(id)
+        if not segment:
+            return None
+        # Only the line of the item is parsed
+        prefix = json.dumps({"id": id})[:-1]
+        for line in self.read_segment(segment):
+            if line.startswith(prefix):
+                return json.loads(line)
+        return None
+
+    def delete_items(self, ids: list):
+        """
+        Remove the items from the index
+        """
+        with self.write_lock:
+            index = dict(self.get_index())
+            deleted = [index.pop(id) for id in ids if id in index]
+            if deleted:
+                self.write_index(index)
+
+    def delete_item(self, id: str):
+        self.delete_items([id])
+
+    def iter_current_items(self):
+        """
+        Yields the archived items, skipping the deleted ones and the
+        older copies
+        """
+        index = self.get_index()
+        for segment in sorted(set(index.values())):
+            for line in self.read_segment(segment):
+                item = json.loads(line)
+                if index.get(item['id']) == segment:
+                    yield item
+
+    def iter_items(self, filters: dict = None, since: float = None,
+                   until: float = None, after: tuple = None):
+        """
+        Yields the archived items matching the filters (see
+        codegen_db_export.item_matches) sorted by (timestamp, id). The
+        segments aren't sorted, so the matching items are sorted in
+        memory.
+        """
+        items = [item for item in self.iter_current_items()
+                 if item_matches(item, filters, since, until, after)]
+        items.sort(key=get_export_key)
+        yield from items
+
+    def search(self, text: str, limit: int = 20):
+        """
+        Returns the newest archived items whose question contains the
+        text (case insensitive). It reads all the segments.
+        """
+        text = text.lower()
+        items = [item for item in self.iter_current_items()
+                 if text in str(item.get('question', '')).lower()]
+        return heapq.nlargest(limit, items,
+                              key=lambda x: x.get('timestamp', 0))
@@ -0,0 +1,101 @@
+"""
+Conversation fields compression
+
+The large conversation fields (the answers and the ttv_response, which
+embeds the full Allegro API responses) are stored compressed, as a marker
+dict that both backends can store:
+
+    {"__compressed__": "zlib", "type": "str" or "json", "data": base64}
+
+The conversation records (see codegen_db_records) decompress a field only
+when it's read. The items stored before the compression, or below the
+size threshold, are read as they are.
+"""
+import os
+import json
+import zlib
+import base64
+
+COMPRESSION_MARKER = "__compressed__"
+COMPRESSED_FIELDS = ("answer", "refined_prompt", "ttv_response")
+DEFAULT_COMPRESSION = "zlib"
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+# Fastest zlib level: most of the size gain, at a fraction of the time
+ZLIB_LEVEL = 1
+
+
+def get_compression_config() -> tuple:
+    """
+    Returns the codec ("none" to disable the compression) and the field
+    size threshold in bytes, from the DB_COMPRESSION and
+    DB_COMPRESSION_MIN_SIZE env. vars.
+    """
+    codec = os.environ.get("DB_COMPRESSION", DEFAULT_COMPRESSION)
+    if codec not in ("zlib", "none"):
+        raise ValueError(f"Invalid DB_COMPRESSION: {codec}")
+    return codec, int(os.environ.get("DB_COMPRESSION_MIN_SIZE",
+                                     DEFAULT_COMPRESSION_MIN_SIZE))
+
+
+def is_compressed(value) -> bool:
+    return isinstance(value, dict) and COMPRESSION_MARKER in value
+
+
+def compress_value(value, codec: str = DEFAULT_COMPRESSION,
+                   min_size: int = DEFAULT_COMPRESSION_MIN_SIZE):
+    """
+    Returns the compressed marker dict of a field value, or the value
+    itself if it's below "min_size" bytes or already compressed
+    """
+    if value is None or codec == "none" or is_compressed(value):
+        return value
+    if isinstance(value, str):
+        value_type = "str"
+        data = value.encode("utf-8")
+    else:
+        value_type = "json"
+        data = json.dumps(value).encode("utf-8")
+    if len(data) < min_size:
+        return value
+    return {
+        COMPRESSION_MARKER: codec,
+        "type": value_type,
+        "data": base64.b64encode(zlib.compress(data, ZLIB_LEVEL))
+        .decode("ascii"),
+    }
+
+
+def decompress_value(value):
+    """
+    Returns the original field value of a compressed marker dict, or the
+    value itself if it isn't compressed
+    """
+    if not is_compressed(value):
+        return value
+    if value[COMPRESSION_MARKER] != "zlib":
+        raise ValueError(
+            f"Invalid compression codec: {value[COMPRESSION_MARKER]}")
+    data = zlib.decompress(base64.b64decode(value["data"])).decode("utf-8")
+    if value.get("type") == "json":
+        return json.loads(data)
+    return data
+
+
+def compress_item(item_data: dict) -> dict:
+    """
+    Returns a copy of the item with its large fields compressed, to be
+    saved in the database
+    """
+    codec, min_size = get_compression_config()
+    if hasattr(item_data, "to_raw_dict"):
+        # A conversation record: the fields that weren't read are saved
+        # without recompressing them
+        item = item_data.to_raw_dict()
+    else:
+        item = dict(item_data)
+    if codec == "none":
+        return item
+    for field in COMPRESSED_FIELDS:
+        if field in item:
+            item[field] = compress_value(item[field], codec, min_size)
+    return item
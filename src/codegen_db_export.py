@@ -0,0 +1,216 @@
+"""
+Conversations NDJSON export and import
+
+The items are exported one JSON object per line, "id" first, ordered by
+(timestamp, id), so an interrupted export can continue after the last
+exported item. The compressed fields are exported as they are stored
+(see codegen_db_compression), so they don't need to be decompressed and
+compressed again on import.
+
+export_to_file() and import_from_file() stream an export file (optionally
+gzip compressed) with a checkpoint file, so an interrupted run resumes
+where it stopped.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import heapq
+
+from src.codegen_utilities import log_debug
+
+DEFAULT_CHECKPOINT_EVERY = 1000
+DEFAULT_IMPORT_BATCH_SIZE = 500
+
+
+def get_export_key(item: dict, id: str = None) -> tuple:
+    """
+    Returns the item sort key in the exports: (timestamp, id). The "id"
+    defaults to the item "id".
+    """
+    return (item.get('timestamp') or 0,
+            str(item['id'] if id is None else id))
+
+
+def get_item_data(item: dict) -> dict:
+    """
+    Returns the item attributes to be saved, without the ids
+    """
+    return {key: value for key, value in item.items()
+            if key not in ("id", "_id")}
+
+
+def item_matches(item: dict, filters: dict = None, since: float = None,
+                 until: float = None, after: tuple = None,
+                 id: str = None) -> bool:
+    """
+    Returns True if the item attributes are equal to the "filters"
+    values, its timestamp is in the [since, until) range and its export
+    key is greater than "after"
+    """
+    if filters and any(item.get(key) != value
+                       for key, value in filters.items()):
+        return False
+    timestamp = item.get('timestamp') or 0
+    if since is not None and timestamp < since:
+        return False
+    if until is not None and timestamp >= until:
+        return False
+    if after is not None and get_export_key(item, id) <= tuple(after):
+        return False
+    return True
+
+
+def merge_items(*sources):
+    """
+    Merge iterables of items sorted by export key, yielding each id once
+    (from the first source that has it, for the same key)
+    """
+    previous_key = None
+    for item in heapq.merge(*sources, key=get_export_key):
+        key = get_export_key(item)
+        if key == previous_key:
+            continue
+        previous_key = key
+        yield item
+
+
+def to_ndjson_line(item: dict) -> str:
+    """
+    Returns the exported line of an item, with its "id" first
+    """
+    item = dict(item)
+    id = item.pop('id')
+    item.pop('_id', None)
+    return json.dumps({"id": id, **item}, default=str) + "\n"
+
+
+def from_ndjson_line(line: str) -> tuple:
+    """
+    Returns the (item_data, id) of an exported line
+    """
+    item = json.loads(line)
+    if not isinstance(item, dict) or not item.get('id'):
+        raise ValueError("Invalid item: it must be an object with an id")
+    id = str(item.pop('id'))
+    return item, id
+
+
+def read_checkpoint(checkpoint_path: str) -> dict:
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    if not checkpoint_path:
+        return
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(checkpoint, timestamp=time.time()), f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def open_input(path: str):
+    """
+    Returns the text stream of an NDJSON file, gzip compressed if its
+    name ends with ".gz", or stdin for "-"
+    """
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt', encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def export_to_file(db, path: str, filters: dict = None,
+                   since: float = None, until: float = None,
+                   include_archive: bool = True, compress: bool = None,
+                   checkpoint_path: str = None,
+                   checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+                   stdout=None) -> int:
+    """
+    Write the CodegenDatabase export_ndjson() lines to a file ("-" for
+    the "stdout" binary stream, default sys.stdout.buffer), gzip
+    compressed with "compress" (default: if its name ends with ".gz").
+    Only "checkpoint_every" lines are held in memory. Each
+    chunk is written as a complete gzip member, and with
+    "checkpoint_path" the file size and the last exported key are saved
+    after each one: running the export again truncates the file to the
+    last checkpoint and resumes after that key. Returns the number of
+    exported items, including the ones of the resumed runs.
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    checkpoint = read_checkpoint(checkpoint_path) \
+        if path != "-" and os.path.exists(path) else {}
+    if checkpoint:
+        log_debug("export_to_file | resuming after "
+                  f"{checkpoint.get('after')}")
+    if path == "-":
+        output_stream = stdout or sys.stdout.buffer
+    else:
+        output_stream = open(path, 'r+b' if checkpoint else 'wb')
+        output_stream.truncate(checkpoint.get("offset", 0))
+        output_stream.seek(checkpoint.get("offset", 0))
+    exported = checkpoint.get("exported", 0)
+    after = checkpoint.get("after")
+    lines = []
+
+    def write_chunk():
+        data = "".join(lines).encode("utf-8")
+        if compress:
+            data = gzip.compress(data)
+        output_stream.write(data)
+        output_stream.flush()
+        lines.clear()
+        if path != "-":
+            write_checkpoint(checkpoint_path, {
+                "after": after,
+                "exported": exported,
+                "offset": output_stream.tell(),
+            })
+
+    try:
+        for item in db.iter_items(filters, since, until, after,
+                                  include_archive):
+            lines.append(to_ndjson_line(item))
+            exported += 1
+            after = get_export_key(item)
+            if len(lines) >= checkpoint_every:
+                write_chunk()
+        if lines or not checkpoint:
+            write_chunk()
+    finally:
+        if path != "-":
+            output_stream.close()
+    return exported
+
+
+def import_from_file(db, path: str,
+                     batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+                     checkpoint_path: str = None) -> int:
+    """
+    Save the items of an export file ("-" for stdin, gzip compressed if
+    its name ends with ".gz") with CodegenDatabase import_ndjson(). With
+    "checkpoint_path", the number of processed lines is saved after each
+    write, and running the import again resumes after them. Returns the
+    number of processed lines.
+    """
+    skip_lines = read_checkpoint(checkpoint_path) \
+        .get("processed_lines", 0)
+    if skip_lines:
+        log_debug(f"import_from_file | resuming after line {skip_lines}")
+    processed_lines = skip_lines
+    input_stream = open_input(path)
+    try:
+        for processed_lines in db.import_ndjson(input_stream, batch_size,
+                                                skip_lines):
+            write_checkpoint(checkpoint_path,
+                             {"processed_lines": processed_lines})
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+    return processed_lines
@@ -4,6 +4,26 @@ JSON file database
 import os
 import json
 import uuid
+import heapq
+import tempfile
+import threading
+
+from src.codegen_db_export import get_export_key, item_matches
+
+# One write lock per database file, shared by all the instances
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+def get_write_lock(db_path: str) -> threading.Lock:
+    """
+    Returns the write lock for a database file
+    """
+    with _write_locks_lock:
+        key = os.path.abspath(db_path)
+        if key not in _write_locks:
+            _write_locks[key] = threading.Lock()
+        return _write_locks[key]
 
 
 class JsonFileDatabase:
@@ -12,46 +32,162 @@ class JsonFileDatabase:
     """
     def __init__(self, db_path):
         self.db_path = db_path
-        self.init_db()
+        self.write_lock = get_write_lock(db_path)
+        # The file is only parsed when it's read, so creating an instance
+        # (e.g. to check the change token) is cheap
+        self.create_db_file()
 
-    def init_db(self):
+    @classmethod
+    def from_config(cls, other_data: dict) -> "JsonFileDatabase":
         """
-        Initialize the JSON file database
+        Returns the database for the CodegenDatabase "other_data"
+        """
+        db_path = other_data.get('JSON_DB_PATH')
+        if not db_path:
+            raise ValueError("Invalid JSON_DB_PATH in other_data")
+        return cls(db_path)
+
+    @classmethod
+    def archive_from_config(cls, other_data: dict, create: bool = False):
+        """
+        Returns the cold store of the archived items: compressed NDJSON
+        segments in JSON_ARCHIVE_DIR (by default, the "archive" directory
+        next to the JSON file). Returns None if it's not configured and
+        doesn't exist, unless "create" (the archival is enabled).
+        """
+        from src.codegen_db_archive import NdjsonArchive
+        archive_dir = other_data.get('JSON_ARCHIVE_DIR') or os.path.join(
+            os.path.dirname(os.path.abspath(other_data['JSON_DB_PATH'])),
+            "archive")
+        if not create and not other_data.get('JSON_ARCHIVE_DIR') and \
+           not os.path.isdir(archive_dir):
+            return None
+        return NdjsonArchive(archive_dir)
+
+    def create_db_file(self):
+        """
+        Create the JSON file database, if it doesn't exist
         """
         if not os.path.exists(self.db_path):
             with open(self.db_path, 'w') as f:
                 json.dump({}, f)
 
+    def init_db(self):
+        """
+        Initialize the JSON file database
+        """
+        self.create_db_file()
         with open(self.db_path) as f:
             json_db = json.load(f)
 
         return json_db
 
+    def ping(self):
+        """
+        Check the JSON file can be read
+        """
+        self.init_db()
+
+    def get_change_token(self):
+        """
+        Returns a value that changes on each write: the file inode (the
+        writes replace the file), modification time and size
+        """
+        self.create_db_file()
+        stat = os.stat(self.db_path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def write_db(self, json_db: dict):
+        """
+        Write the JSON file database atomically, so the readers never get
+        a partially written file
+        """
+        db_dir = os.path.dirname(os.path.abspath(self.db_path))
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=db_dir, suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, 'w') as f:
+                json.dump(json_db, f)
+            os.replace(tmp_path, self.db_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
     def save_item(self, item_data: dict, id: str = None):
         """
         Save the item in the database
         """
         if not id:
             id = str(uuid.uuid4())
-        json_db = self.init_db()
-        json_db[id] = dict(item_data)
-        with open(self.db_path, 'w') as f:
-            json.dump(json_db, f)
+        with self.write_lock:
+            json_db = self.init_db()
+            json_db[id] = dict(item_data)
+            self.write_db(json_db)
         return id
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def save_items(self, items: list):
+        """
+        Save many (item_data, id) items with one file rewrite
+        """
+        ids = []
+        with self.write_lock:
+            json_db = self.init_db()
+            for item_data, id in items:
+                if not id:
+                    id = str(uuid.uuid4())
+                json_db[id] = dict(item_data)
+                ids.append(id)
+            self.write_db(json_db)
+        return ids
+
+    def update_item(self, id: str, data: dict) -> bool:
         """
-        Returns the items in the database
+        Set some attributes of an item, keeping the other ones, under the
+        file write lock. Returns False if the item doesn't exist.
+        """
+        with self.write_lock:
+            json_db = self.init_db()
+            if id not in json_db:
+                return False
+            json_db[id].update(data)
+            self.write_db(json_db)
+        return True
+
+    def get_list(self, sort_attr: str = None, sort_order: str = "desc",
+                 limit: int = None, skip: int = 0, filters: dict = None,
+                 fields: list = None):
+        """
+        Returns the items in the database. "limit" and "skip" allow to
+        get just one page of the sorted items, "filters" to get only
+        the items whose attributes are equal to the given values, and
+        "fields" to get only those attributes (and the id)
         """
         json_db = self.init_db()
+        entries = json_db.items()
+        if filters:
+            entries = [(id, item) for id, item in entries
+                       if all(item.get(key) == value
+                              for key, value in filters.items())]
+        if sort_attr:
+            if limit:
+                # Partial sort: only the first skip + limit items are needed
+                select = heapq.nlargest if sort_order == "desc" \
+                    else heapq.nsmallest
+                entries = select(skip + limit, entries,
+                                 key=lambda x: x[1][sort_attr])
+            else:
+                entries = sorted(entries, key=lambda x: x[1][sort_attr],
+                                 reverse=sort_order == "desc")
+        entries = list(entries)[skip:(skip + limit) if limit else None]
         items = []
-        for id, item in json_db.items():
-            item_to_append = item.copy()
+        for id, item in entries:
+            if fields:
+                item_to_append = {field: item[field] for field in fields
+                                  if field in item}
+            else:
+                item_to_append = item.copy()
             item_to_append['id'] = id
             items.append(item_to_append)
-        if sort_attr:
-            items = sorted(items, key=lambda x: x[sort_attr],
-                           reverse=sort_order == "desc")
         return items
 
     def get_item(self, id: str):
@@ -69,8 +205,62 @@ class JsonFileDatabase:
         """
         Delete a item from the database
         """
+        with self.write_lock:
+            json_db = self.init_db()
+            if id in json_db:
+                del json_db[id]
+                self.write_db(json_db)
+
+    def delete_items(self, ids: list):
+        """
+        Delete many items with one file rewrite
+        """
+        with self.write_lock:
+            json_db = self.init_db()
+            deleted = [json_db.pop(id) for id in ids if id in json_db]
+            if deleted:
+                self.write_db(json_db)
+
+    def delete_unchanged_items(self, updated_at: dict) -> list:
+        """
+        Delete the items whose "updated_at" attribute is still the one in
+        "updated_at" (id -> value, None if it wasn't set), with one file
+        rewrite. Returns the ids of the items that changed, not deleted.
+        """
+        with self.write_lock:
+            json_db = self.init_db()
+            changed = [id for id, value in updated_at.items()
+                       if id in json_db and
+                       json_db[id].get('updated_at') != value]
+            deleted = [json_db.pop(id) for id in updated_at
+                       if id in json_db and id not in changed]
+            if deleted:
+                self.write_db(json_db)
+        return changed
+
+    def iter_items(self, filters: dict = None, since: float = None,
+                   until: float = None, after: tuple = None):
+        """
+        Yields the items matching the filters (see
+        codegen_db_export.item_matches) sorted by (timestamp, id). The
+        whole file is read, as for the other operations.
+        """
         json_db = self.init_db()
-        if id in json_db:
-            del json_db[id]
-            with open(self.db_path, 'w') as f:
-                json.dump(json_db, f)
+        keys = sorted(get_export_key(item, id)
+                      for id, item in json_db.items()
+                      if item_matches(item, filters, since, until, after,
+                                      id))
+        for _, id in keys:
+            yield dict(json_db[id], id=id)
+
+    def search(self, text: str, limit: int = 20):
+        """
+        Returns the newest items whose question contains the text (case
+        insensitive)
+        """
+        text = text.lower()
+        entries = [(id, item) for id, item in self.init_db().items()
+                   if text in str(item.get('question', '')).lower()]
+        entries = heapq.nlargest(limit, entries,
+                                 key=lambda x: x[1].get('timestamp', 0))
+        return [dict(item, id=id) for id, item in entries]
@@ -0,0 +1,251 @@
+"""
+Database migration between backends
+
+DatabaseMigration copies the conversations of a source CodegenDatabase
+(with its archived ones) to a target one, e.g. from the JSON file
+database to MongoDB, streaming them in (timestamp, id) order (see
+codegen_db_export) and saving them in parallel save_items() batches.
+
+Each pass continues after the last migrated (timestamp, id) key, saved
+in the checkpoint file, so running it again is an incremental catch-up
+pass that copies only the conversations created since, and the ones
+updated since the previous pass started (their "updated_at" attribute,
+set by CodegenDatabase.update_item(), e.g. the video URL or poster).
+The conversations deleted from the source aren't deleted from the
+target: verify() reports them as "extra". verify() compares both
+databases, item by item, in one streaming pass.
+
+For a near zero downtime cutover:
+    1. Migrate (with the app running).
+    2. Set DB_MIRROR_TYPE to the target type, so the app writes to both
+       databases (see CodegenDatabase "mirror_db"), and run a catch-up
+       pass for the conversations created in between.
+    3. Verify, switch DB_TYPE to the target, and remove DB_MIRROR_TYPE
+       (or set it to the old type, to keep it as a fallback).
+"""
+import json
+import time
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.codegen_utilities import log_debug
+from src.codegen_db_compression import decompress_value
+from src.codegen_db_export import (
+    get_export_key,
+    get_item_data,
+    read_checkpoint,
+    write_checkpoint,
+)
+
+DEFAULT_MIGRATION_BATCH_SIZE = 500
+DEFAULT_MIGRATION_WORKERS = 4
+DEFAULT_MAX_PASSES = 3
+# Seconds subtracted from the pass start time when looking for updated
+# items, for the clock differences between the app and the migration
+UPDATED_SINCE_MARGIN = 60
+# Mismatching ids reported by verify()
+MAX_REPORTED_MISMATCHES = 20
+
+
+def get_item_checksum(item: dict) -> str:
+    """
+    Returns the SHA-256 of the item attributes, with the compressed
+    fields decompressed, so it doesn't depend on the backend or on the
+    compression settings
+    """
+    data = {key: decompress_value(value)
+            for key, value in get_item_data(item).items()}
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class DatabaseMigration:
+    """
+    Source to target CodegenDatabase migration
+    """
+    def __init__(self, source_db, target_db, params: dict = None):
+        params = params or {}
+        self.source_db = source_db
+        self.target_db = target_db
+        self.batch_size = int(params.get("batch_size",
+                                         DEFAULT_MIGRATION_BATCH_SIZE))
+        self.workers = int(params.get("workers",
+                                      DEFAULT_MIGRATION_WORKERS))
+        self.include_archive = params.get("include_archive", True)
+        self.checkpoint_path = params.get("checkpoint_path")
+
+    def iter_pass_items(self, after: tuple, updated_since: float):
+        """
+        Yields the (item, checkpoint key, updated) of a pass: the source
+        items up to the "after" key updated since "updated_since"
+        (checkpointed as "after", since they are before it), then the
+        items after it
+        """
+        if after is not None and updated_since is not None:
+            after = tuple(after)
+            for item in self.source_db.iter_items(
+                    include_archive=self.include_archive):
+                if get_export_key(item) > after:
+                    break
+                if (item.get('updated_at') or 0) >= updated_since:
+                    yield item, after, True
+        for item in self.source_db.iter_items(
+                after=after, include_archive=self.include_archive):
+            yield item, get_export_key(item), False
+
+    def run_pass(self) -> dict:
+        """
+        Copy the source items after the checkpoint key, and the ones
+        updated since the previous pass started, to the target, in
+        batches of "batch_size" saved by "workers" threads. Only
+        "workers" * 2 batches are held in memory. The checkpoint is
+        written when all the batches up to a key are saved, so an
+        interrupted pass resumes without gaps (the batches saved after
+        it are saved again, with the same ids). Returns the number of
+        migrated items, of updated items copied again and the last
+        migrated key.
+        """
+        checkpoint = read_checkpoint(self.checkpoint_path)
+        after = checkpoint.get("after")
+        updated_since = checkpoint.get("updated_since")
+        migrated = checkpoint.get("migrated", 0)
+        stats = {"migrated": 0, "updated": 0, "batches": 0,
+                 "after": after}
+        started = time.monotonic()
+        pass_started = time.time()
+        # (future, new items, updated items, last key of the batch), in
+        # the items order
+        pending = deque()
+
+        def complete_first() -> None:
+            nonlocal migrated
+            future, size, updated, last_key = pending.popleft()
+            future.result()
+            migrated += size
+            stats["migrated"] += size
+            stats["updated"] += updated
+            stats["batches"] += 1
+            stats["after"] = last_key
+            write_checkpoint(self.checkpoint_path, {
+                "after": last_key,
+                "migrated": migrated,
+                "updated_since": updated_since,
+            })
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            batch = []
+            batch_updated = 0
+            last_key = None
+            for item, last_key, updated in self.iter_pass_items(
+                    after, updated_since):
+                batch.append((get_item_data(item), str(item['id'])))
+                batch_updated += updated
+                if len(batch) < self.batch_size:
+                    continue
+                pending.append((executor.submit(self.target_db.save_items,
+                                                batch),
+                                len(batch) - batch_updated, batch_updated,
+                                last_key))
+                batch = []
+                batch_updated = 0
+                while pending and (len(pending) >= self.workers * 2 or
+                                   pending[0][0].done()):
+                    complete_first()
+            if batch:
+                pending.append((executor.submit(self.target_db.save_items,
+                                                batch),
+                                len(batch) - batch_updated, batch_updated,
+                                last_key))
+            while pending:
+                complete_first()
+        # The next pass copies the items updated since this one started
+        write_checkpoint(self.checkpoint_path, {
+            "after": stats["after"],
+            "migrated": migrated,
+            "updated_since": pass_started - UPDATED_SINCE_MARGIN,
+        })
+        stats["total_migrated"] = migrated
+        stats["elapsed"] = round(time.monotonic() - started, 3)
+        log_debug(f"DatabaseMigration.run_pass | {stats}")
+        return stats
+
+    def run(self, max_passes: int = DEFAULT_MAX_PASSES) -> list:
+        """
+        Run catch-up passes until one doesn't find new items, or
+        "max_passes" passes. Returns the stats of each pass.
+        """
+        passes = []
+        for _ in range(max_passes):
+            stats = self.run_pass()
+            passes.append(stats)
+            if not stats["migrated"]:
+                break
+        return passes
+
+    def verify(self) -> dict:
+        """
+        Compare the source and target items, walking both in (timestamp,
+        id) order. Returns the counts, the source and target checksums
+        (of all the items checksums, in order), and the ids missing in
+        the target, only in the target or different (at most
+        MAX_REPORTED_MISMATCHES each, with their counts). "ok" is True if
+        both have the same items.
+        """
+        source_items = self.source_db.iter_items(
+            include_archive=self.include_archive)
+        target_items = self.target_db.iter_items(
+            include_archive=self.include_archive)
+        source_hash = hashlib.sha256()
+        target_hash = hashlib.sha256()
+        result = {
+            "source_count": 0,
+            "target_count": 0,
+            "missing": [],
+            "missing_count": 0,
+            "extra": [],
+            "extra_count": 0,
+            "different": [],
+            "different_count": 0,
+        }
+
+        def add_mismatch(kind: str, id: str) -> None:
+            if len(result[kind]) < MAX_REPORTED_MISMATCHES:
+                result[kind].append(id)
+            result[f"{kind}_count"] += 1
+
+        def next_entry(items, items_hash, count_key):
+            item = next(items, None)
+            if item is None:
+                return None
+            result[count_key] += 1
+            checksum = get_item_checksum(item)
+            items_hash.update(f"{item['id']}:{checksum}\n".encode("utf-8"))
+            return get_export_key(item), checksum
+
+        source = next_entry(source_items, source_hash, "source_count")
+        target = next_entry(target_items, target_hash, "target_count")
+        while source is not None or target is not None:
+            if target is None or \
+               (source is not None and source[0] < target[0]):
+                add_mismatch("missing", source[0][1])
+                source = next_entry(source_items, source_hash,
+                                    "source_count")
+            elif source is None or target[0] < source[0]:
+                add_mismatch("extra", target[0][1])
+                target = next_entry(target_items, target_hash,
+                                    "target_count")
+            else:
+                if source[1] != target[1]:
+                    add_mismatch("different", source[0][1])
+                source = next_entry(source_items, source_hash,
+                                    "source_count")
+                target = next_entry(target_items, target_hash,
+                                    "target_count")
+        result["source_checksum"] = source_hash.hexdigest()
+        result["target_checksum"] = target_hash.hexdigest()
+        result["ok"] = result["source_checksum"] == \
+            result["target_checksum"]
+        log_debug(f"DatabaseMigration.verify | ok: {result['ok']}")
+        return result
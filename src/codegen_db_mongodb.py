@@ -1,19 +1,94 @@
 """
 MongoDB database
 """
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
+import re
+import threading
 import uuid
 
+# One client (and connection pool) per URI, shared by all the instances
+_mongo_clients = {}
+_mongo_clients_lock = threading.Lock()
+
+
+def get_mongo_client(uri: str) -> MongoClient:
+    """
+    Returns the MongoDB client for the URI
+    """
+    with _mongo_clients_lock:
+        if uri not in _mongo_clients:
+            _mongo_clients[uri] = MongoClient(uri)
+        return _mongo_clients[uri]
+
 
 class MongoDBDatabase:
     """
     MongoDB database class
     """
     def __init__(self, uri, db_name, collection_name):
-        self.client = MongoClient(uri)
+        self.client = get_mongo_client(uri)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
 
+    @classmethod
+    def from_config(cls, other_data: dict) -> "MongoDBDatabase":
+        """
+        Returns the database for the CodegenDatabase "other_data"
+        """
+        uri = other_data.get('MONGODB_URI')
+        db_name = other_data.get('MONGODB_DB_NAME')
+        collection_name = other_data.get('MONGODB_COLLECTION_NAME')
+        if not uri or not db_name or not collection_name:
+            raise ValueError("Invalid MONGODB_URI, MONGODB_DB_NAME or "
+                             "MONGODB_COLLECTION_NAME in other_data")
+        return cls(uri, db_name, collection_name)
+
+    @classmethod
+    def archive_from_config(cls, other_data: dict,
+                            create: bool = False) -> "MongoDBDatabase":
+        """
+        Returns the cold store of the archived items: another collection
+        (MONGODB_ARCHIVE_COLLECTION_NAME, by default the collection name
+        with "_archive"). Returns None if it's not configured and doesn't
+        exist, unless "create" (the archival is enabled), so the hot
+        store misses don't cost another round trip.
+        """
+        configured_name = other_data.get('MONGODB_ARCHIVE_COLLECTION_NAME')
+        archive = cls(other_data.get('MONGODB_URI'),
+                      other_data.get('MONGODB_DB_NAME'),
+                      configured_name or
+                      f"{other_data.get('MONGODB_COLLECTION_NAME')}_archive")
+        if create or configured_name or archive.exists():
+            return archive
+        return None
+
+    def exists(self) -> bool:
+        """
+        Returns True if the collection exists. If the server can't tell,
+        it's assumed to exist.
+        """
+        try:
+            return bool(self.db.list_collection_names(
+                filter={"name": self.collection.name}))
+        except Exception:
+            return True
+
+    def ping(self):
+        """
+        Connect to the MongoDB server and check it answers
+        """
+        self.client.admin.command("ping")
+
+    def get_change_token(self):
+        """
+        Returns a value that changes when items are added or deleted: the
+        collection document count and newest timestamp
+        """
+        newest = self.collection.find_one(
+            {}, {"timestamp": 1}, sort=[("timestamp", -1)])
+        return (self.collection.estimated_document_count(),
+                newest.get("timestamp") if newest else None)
+
     def save_item(self, item_data: dict, id: str = None):
         """
         Save the item in the MongoDB collection
@@ -24,15 +99,49 @@ class MongoDBDatabase:
         self.collection.replace_one({'_id': id}, item_data, upsert=True)
         return id
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def save_items(self, items: list):
         """
-        Returns the items in the MongoDB collection
+        Save many (item_data, id) items with one bulk write
+        """
+        ids = []
+        operations = []
+        for item_data, id in items:
+            if not id:
+                id = str(uuid.uuid4())
+            item_data['_id'] = id
+            operations.append(ReplaceOne({'_id': id}, item_data, upsert=True))
+            ids.append(id)
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return ids
+
+    def update_item(self, id: str, data: dict) -> bool:
+        """
+        Set some attributes of an item with one atomic $set, keeping the
+        other ones. Returns False if the item doesn't exist.
+        """
+        result = self.collection.update_one({'_id': id}, {'$set': data})
+        return result.matched_count > 0
+
+    def get_list(self, sort_attr: str = None, sort_order: str = "desc",
+                 limit: int = None, skip: int = 0, filters: dict = None,
+                 fields: list = None):
+        """
+        Returns the items in the MongoDB collection. "limit" and "skip"
+        allow to get just one page of the sorted items, "filters" to get
+        only the items whose attributes are equal to the given values, and
+        "fields" to get only those attributes (and the id)
         """
         sort_order = -1 if sort_order == "desc" else 1
+        cursor = self.collection.find(filters or {},
+                                      list(fields) if fields else None)
         if sort_attr:
-            items = list(self.collection.find().sort(sort_attr, sort_order))
-        else:
-            items = list(self.collection.find())
+            cursor = cursor.sort(sort_attr, sort_order)
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        items = list(cursor)
         # Assign id from _id field
         for item in items:
             item['id'] = str(item['_id'])  # Convert ObjectId to str
@@ -54,6 +163,69 @@ class MongoDBDatabase:
         """
         self.collection.delete_one({'_id': id})
 
+    def delete_items(self, ids: list):
+        """
+        Delete many items with one request
+        """
+        if ids:
+            self.collection.delete_many({'_id': {'$in': list(ids)}})
+
+    def delete_unchanged_items(self, updated_at: dict) -> list:
+        """
+        Delete the items whose "updated_at" attribute is still the one in
+        "updated_at" (id -> value, None if it wasn't set), each one
+        checked atomically by the delete filter. Returns the ids of the
+        items that changed, not deleted.
+        """
+        if not updated_at:
+            return []
+        self.collection.delete_many({'$or': [
+            {'_id': id, 'updated_at': value}
+            for id, value in updated_at.items()]})
+        return [item['_id'] for item in self.collection.find(
+            {'_id': {'$in': list(updated_at)}}, {'_id': 1})]
+
+    def iter_items(self, filters: dict = None, since: float = None,
+                   until: float = None, after: tuple = None,
+                   batch_size: int = 1000):
+        """
+        Yields the items matching the filters (see
+        codegen_db_export.item_matches) sorted by (timestamp, _id), read
+        from the server in batches of "batch_size"
+        """
+        query = dict(filters or {})
+        timestamp_range = {}
+        if since is not None:
+            timestamp_range["$gte"] = since
+        if until is not None:
+            timestamp_range["$lt"] = until
+        if timestamp_range:
+            query["timestamp"] = timestamp_range
+        if after is not None:
+            after_timestamp, after_id = after
+            query = {"$and": [query, {"$or": [
+                {"timestamp": {"$gt": after_timestamp}},
+                {"timestamp": after_timestamp, "_id": {"$gt": after_id}},
+            ]}]}
+        cursor = self.collection.find(query) \
+            .sort([("timestamp", 1), ("_id", 1)]).batch_size(batch_size)
+        for item in cursor:
+            item['id'] = str(item['_id'])
+            yield item
+
+    def search(self, text: str, limit: int = 20):
+        """
+        Returns the newest items whose question contains the text (case
+        insensitive)
+        """
+        cursor = self.collection.find({
+            "question": {"$regex": re.escape(text), "$options": "i"},
+        }).sort("timestamp", -1).limit(limit)
+        items = list(cursor)
+        for item in items:
+            item['id'] = str(item['_id'])
+        return items
+
 
 # Example usage:
 # db = MongoDBDatabase(
@@ -0,0 +1,174 @@
+"""
+Conversation records
+
+CodegenDatabase returns the conversations as ConversationRecord objects,
+and the listings as ConversationSummary ones, with just the attributes
+the side bar needs. Both use __slots__, so each one takes a fraction of
+the memory of the equivalent dict, and compute "date_time" when it's
+read instead of storing it.
+
+They also support the dict style access (conversation['question'],
+conversation.get('poster')) and to_dict(), for the API responses and the
+existing callers. The compressed fields (see codegen_db_compression) are
+decompressed when they are read.
+"""
+from src.codegen_utilities import get_date_time
+from src.codegen_db_compression import decompress_value
+
+SUMMARY_FIELDS = ("type", "question", "timestamp")
+RECORD_FIELDS = SUMMARY_FIELDS + (
+    "answer", "refined_prompt", "ttv_response", "llm_provider", "poster",
+    "video_cache_key")
+# Stored as they are read from the database, decompressed on first read
+LAZY_FIELDS = ("answer", "refined_prompt", "ttv_response")
+
+
+class ConversationSummary:
+    """
+    Conversation attributes shown in the listings
+    """
+    __slots__ = ("id", "type", "question", "timestamp")
+
+    fields = SUMMARY_FIELDS
+
+    def __init__(self, id: str = None, data: dict = None):
+        data = data or {}
+        self.id = id
+        for field in self.fields:
+            setattr(self, field, data.get(field))
+
+    @classmethod
+    def from_dict(cls, data: dict, id: str = None):
+        """
+        Returns the record of a database item. The "id" defaults to the
+        item "id" or "_id".
+        """
+        if id is None:
+            id = data.get('id', data.get('_id'))
+        return cls(None if id is None else str(id), data)
+
+    @property
+    def date_time(self) -> str:
+        return get_date_time(self.timestamp) \
+            if self.timestamp is not None else None
+
+    def keys(self) -> list:
+        return ["id"] + list(self.fields)
+
+    def __getitem__(self, key: str):
+        if key == "date_time" or key in self.keys():
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.keys():
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def get(self, key: str, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def to_dict(self) -> dict:
+        """
+        Returns the attributes as a dict, with "id" and "date_time"
+        """
+        data = {key: self[key] for key in self.keys()}
+        data['date_time'] = self.date_time
+        return data
+
+    def copy(self):
+        return type(self).from_dict(self.to_raw_dict(), self.id)
+
+    def to_raw_dict(self) -> dict:
+        """
+        Returns the attributes to be saved in the database, without "id",
+        the unset ones and with the fields not read yet still compressed
+        """
+        data = {field: getattr(self, field) for field in self.fields}
+        return {key: value for key, value in data.items()
+                if value is not None}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={self.id!r}, " \
+               f"question={self.question!r})"
+
+
+class ConversationRecord(ConversationSummary):
+    """
+    Complete conversation. The attributes that aren't conversation fields
+    (e.g. added by plugins) are kept in "extra".
+    """
+    __slots__ = ("_answer", "_refined_prompt", "_ttv_response",
+                 "llm_provider", "poster", "video_cache_key", "extra")
+
+    fields = RECORD_FIELDS
+
+    def __init__(self, id: str = None, data: dict = None):
+        data = data or {}
+        super().__init__(id, data)
+        extra = {key: value for key, value in data.items()
+                 if key not in RECORD_FIELDS and
+                 key not in ("id", "_id", "date_time")}
+        self.extra = extra or None
+
+    def get_lazy_field(self, field: str):
+        value = getattr(self, f"_{field}")
+        decompressed = decompress_value(value)
+        if decompressed is not value:
+            setattr(self, f"_{field}", decompressed)
+        return decompressed
+
+    @property
+    def answer(self):
+        return self.get_lazy_field("answer")
+
+    @answer.setter
+    def answer(self, value):
+        self._answer = value
+
+    @property
+    def refined_prompt(self):
+        return self.get_lazy_field("refined_prompt")
+
+    @refined_prompt.setter
+    def refined_prompt(self, value):
+        self._refined_prompt = value
+
+    @property
+    def ttv_response(self):
+        return self.get_lazy_field("ttv_response")
+
+    @ttv_response.setter
+    def ttv_response(self, value):
+        self._ttv_response = value
+
+    def keys(self) -> list:
+        return super().keys() + list(self.extra or {})
+
+    def __getitem__(self, key: str):
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        return super().__getitem__(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key in ("id",) + RECORD_FIELDS:
+            setattr(self, key, value)
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def to_raw_dict(self) -> dict:
+        data = {field: getattr(self, f"_{field}")
+                if field in LAZY_FIELDS else getattr(self, field)
+                for field in self.fields}
+        data.update(self.extra or {})
+        return {key: value for key, value in data.items()
+                if value is not None}
@@ -0,0 +1,66 @@
+"""
+Request deadlines
+
+A deadline is an absolute time.monotonic() value passed down the provider
+stack, from the UI action to the HTTP client timeouts (None means there's
+no deadline). Each hop uses the remaining budget as its timeout and stops
+with a "deadline exceeded" error resultset once it has passed.
+"""
+import time
+
+from src.codegen_utilities import get_default_resultset
+
+
+def get_deadline(timeout: float = None) -> float:
+    """
+    Returns the deadline "timeout" seconds from now, or None if there's
+    no timeout
+    """
+    if not timeout:
+        return None
+    return time.monotonic() + float(timeout)
+
+
+def get_remaining_time(deadline: float = None) -> float:
+    """
+    Returns the seconds until the deadline (0 if it has passed), or None
+    if there's no deadline
+    """
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def is_expired(deadline: float = None) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def get_timeout(deadline: float = None, default: float = None) -> float:
+    """
+    Returns the timeout for the next hop: the remaining time, capped by
+    "default" if given
+    """
+    remaining = get_remaining_time(deadline)
+    if remaining is None:
+        return default
+    if default is None:
+        return remaining
+    return min(remaining, default)
+
+
+def get_deadline_exceeded_resultset(operation: str) -> dict:
+    """
+    Returns the error resultset of an operation stopped by its deadline
+    """
+    response = get_default_resultset()
+    response['error'] = True
+    response['error_message'] = f"Deadline exceeded: {operation}"
+    response['deadline_exceeded'] = True
+    return response
+
+
+def is_deadline_exceeded(response: dict) -> bool:
+    """
+    Returns True if a resultset is a "deadline exceeded" error
+    """
+    return bool(response and response.get('deadline_exceeded'))
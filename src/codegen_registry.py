@@ -0,0 +1,83 @@
+"""
+Lazy implementations registry
+
+Maps names (e.g. a DB_TYPE or a LLM provider) to "module:attribute"
+references that are imported on first use, so a deployment only imports
+the libraries of the implementations it uses (e.g. no pymongo for the
+JSON database). Third-party packages can add implementations with entry
+points, e.g. in their pyproject.toml:
+
+    [project.entry-points."vitexbrain.databases"]
+    redis = "vitexbrain_redis:RedisDatabase"
+"""
+import importlib
+import threading
+from importlib.metadata import entry_points
+
+from src.codegen_utilities import log_debug
+
+
+class Registry:
+    """
+    Registry of lazily imported implementations
+    """
+    def __init__(self, name: str, entry_point_group: str,
+                 implementations: dict = None):
+        self.name = name
+        self.entry_point_group = entry_point_group
+        # name -> "module:attribute" reference or loaded object
+        self.implementations = dict(implementations or {})
+        self.entry_points_loaded = False
+        self.lock = threading.Lock()
+
+    def register(self, name: str, implementation) -> None:
+        """
+        Register an implementation: a "module:attribute" reference or the
+        object itself
+        """
+        with self.lock:
+            self.implementations[name] = implementation
+
+    def load_entry_points(self) -> None:
+        """
+        Add the entry points implementations (just their references, the
+        packages are imported on first use). Must be called with the lock
+        held.
+        """
+        if self.entry_points_loaded:
+            return
+        self.entry_points_loaded = True
+        try:
+            plugins = entry_points(group=self.entry_point_group)
+        except Exception as e:
+            log_debug(f"Registry | {self.entry_point_group} entry points"
+                      f" error: {e}")
+            return
+        for entry_point in plugins:
+            self.implementations.setdefault(entry_point.name,
+                                            entry_point.value)
+
+    def get(self, name: str):
+        """
+        Returns the implementation, importing it on the first call.
+        Raises LookupError if it's not registered.
+        """
+        with self.lock:
+            if name not in self.implementations:
+                # Only looked up when a name isn't built-in
+                self.load_entry_points()
+            if name not in self.implementations:
+                raise LookupError(f"Invalid {self.name}: {name}")
+            implementation = self.implementations[name]
+            if isinstance(implementation, str):
+                module_name, _, attribute = implementation.partition(":")
+                implementation = importlib.import_module(module_name)
+                for attribute_name in filter(None, attribute.split(".")):
+                    implementation = getattr(implementation, attribute_name)
+                self.implementations[name] = implementation
+            return implementation
+
+    def get_names(self) -> list:
+        with self.lock:
+            self.load_entry_points()
+            return sorted(self.implementations)
@@ -0,0 +1,269 @@
+"""
+Semantic answer cache
+
+Finds the text conversations whose question is a near duplicate of a new
+one, so their answer can be returned (or offered) instead of a new
+LlmProvider.query. The questions are embedded offline with a hashing
+vectorizer (words, numbers and operators, their character trigrams and
+the ordered pairs of consecutive words, hashed to a fixed number of
+dimensions, with sublinear term frequencies and L2 normalization) and
+kept in a NumPy matrix, one row per conversation. A lookup is one
+matrix-vector product: the cosine similarity with every stored question.
+NumPy is imported on first use, so the processes with the cache off
+don't load it.
+
+The questions that only differ by their stop words, case or punctuation
+get a similarity of 1.0. A different word, number or operator, or the
+same words in another order, lowers it less as the questions get
+longer: "Is python faster than java" / "Is java faster than python"
+get 0.66, but two 40 words questions with one different word can get
+0.95. So the default threshold is 0.95, and the "offer" mode is safer
+than "return".
+
+The index is built from the database on first use, and updated by the
+callers when they save or delete a conversation (add() / remove()).
+"""
+import os
+import re
+import math
+import zlib
+import threading
+
+from src.codegen_utilities import log_debug
+
+SEMANTIC_CACHE_MODES = ("off", "return", "offer")
+DEFAULT_SEMANTIC_CACHE_MODE = "off"
+DEFAULT_SEMANTIC_CACHE_THRESHOLD = 0.95
+DEFAULT_SEMANTIC_CACHE_DIMENSIONS = 512
+INITIAL_CAPACITY = 256
+# Character trigrams and word pairs weights, relative to the whole words
+TRIGRAM_WEIGHT = 0.25
+BIGRAM_WEIGHT = 1.0
+
+# Words, numbers and the operators, so "2 + 2" and "2 * 2" differ
+TOKEN_PATTERN = re.compile(r"\w+|[+\-*/%^<>=!&|]")
+# With the contractions endings ("what's", "you'll")
+STOP_WORDS = frozenset("""
+a an and are as at be but by can could d do does for from how i in is it
+its ll m me my of on or please re s should so tell than that the their
+them then there these this those to ve was we were what when where which
+who whom why will with would you your
+""".split())
+
+
+def get_semantic_cache_mode() -> str:
+    """
+    Returns the SEMANTIC_CACHE_MODE env. var.: "off", "return" (return
+    the answer of the similar conversation) or "offer" (let the user
+    choose between that answer and a new one)
+    """
+    mode = os.environ.get("SEMANTIC_CACHE_MODE",
+                          DEFAULT_SEMANTIC_CACHE_MODE)
+    if mode not in SEMANTIC_CACHE_MODES:
+        raise ValueError(f"Invalid SEMANTIC_CACHE_MODE: {mode}")
+    return mode
+
+
+class HashingVectorizer:
+    """
+    Stateless text vectorizer: the same text always gets the same vector,
+    in any process, without a vocabulary
+    """
+    def __init__(self, dimensions: int = DEFAULT_SEMANTIC_CACHE_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def get_features(self, text: str) -> dict:
+        """
+        Returns the weighted features of a text: its words (without the
+        stop words), their character trigrams, so the word variants
+        ("tomato", "tomatoes") are still similar, and the pairs of
+        consecutive words, so the word order matters
+        """
+        features = {}
+        words = [word for word in TOKEN_PATTERN.findall(text.lower())
+                 if word not in STOP_WORDS]
+        for word in words:
+            features[f"w:{word}"] = features.get(f"w:{word}", 0) + 1
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                trigram = f"t:{padded[i:i + 3]}"
+                features[trigram] = \
+                    features.get(trigram, 0) + TRIGRAM_WEIGHT
+        for first, second in zip(words, words[1:]):
+            bigram = f"b:{first} {second}"
+            features[bigram] = features.get(bigram, 0) + BIGRAM_WEIGHT
+        return features
+
+    def transform(self, text: str):
+        """
+        Returns the L2 normalized vector of a text, or None if it has no
+        features
+        """
+        import numpy as np
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, count in self.get_features(text).items():
+            # crc32, unlike hash(), is the same in every process
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            # The sign bit reduces the collisions bias
+            sign = -1.0 if hashed & 0x80000000 else 1.0
+            weight = 1 + math.log(count) if count >= 1 else count
+            vector[hashed % self.dimensions] += sign * weight
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+
+class SemanticCache:
+    """
+    Thread-safe index of the text conversations questions
+    """
+    def __init__(self, dimensions: int = DEFAULT_SEMANTIC_CACHE_DIMENSIONS,
+                 threshold: float = DEFAULT_SEMANTIC_CACHE_THRESHOLD):
+        import numpy as np
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.threshold = threshold
+        self.matrix = np.zeros((INITIAL_CAPACITY, dimensions),
+                               dtype=np.float32)
+        # row -> id (None for the removed ones), and id -> row
+        self.ids = []
+        self.rows = {}
+        self.free_rows = []
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, db) -> int:
+        """
+        Index the answered text conversations of a CodegenDatabase,
+        including the archived ones, once. Returns the number of indexed
+        conversations.
+        """
+        with self.lock:
+            if self.loaded:
+                return len(self.rows)
+            for item in db.iter_items(filters={"type": "text"}):
+                if item.get('answer') and item.get('question'):
+                    self.add_locked(str(item['id']), item['question'])
+            self.loaded = True
+            log_debug(f"SemanticCache.load | {len(self.rows)} questions")
+            return len(self.rows)
+
+    def add_locked(self, id: str, question: str) -> None:
+        vector = self.vectorizer.transform(question)
+        row = self.rows.get(id)
+        if vector is None:
+            if row is not None:
+                self.remove_locked(id)
+            return
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+                self.ids[row] = id
+            else:
+                row = len(self.ids)
+                if row == len(self.matrix):
+                    import numpy as np
+                    # Grow by doubling, so the adds are amortized O(1)
+                    self.matrix = np.concatenate(
+                        [self.matrix, np.zeros_like(self.matrix)])
+                self.ids.append(id)
+            self.rows[id] = row
+        self.matrix[row] = vector
+
+    def remove_locked(self, id: str) -> None:
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        self.matrix[row] = 0
+        self.ids[row] = None
+        self.free_rows.append(row)
+
+    def add(self, id: str, question: str) -> None:
+        """
+        Index or re-index the question of a conversation
+        """
+        with self.lock:
+            self.add_locked(id, question)
+
+    def remove(self, id: str) -> None:
+        with self.lock:
+            self.remove_locked(id)
+
+    def find(self, question: str, threshold: float = None):
+        """
+        Returns the (id, similarity) of the most similar indexed question
+        if its cosine similarity is at least "threshold" (default: the
+        cache threshold), or None
+        """
+        if threshold is None:
+            threshold = self.threshold
+        vector = self.vectorizer.transform(question)
+        with self.lock:
+            if vector is None or not self.rows:
+                self.misses += 1
+                return None
+            scores = self.matrix[:len(self.ids)] @ vector
+            row = int(scores.argmax())
+            score = float(scores[row])
+            if score < threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.ids[row], score
+
+    def find_conversation(self, db, question: str,
+                          threshold: float = None):
+        """
+        Returns the (ConversationRecord, similarity) of the most similar
+        answered conversation, or None. The conversations deleted by
+        other processes are removed from the index.
+        """
+        self.load(db)
+        match = self.find(question, threshold)
+        if match is None:
+            return None
+        id, score = match
+        conversation = db.get_item(id)
+        if conversation is None or not conversation.answer:
+            self.remove(id)
+            return None
+        return conversation, score
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.rows),
+                "dimensions": self.vectorizer.dimensions,
+                "matrix_bytes": self.matrix.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """
+    Returns the process-wide semantic cache, configured by the
+    SEMANTIC_CACHE_MODE, SEMANTIC_CACHE_THRESHOLD and
+    SEMANTIC_CACHE_DIMENSIONS environment variables, or None if it's
+    disabled
+    """
+    global _semantic_cache
+    if get_semantic_cache_mode() == "off":
+        return None
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                int(os.environ.get("SEMANTIC_CACHE_DIMENSIONS",
+                                   DEFAULT_SEMANTIC_CACHE_DIMENSIONS)),
+                float(os.environ.get("SEMANTIC_CACHE_THRESHOLD",
+                                     DEFAULT_SEMANTIC_CACHE_THRESHOLD)),
+            )
+    return _semantic_cache
@@ -0,0 +1,153 @@
+"""
+Single-flight request coalescing
+
+Concurrent callers with the same request key wait on one call and share
+its result, instead of sending identical requests upstream.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import time
+import threading
+
+
+def get_request_key(*args) -> str:
+    """
+    Returns a request key from JSON serializable arguments
+    """
+    return hashlib.sha256(
+        json.dumps(args, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def get_remaining_timeout(timeout: float, started: float) -> float:
+    """
+    Returns what is left of "timeout" since "started" (a time.monotonic()
+    value), or None if there's no timeout
+    """
+    if timeout is None:
+        return None
+    return max(0.0, timeout - (time.monotonic() - started))
+
+
+class SingleFlightCall:
+    """
+    An in-flight call and its outcome
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Single-flight group for sync and async callers
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key: str, func, timeout: float = None, retry=None):
+        """
+        Run func() once for all the concurrent callers with the same key.
+        The followers get a copy of the leader's result, so they can
+        modify it safely. A follower waits at most "timeout" seconds for
+        the result, then raises TimeoutError. If retry(result) is True
+        (e.g. the leader was stopped by its own deadline), a follower
+        with time left runs the call again instead of sharing the result.
+        """
+        started = time.monotonic()
+        with self.lock:
+            self.stats["calls"] += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = SingleFlightCall()
+                self.calls[key] = call
+            else:
+                call.followers += 1
+                self.stats["coalesced"] += 1
+        if not leader:
+            if not call.event.wait(timeout):
+                raise TimeoutError("Timed out waiting for the in-flight call")
+            if call.exception:
+                raise call.exception
+            if retry and retry(call.result):
+                remaining = get_remaining_timeout(timeout, started)
+                if remaining is None or remaining > 0:
+                    return self.do(key, func, remaining, retry)
+            return copy.deepcopy(call.result)
+        try:
+            call.result = func()
+        except Exception as e:
+            call.exception = e
+            raise
+        finally:
+            with self.lock:
+                # No follower can join once the key is removed, so the
+                # followers count is final
+                del self.calls[key]
+            result = call.result
+            if call.followers and call.exception is None:
+                # The followers copy call.result once the event is set,
+                # while the leader's caller may modify its result: keep
+                # call.result pristine
+                result = copy.deepcopy(call.result)
+            call.event.set()
+        return result
+
+    async def do_async(self, key: str, func, timeout: float = None,
+                       retry=None):
+        """
+        Async version of do(). If func is a coroutine function it's awaited
+        once for the concurrent callers in the same event loop. Otherwise
+        it runs in the loop executor, sharing the in-flight calls with the
+        sync callers.
+        """
+        loop = asyncio.get_running_loop()
+        if not asyncio.iscoroutinefunction(func):
+            return await loop.run_in_executor(None, self.do, key, func,
+                                              timeout, retry)
+        started = time.monotonic()
+        async_key = (id(loop), key)
+        with self.lock:
+            self.stats["calls"] += 1
+            future = self.async_calls.get(async_key)
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                self.async_calls[async_key] = future
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future),
+                                                timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("Timed out waiting for the in-flight call")
+            if retry and retry(result):
+                remaining = get_remaining_timeout(timeout, started)
+                if remaining is None or remaining > 0:
+                    return await self.do_async(key, func, remaining, retry)
+            return copy.deepcopy(result)
+        try:
+            result = await func()
+            future.set_result(copy.deepcopy(result))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Avoid the "exception was never retrieved" warning when
+            # there are no followers
+            future.exception()
+            raise
+        finally:
+            with self.lock:
+                del self.async_calls[async_key]
+        return result
@@ -0,0 +1,199 @@
+"""
+Local content-addressed video cache
+
+The generated videos are downloaded once, in the background, into a
+directory where each file is named by the SHA-256 of its content. The
+cached copies are played from the local disk (Streamlit serves local
+media files with HTTP range support), and the least recently used ones
+are evicted when the cache exceeds its maximum size.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+)
+
+DEFAULT_VIDEO_CACHE_DIR = "./db/videos"
+DEFAULT_VIDEO_CACHE_MAX_MB = 1024
+VIDEO_CACHE_EXTENSION = ".mp4"
+VIDEO_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+VIDEO_DOWNLOAD_TIMEOUT = 60
+VIDEO_DOWNLOAD_WORKERS = 2
+POSTER_DIR_NAME = "posters"
+
+
+class VideoCache:
+    """
+    Content-addressed video cache with size-based LRU eviction
+    """
+    def __init__(self, cache_dir: str, max_bytes: int,
+                 workers: int = VIDEO_DOWNLOAD_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="video_cache")
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_path(self, cache_key: str) -> str:
+        """
+        Returns the cached file path for a content hash
+        """
+        return os.path.join(self.cache_dir, cache_key[:2],
+                            f"{cache_key}{VIDEO_CACHE_EXTENSION}")
+
+    def get_cached_path(self, cache_key: str) -> str:
+        """
+        Returns the cached file path if it's in the cache, or None.
+        The file access time is updated for the LRU eviction.
+        """
+        if not cache_key:
+            return None
+        path = self.get_path(cache_key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def fetch(self, video_url: str, timeout: int = VIDEO_DOWNLOAD_TIMEOUT
+              ) -> dict:
+        """
+        Download a video into the cache. Returns the content hash in the
+        "cache_key" attribute.
+        """
+        # Imported on first use, so the processes with the cache disabled
+        # don't load it
+        import requests
+        response = get_default_resultset()
+        sha256 = hashlib.sha256()
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(tmp_fd, "wb") as f, \
+                 requests.get(video_url, stream=True,
+                              timeout=timeout) as video_response:
+                if video_response.status_code != 200:
+                    raise ValueError(
+                        "Request failed with status "
+                        f"code {video_response.status_code}")
+                for chunk in video_response.iter_content(
+                        VIDEO_DOWNLOAD_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    f.write(chunk)
+            cache_key = sha256.hexdigest()
+            path = self.get_path(cache_key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Same content, same file: a repeated download just replaces it
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            response['error'] = True
+            response['error_message'] = str(e)
+            log_debug(f"VideoCache.fetch | {video_url} | ERROR: {e}")
+            return response
+        response['cache_key'] = cache_key
+        self.evict()
+        return response
+
+    def fetch_in_background(self, video_url: str, on_cached=None) -> bool:
+        """
+        Schedule a video download, calling on_cached(cache_key) once it's
+        cached. Returns False if the same URL is already being downloaded.
+        """
+        with self.lock:
+            if video_url in self.in_flight:
+                return False
+            self.in_flight[video_url] = True
+
+        def run():
+            try:
+                result = self.fetch(video_url)
+                if not result['error'] and on_cached:
+                    on_cached(result['cache_key'])
+            except Exception as e:
+                log_debug(f"VideoCache.fetch_in_background | ERROR: {e}")
+            finally:
+                with self.lock:
+                    self.in_flight.pop(video_url, None)
+
+        self.executor.submit(run)
+        return True
+
+    def get_entries(self) -> list:
+        """
+        Returns the cached files as (access time, size, path) tuples
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(VIDEO_CACHE_EXTENSION):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used videos until the cache size is under
+        the maximum. Returns the number of removed files.
+        """
+        entries = self.get_entries()
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        if removed:
+            log_debug(f"VideoCache.evict | removed {removed} videos")
+        return removed
+
+
+_video_cache = None
+_video_cache_lock = threading.Lock()
+
+
+def get_video_cache() -> VideoCache:
+    """
+    Returns the process-wide video cache, configured by the
+    VIDEO_CACHE_ENABLED, VIDEO_CACHE_DIR and VIDEO_CACHE_MAX_MB
+    environment variables, or None if it's disabled
+    """
+    global _video_cache
+    if os.environ.get("VIDEO_CACHE_ENABLED", "1") != "1":
+        return None
+    with _video_cache_lock:
+        if _video_cache is None:
+            _video_cache = VideoCache(
+                os.environ.get("VIDEO_CACHE_DIR", DEFAULT_VIDEO_CACHE_DIR),
+                int(os.environ.get("VIDEO_CACHE_MAX_MB",
+                                   DEFAULT_VIDEO_CACHE_MAX_MB)) * 1024 * 1024,
+            )
+    return _video_cache
+
+
+def get_video_poster_dir() -> str:
+    """
+    Returns the directory of the video poster files, in the video cache
+    directory (VIDEO_CACHE_DIR), even if the video cache is disabled
+    """
+    return os.path.join(
+        os.environ.get("VIDEO_CACHE_DIR", DEFAULT_VIDEO_CACHE_DIR),
+        POSTER_DIR_NAME)
@@ -0,0 +1,96 @@
+"""
+Video utilities
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from src.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+)
+
+POSTER_WIDTH = 320
+POSTER_SEEK_SECONDS = 1
+POSTER_TIMEOUT = 30
+POSTER_EXTENSION = ".jpg"
+
+
+def is_poster_extraction_available() -> bool:
+    """
+    Returns True if the poster frames can be extracted (ffmpeg installed)
+    """
+    return shutil.which("ffmpeg") is not None
+
+
+def save_poster_file(poster_dir: str, data: bytes) -> str:
+    """
+    Write a JPEG poster to the poster directory, named by the SHA-256 of
+    its content. Returns its path.
+    """
+    poster_hash = hashlib.sha256(data).hexdigest()
+    path = os.path.join(poster_dir, poster_hash[:2],
+                        f"{poster_hash}{POSTER_EXTENSION}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix=".part")
+    try:
+        with os.fdopen(tmp_fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def get_video_poster(video_url: str, poster_dir: str,
+                     width: int = POSTER_WIDTH,
+                     seek_seconds: int = POSTER_SEEK_SECONDS,
+                     timeout: int = POSTER_TIMEOUT) -> dict:
+    """
+    Extract a poster frame from a video (URL or local path) with ffmpeg,
+    and save it as a JPEG file in "poster_dir". Returns the file path in
+    the "poster" attribute. Only the first seconds of the video are read.
+    """
+    response = get_default_resultset()
+    ffmpeg_path = shutil.which("ffmpeg")
+    if not ffmpeg_path:
+        response['error'] = True
+        response['error_message'] = "ffmpeg not found"
+        return response
+    command = [
+        ffmpeg_path, "-loglevel", "error",
+        "-ss", str(seek_seconds),
+        "-i", video_url,
+        "-frames:v", "1",
+        "-vf", f"scale={width}:-2",
+        "-f", "image2pipe",
+        "-vcodec", "mjpeg",
+        "-",
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True,
+                                timeout=timeout, check=False)
+    except Exception as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+        return response
+    if result.returncode != 0 or not result.stdout:
+        response['error'] = True
+        response['error_message'] = \
+            f"Poster extraction failed: {result.stderr.decode()[:200]}"
+        log_debug(f"get_video_poster | {video_url} | " +
+                  f"{response['error_message']}")
+        return response
+    try:
+        response['poster'] = save_poster_file(poster_dir, result.stdout)
+    except OSError as e:
+        response['error'] = True
+        response['error_message'] = f"Poster save failed: {e}"
+    return response
@@ -0,0 +1,210 @@
+"""
+Process warm-up
+
+Runs once per process, in the background, the steps that make the first
+request slow: opening the provider and database connections, loading the
+first conversations page, priming the suggestions pool and building the
+semantic cache index. The worker reports itself ready once they are done
+(a "ready file" and the API /api/ready endpoint), so the load balancers
+only route to warm workers.
+
+Configured with the WARMUP_ENABLED and WARMUP_READY_FILE environment
+variables.
+"""
+import os
+import time
+import threading
+from collections import deque
+
+from src.codegen_utilities import log_debug, get_default_resultset
+
+DEFAULT_SUGGESTIONS_POOL_SIZE = 1
+
+# Warm-ups by name, so each one runs once per process
+_warm_ups = {}
+_warm_ups_lock = threading.Lock()
+
+
+def is_warm_up_enabled() -> bool:
+    return os.environ.get("WARMUP_ENABLED", "0") == "1"
+
+
+class WarmUp:
+    """
+    Named warm-up steps run one after the other. Each step is a callable
+    that can return a resultset: its errors are reported, but they don't
+    stop the warm-up (the app works cold as well).
+    """
+    def __init__(self, name: str, steps: list, ready_file: str = None):
+        self.name = name
+        # (step name, callable) tuples
+        self.steps = steps
+        self.ready_file = ready_file
+        self.ready = threading.Event()
+        self.started_at = None
+        self.elapsed = None
+        self.step_status = {}
+        self.thread = None
+
+    def run_step(self, step_name: str, func) -> None:
+        start = time.perf_counter()
+        try:
+            response = func()
+        except Exception as e:
+            response = get_default_resultset()
+            response['error'] = True
+            response['error_message'] = str(e)
+        if not isinstance(response, dict) or 'error' not in response:
+            response = get_default_resultset()
+        self.step_status[step_name] = {
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "error": response['error'],
+            "error_message": response['error_message'],
+        }
+        log_debug(f"WarmUp | {self.name} | {step_name}: "
+                  f"{self.step_status[step_name]}")
+
+    def run(self) -> dict:
+        """
+        Run the steps, and then report the process as ready
+        """
+        self.started_at = time.time()
+        start = time.perf_counter()
+        for step_name, func in self.steps:
+            self.run_step(step_name, func)
+        self.elapsed = time.perf_counter() - start
+        self.set_ready()
+        return self.get_status()
+
+    def start(self) -> "WarmUp":
+        """
+        Run the steps in a background thread
+        """
+        self.thread = threading.Thread(
+            target=self.run, name=f"warm_up_{self.name}", daemon=True)
+        self.thread.start()
+        return self
+
+    def set_ready(self) -> None:
+        self.ready.set()
+        if self.ready_file:
+            try:
+                with open(self.ready_file, "w") as f:
+                    f.write(f"{os.getpid()}\n")
+            except OSError as e:
+                log_debug(f"WarmUp | {self.name} | ready file error: {e}")
+
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.ready.wait(timeout)
+
+    def get_status(self) -> dict:
+        return {
+            "name": self.name,
+            "ready": self.is_ready(),
+            "elapsed_ms": round(self.elapsed * 1000, 2)
+            if self.elapsed is not None else None,
+            "steps": dict(self.step_status),
+        }
+
+
+def start_warm_up(name: str, steps: list) -> WarmUp:
+    """
+    Start the "name" warm-up in the background, only the first time it's
+    called in the process. Returns the warm-up, or None if it's disabled
+    by WARMUP_ENABLED.
+    """
+    if not is_warm_up_enabled():
+        return None
+    with _warm_ups_lock:
+        if name not in _warm_ups:
+            _warm_ups[name] = WarmUp(
+                name, steps, os.environ.get("WARMUP_READY_FILE")).start()
+        return _warm_ups[name]
+
+
+def get_warm_up(name: str) -> WarmUp:
+    with _warm_ups_lock:
+        return _warm_ups.get(name)
+
+
+def get_warm_up_steps(db, get_llm_model, get_ttv_model,
+                      page_size: int, suggestions_pool=None,
+                      semantic_cache=None) -> list:
+    """
+    Returns the app warm-up steps: the provider connections, the database
+    connection, its first conversations page and, if given, the
+    suggestions pool and the semantic cache index
+    """
+    def warm_up_database():
+        db.ping()
+
+    def load_conversations():
+        db.get_list("timestamp", "desc", page_size + 1, 0)
+
+    steps = [
+        ("llm", lambda: get_llm_model().warm_up()),
+        ("text_to_video", lambda: get_ttv_model().warm_up()),
+        ("database", warm_up_database),
+        ("conversations", load_conversations),
+    ]
+    if suggestions_pool:
+        steps.append(("suggestions", suggestions_pool.fill))
+    if semantic_cache:
+        steps.append(("semantic_cache", lambda: semantic_cache.load(db)))
+    return steps
+
+
+class PrefetchPool:
+    """
+    Pool of prefetched results (e.g. AI suggestions). get() returns a
+    prefetched result if there's one, or generates it, and then refills
+    the pool in the background. Error resultsets aren't pooled.
+    """
+    def __init__(self, generate, size: int = DEFAULT_SUGGESTIONS_POOL_SIZE):
+        self.generate = generate
+        self.size = size
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def get(self):
+        with self.lock:
+            item = self.items.popleft() if self.items else None
+        if item is None:
+            item = self.generate()
+        self.refill()
+        return item
+
+    def fill(self) -> dict:
+        """
+        Generate results until the pool is full. Returns the last error
+        resultset, if any.
+        """
+        response = get_default_resultset()
+        while True:
+            with self.lock:
+                if len(self.items) >= self.size:
+                    return response
+            item = self.generate()
+            if isinstance(item, dict) and item.get('error'):
+                return item
+            with self.lock:
+                self.items.append(item)
+
+    def refill(self) -> None:
+        with self.lock:
+            if self.refilling or len(self.items) >= self.size:
+                return
+            self.refilling = True
+
+        def run():
+            try:
+                self.fill()
+            finally:
+                with self.lock:
+                    self.refilling = False
+        threading.Thread(target=run, name="prefetch_pool",
+                         daemon=True).start()
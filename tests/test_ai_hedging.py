@@ -0,0 +1,112 @@
+"""
+Hedged LLM requests tests
+"""
+import time
+import unittest
+
+from src.codegen_utilities import get_default_resultset
+from src.codegen_deadlines import get_deadline
+from src.codegen_ai_hedging import (
+    LatencyTracker,
+    hedged_call,
+    get_hedge_delay,
+    latency_tracker,
+)
+
+
+def get_provider_func(answer: str, sleep: float = 0, error: bool = False):
+    """
+    Returns a provider call that answers after "sleep" seconds
+    """
+    def func():
+        time.sleep(sleep)
+        response = get_default_resultset()
+        if error:
+            response['error'] = True
+            response['error_message'] = f"{answer} failed"
+        else:
+            response['response'] = answer
+        return response
+    return func
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_percentile(self):
+        tracker = LatencyTracker(max_samples=100, min_samples=10)
+        for latency in range(1, 10):
+            tracker.record("provider", latency)
+        # Not enough samples yet
+        self.assertIsNone(tracker.get_percentile("provider", 95))
+        tracker.record("provider", 10)
+        self.assertEqual(tracker.get_percentile("provider", 50), 5)
+        self.assertEqual(tracker.get_percentile("provider", 95), 10)
+        self.assertIsNone(tracker.get_percentile("other", 95))
+
+    def test_max_samples(self):
+        tracker = LatencyTracker(max_samples=5, min_samples=1)
+        for latency in range(10):
+            tracker.record("provider", latency)
+        self.assertEqual(tracker.get_percentile("provider", 0), 5)
+
+    def test_default_delay(self):
+        self.assertEqual(get_hedge_delay("test_unknown_provider", 95, 7), 7)
+
+
+class TestHedgedCall(unittest.TestCase):
+
+    def test_fast_primary(self):
+        response = hedged_call(
+            ("primary", get_provider_func("primary answer")),
+            ("secondary", get_provider_func("secondary answer")),
+            95, 1, latency_suffix=":test_fast")
+        self.assertFalse(response['error'])
+        self.assertEqual(response['response'], "primary answer")
+        self.assertEqual(response['provider'], "primary")
+        self.assertNotIn('hedged', response)
+
+    def test_failover(self):
+        response = hedged_call(
+            ("primary", get_provider_func("primary", error=True)),
+            ("secondary", get_provider_func("secondary answer")),
+            95, 1, latency_suffix=":test_failover")
+        self.assertFalse(response['error'])
+        self.assertEqual(response['provider'], "secondary")
+
+    def test_slow_primary_is_hedged(self):
+        start = time.monotonic()
+        response = hedged_call(
+            ("primary", get_provider_func("primary answer", sleep=1)),
+            ("secondary", get_provider_func("secondary answer")),
+            95, 0.05, latency_suffix=":test_hedged")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(response['provider'], "secondary")
+        self.assertTrue(response['hedged'])
+
+    def test_both_fail(self):
+        response = hedged_call(
+            ("primary", get_provider_func("primary", sleep=0.1,
+                                          error=True)),
+            ("secondary", get_provider_func("secondary", error=True)),
+            95, 0.01, latency_suffix=":test_both_fail")
+        self.assertTrue(response['error'])
+
+    def test_deadline(self):
+        response = hedged_call(
+            ("primary", get_provider_func("primary", sleep=1)),
+            ("secondary", get_provider_func("secondary", sleep=1)),
+            95, 0.05, latency_suffix=":test_deadline",
+            deadline=get_deadline(0.2))
+        self.assertTrue(response['error'])
+        self.assertTrue(response['deadline_exceeded'])
+
+    def test_records_latency(self):
+        hedged_call(("primary", get_provider_func("answer")),
+                    ("secondary", get_provider_func("answer")),
+                    95, 1, latency_suffix=":test_latency")
+        self.assertEqual(
+            len(latency_tracker.samples["primary:test_latency"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Prompt enhancement modes tests
+"""
+import os
+import json
+import unittest
+from unittest import mock
+
+from src.codegen_utilities import get_default_resultset
+from src.codegen_ai_abstracts import (
+    clean_refined_prompt,
+    parse_fused_response,
+)
+from src import codegen_ai_provider_openai, codegen_ai_provider_rhymes
+from src.codegen_ai_provider_openai import OpenaiLlm
+from src.codegen_ai_provider_rhymes import AriaLlm
+
+
+class TestParseFusedResponse(unittest.TestCase):
+
+    def test_clean_refined_prompt(self):
+        self.assertEqual(
+            clean_refined_prompt('**Enhanced Prompt**: "Explain\nit"'),
+            "Explain it")
+
+    def test_parse(self):
+        text = '```json\n{"refined_prompt": "Enhanced Prompt: Explain",' \
+            ' "response": "Answer"}\n```'
+        self.assertEqual(parse_fused_response(text), ("Explain", "Answer"))
+
+    def test_partial(self):
+        self.assertEqual(
+            parse_fused_response('{"refined_prompt": "Explain"}'),
+            ("Explain", None))
+        self.assertEqual(
+            parse_fused_response('{"refined_prompt": " ", "response": 1}'),
+            (None, None))
+
+    def test_invalid(self):
+        self.assertIsNone(parse_fused_response("Plain answer"))
+        self.assertIsNone(parse_fused_response("{invalid}"))
+        self.assertIsNone(parse_fused_response(""))
+
+
+class TestPromptEnhancementModes(unittest.TestCase):
+    """
+    AriaLlm.query (or OpenaiLlm.query with "openai") with the OpenAI API
+    responses replaced by "answers", in order
+    """
+    def query(self, answers: list, mode: str = None,
+              provider: str = "rhymes") -> tuple:
+        requests = []
+
+        def get_openai_api_response(model_params: dict) -> dict:
+            requests.append(model_params['messages'][0]['content'])
+            response = get_default_resultset()
+            response['response'] = answers[len(requests) - 1]
+            return response
+
+        module, llm_class = {
+            "rhymes": (codegen_ai_provider_rhymes, AriaLlm),
+            "openai": (codegen_ai_provider_openai, OpenaiLlm),
+        }[provider]
+        params = {"provider": provider}
+        if mode:
+            params["prompt_enhancement_mode"] = mode
+        with mock.patch.object(module, "get_openai_api_response",
+                               get_openai_api_response):
+            response = llm_class(params).query(
+                "{question}", "What is AI?", "Enhance it")
+        return response, requests
+
+    def test_default_is_two_calls(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("LLM_PROMPT_ENHANCEMENT_MODE", None)
+            response, requests = self.query(
+                ['Refined Prompt: "Explain AI"', "AI is..."])
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1], "Explain AI")
+        self.assertEqual(response['refined_prompt'], "Explain AI")
+        self.assertEqual(response['response'], "AI is...")
+
+    def test_fused(self):
+        response, requests = self.query([json.dumps({
+            "refined_prompt": "**Enhanced Prompt**: Explain AI",
+            "response": "AI is...",
+        })], mode="fused")
+        self.assertEqual(len(requests), 1)
+        self.assertTrue(response['fused'])
+        self.assertEqual(response['refined_prompt'], "Explain AI")
+        self.assertEqual(response['response'], "AI is...")
+
+    def test_fused_with_refined_prompt_only(self):
+        response, requests = self.query([
+            '{"refined_prompt": "Explain AI"}', "AI is..."], mode="fused")
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1], "Explain AI")
+        self.assertEqual(response['refined_prompt'], "Explain AI")
+        self.assertEqual(response['response'], "AI is...")
+
+    def test_fused_unparsed(self):
+        for provider in ("rhymes", "openai"):
+            with self.subTest(provider=provider):
+                response, requests = self.query(
+                    ["Plain answer", 'Refined Prompt: "Explain AI"',
+                     "AI is..."], mode="fused", provider=provider)
+                # Still enhanced, with the two calls
+                self.assertEqual(len(requests), 3)
+                self.assertEqual(requests[2], "Explain AI")
+                self.assertEqual(response['refined_prompt'], "Explain AI")
+                self.assertEqual(response['response'], "AI is...")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+OpenAI provider request retries tests
+"""
+import time
+import unittest
+from unittest import mock
+
+import httpx
+from openai import APIConnectionError, BadRequestError
+
+from src import codegen_ai_provider_openai
+from src.codegen_deadlines import get_deadline
+from src.codegen_ai_provider_openai import (
+    create_chat_completion,
+    get_openai_request_config,
+    is_retryable_error,
+)
+
+REQUEST = httpx.Request("POST", "http://localhost/v1/chat/completions")
+
+
+def get_connection_error() -> APIConnectionError:
+    return APIConnectionError(request=REQUEST)
+
+
+def get_bad_request_error() -> BadRequestError:
+    return BadRequestError("bad request",
+                           response=httpx.Response(400, request=REQUEST),
+                           body=None)
+
+
+class StubClient:
+    """
+    OpenAI client stand-in whose chat completions raise the "errors" in
+    order, then succeed
+    """
+    def __init__(self, errors: list, max_retries: int = 2):
+        self.errors = list(errors)
+        self.max_retries = max_retries
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def with_options(self, max_retries: int):
+        self.attempt_max_retries = max_retries
+        return self
+
+    def create(self, **model_config):
+        self.calls.append(model_config)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "completion"
+
+
+class TestCreateChatCompletion(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(codegen_ai_provider_openai,
+                                    "INITIAL_RETRY_DELAY", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable_error(get_connection_error()))
+        self.assertFalse(is_retryable_error(get_bad_request_error()))
+
+    def test_deadline_keeps_the_client_retries(self):
+        client = StubClient([get_connection_error(),
+                             get_connection_error()])
+        deadline = get_deadline(10)
+        self.assertEqual(create_chat_completion(client, {"model": "m"},
+                                                deadline), "completion")
+        self.assertEqual(len(client.calls), 3)
+        # Each attempt is bounded by the remaining time
+        self.assertEqual(client.attempt_max_retries, 0)
+        self.assertTrue(all(0 < call["timeout"] <= 10
+                            for call in client.calls))
+
+    def test_retries_are_limited(self):
+        client = StubClient([get_connection_error()] * 3, max_retries=1)
+        with self.assertRaises(APIConnectionError):
+            create_chat_completion(client, {}, get_deadline(10))
+        self.assertEqual(len(client.calls), 2)
+
+    def test_no_retry_past_the_deadline(self):
+        client = StubClient([get_connection_error()])
+        start = time.monotonic()
+        with self.assertRaises(APIConnectionError):
+            create_chat_completion(client, {}, get_deadline(0.005))
+        self.assertEqual(len(client.calls), 1)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_no_retry_of_request_errors(self):
+        client = StubClient([get_bad_request_error()])
+        with self.assertRaises(BadRequestError):
+            create_chat_completion(client, {}, get_deadline(10))
+        self.assertEqual(len(client.calls), 1)
+
+    def test_without_deadline(self):
+        client = StubClient([])
+        self.assertEqual(create_chat_completion(client, {"model": "m"}),
+                         "completion")
+        self.assertEqual(client.calls, [{"model": "m"}])
+
+    def test_request_config_keeps_retries(self):
+        client_config, _ = get_openai_request_config({
+            "api_key": "key", "deadline": get_deadline(10)})
+        self.assertNotIn("max_retries", client_config)
+
+
+if __name__ == '__main__':
+    unittest.main()
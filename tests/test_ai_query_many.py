@@ -0,0 +1,104 @@
+"""
+Batch query API tests: run_many and LlmProvider.query_many
+"""
+import time
+import threading
+import unittest
+
+from src.codegen_utilities import get_default_resultset
+from src.codegen_ai_abstracts import LlmProviderAbstract
+from src.codegen_ai_utilities import (
+    LlmProvider,
+    llm_registry,
+    run_many,
+)
+
+
+class StubLlm(LlmProviderAbstract):
+    """
+    LLM provider that answers with the question, tracking the requests in
+    flight
+    """
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def query(self, prompt: str, question: str,
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
+        with StubLlm.lock:
+            StubLlm.in_flight += 1
+            StubLlm.max_in_flight = max(StubLlm.max_in_flight,
+                                        StubLlm.in_flight)
+        try:
+            time.sleep(0.02)
+            if question == "fail":
+                raise RuntimeError("stub failure")
+            response = get_default_resultset()
+            response['response'] = prompt.replace("{question}", question)
+            return response
+        finally:
+            with StubLlm.lock:
+                StubLlm.in_flight -= 1
+
+
+class TestRunMany(unittest.TestCase):
+
+    def test_order_and_progress(self):
+        progress = []
+        results = run_many(lambda item: {"error": False, "response": item},
+                           list(range(20)), concurrency=4,
+                           on_progress=lambda done, total:
+                               progress.append((done, total)))
+        self.assertEqual([result['response'] for result in results],
+                         list(range(20)))
+        self.assertEqual(sorted(progress), [(done, 20)
+                                            for done in range(1, 21)])
+
+    def test_errors_are_isolated(self):
+        def func(item):
+            if item == 2:
+                raise ValueError("bad item")
+            return {"error": False, "response": item}
+
+        results = run_many(func, [1, 2, 3])
+        self.assertFalse(results[0]['error'])
+        self.assertTrue(results[1]['error'])
+        self.assertEqual(results[1]['error_message'], "bad item")
+        self.assertFalse(results[2]['error'])
+
+    def test_empty(self):
+        self.assertEqual(run_many(lambda item: item, []), [])
+
+
+class TestQueryMany(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        llm_registry.register("test_stub", StubLlm)
+
+    def setUp(self):
+        StubLlm.max_in_flight = 0
+        self.llm = LlmProvider({"provider": "test_stub",
+                                "model_name": "stub",
+                                "hedge_provider": ""})
+
+    def test_query_many(self):
+        prompts = [f"question {index}" for index in range(12)] + [
+            {"question": "with prompt", "prompt": "Q: {question}"},
+            "fail",
+        ]
+        results = self.llm.query_many(prompts, concurrency=3)
+        self.assertEqual(len(results), 14)
+        self.assertEqual(results[0]['response'], "question 0")
+        self.assertEqual(results[11]['response'], "question 11")
+        self.assertEqual(results[12]['response'], "Q: with prompt")
+        self.assertTrue(results[13]['error'])
+        self.assertEqual(results[13]['error_message'], "stub failure")
+        self.assertLessEqual(StubLlm.max_in_flight, 3)
+        self.assertTrue(all(result.get('provider') == "test_stub"
+                            for result in results[:13]))
+
+
+if __name__ == '__main__':
+    unittest.main()
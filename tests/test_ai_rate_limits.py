@@ -0,0 +1,145 @@
+"""
+Client-side rate limiting tests
+"""
+import time
+import threading
+import unittest
+
+from src.codegen_ai_rate_limits import (
+    TokenBucket,
+    RateLimiter,
+    set_rate_limits,
+    get_rate_limiter,
+    estimate_tokens,
+)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_and_wait_time(self):
+        bucket = TokenBucket(60)
+        self.assertEqual(bucket.get_wait_time(60), 0)
+        bucket.consume(60)
+        # 1 token per second
+        self.assertAlmostEqual(bucket.get_wait_time(1), 1, places=1)
+        self.assertAlmostEqual(bucket.get_wait_time(30), 30, places=1)
+
+    def test_amount_is_capped_by_capacity(self):
+        bucket = TokenBucket(10)
+        # A request bigger than the burst must not wait forever
+        self.assertEqual(bucket.get_wait_time(1000), 0)
+        bucket.consume(1000)
+        self.assertLessEqual(bucket.tokens, 0.01)
+
+    def test_refill(self):
+        bucket = TokenBucket(6000)
+        bucket.consume(6000)
+        time.sleep(0.1)
+        bucket.refill()
+        self.assertGreaterEqual(bucket.tokens, 9)
+        self.assertLessEqual(bucket.tokens, bucket.capacity)
+
+    def test_adjust(self):
+        bucket = TokenBucket(100)
+        bucket.consume(50)
+        bucket.adjust(-100)
+        # In debt
+        self.assertLess(bucket.tokens, 0)
+        bucket.adjust(1000)
+        self.assertEqual(bucket.tokens, bucket.capacity)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_requests_per_minute(self):
+        limiter = RateLimiter("test", rpm=2, max_wait=0.1)
+        for _ in range(2):
+            self.assertFalse(limiter.acquire()['error'])
+            limiter.release()
+        response = limiter.acquire()
+        self.assertTrue(response['error'])
+        self.assertIn("timed out", response['error_message'])
+
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter("test", tpm=1000, max_wait=0.1)
+        with limiter.limit(tokens=900) as response:
+            self.assertFalse(response['error'])
+            # Only 10 tokens were used
+            response['used_tokens'] = 10
+        with limiter.limit(tokens=900) as response:
+            self.assertFalse(response['error'])
+        with limiter.limit(tokens=900) as response:
+            self.assertTrue(response['error'])
+
+    def test_concurrency(self):
+        limiter = RateLimiter("test", concurrency=2, max_wait=2)
+        in_flight = []
+        max_in_flight = []
+        lock = threading.Lock()
+
+        def request():
+            with limiter.limit() as response:
+                self.assertFalse(response['error'])
+                with lock:
+                    in_flight.append(1)
+                    max_in_flight.append(len(in_flight))
+                time.sleep(0.05)
+                with lock:
+                    in_flight.pop()
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(max_in_flight), 6)
+        self.assertLessEqual(max(max_in_flight), 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_max_queue(self):
+        limiter = RateLimiter("test", concurrency=1, max_queue=1,
+                              max_wait=1)
+        self.assertFalse(limiter.acquire()['error'])
+        # The second request waits for the slot, the third is rejected
+        waiting = threading.Thread(target=limiter.acquire)
+        waiting.start()
+        while not limiter.waiting:
+            time.sleep(0.01)
+        response = limiter.acquire()
+        self.assertTrue(response['error'])
+        self.assertIn("queue", response['error_message'])
+        limiter.release()
+        waiting.join()
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_pause(self):
+        limiter = RateLimiter("test", max_wait=0.05)
+        limiter.pause(1)
+        self.assertTrue(limiter.acquire()['error'])
+
+
+class TestRateLimitsConfig(unittest.TestCase):
+
+    def tearDown(self):
+        set_rate_limits({})
+
+    def test_get_rate_limiter(self):
+        set_rate_limits({
+            "rhymes/aria": {"rpm": 10},
+            "openai/*": {"tpm": 1000},
+        })
+        limiter = get_rate_limiter("rhymes", "aria")
+        self.assertEqual(limiter.name, "rhymes/aria")
+        self.assertIs(get_rate_limiter("rhymes", "aria"), limiter)
+        self.assertEqual(get_rate_limiter("openai", "gpt-4o").name,
+                         "openai/*")
+        self.assertIsNone(get_rate_limiter("rhymes", "other"))
+
+    def test_estimate_tokens(self):
+        messages = [{"role": "user", "content": "x" * 400}]
+        self.assertEqual(estimate_tokens(messages, 100), 200)
+        self.assertEqual(estimate_tokens([]), 512)
+
+
+if __name__ == '__main__':
+    unittest.main()
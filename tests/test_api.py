@@ -0,0 +1,182 @@
+"""
+Async HTTP API tests
+"""
+import os
+import json
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+from tornado.testing import AsyncHTTPTestCase
+
+from src import codegen_api
+from src.codegen_utilities import get_default_resultset
+from src.codegen_db import CodegenDatabase
+from src.codegen_api import make_api_app
+
+
+class StubLlmModel:
+    """
+    LlmProvider stand-in. The "fail" question fails after the first
+    streamed chunk.
+    """
+    async def query_async(self, prompt: str, question: str,
+                          prompt_enhancement_text: str = None,
+                          deadline: float = None) -> dict:
+        response = get_default_resultset()
+        response['response'] = f"answer: {question}"
+        return response
+
+    def query_stream(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None,
+                     deadline: float = None):
+        yield {"delta": "answer: "}
+        if question == "fail":
+            raise RuntimeError("provider failure")
+        response = get_default_resultset()
+        response['response'] = f"answer: {question}"
+        yield response
+
+
+class StubTtvModel:
+    """
+    TextToVideoProvider stand-in whose generation checks wait for the
+    "release" event
+    """
+    def __init__(self):
+        self.release = threading.Event()
+
+    def request(self, question: str, prompt_enhancement_text: str = None,
+                deadline: float = None) -> dict:
+        response = get_default_resultset()
+        response['response'] = {"data": "stub"}
+        return response
+
+    def generation_check(self, ttv_response: dict, wait_time: int = 60,
+                         deadline: float = None) -> dict:
+        self.release.wait(10)
+        response = get_default_resultset()
+        response['video_url'] = "https://example.com/stub.mp4"
+        return response
+
+
+class ApiTestCase(AsyncHTTPTestCase):
+
+    api_key = None
+
+    def get_app(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+        })
+        app = make_api_app({"db": self.db, "workers": 1,
+                            "video_workers": 1, "api_key": self.api_key})
+        self.context = app.settings["api_context"]
+        self.ttv_model = StubTtvModel()
+        self.context.get_llm_model = StubLlmModel
+        self.context.get_ttv_model = lambda: self.ttv_model
+        return app
+
+    def tearDown(self):
+        self.ttv_model.release.set()
+        super().tearDown()
+        self.context.executor.shutdown()
+        self.context.video_executor.shutdown()
+        self.tmp_dir.cleanup()
+
+    def post_json(self, path: str, body: dict, **kwargs):
+        return self.fetch(path, method="POST", body=json.dumps(body),
+                          **kwargs)
+
+    def get_stream_events(self, response) -> list:
+        return [json.loads(line) for line in
+                response.body.decode("utf-8").splitlines()]
+
+
+class TestApi(ApiTestCase):
+
+    def test_text(self):
+        response = self.post_json("/api/text", {"question": "hello"})
+        self.assertEqual(response.code, 200)
+        data = json.loads(response.body)
+        self.assertEqual(data['response'], "answer: hello")
+        self.assertEqual(self.db.get_item(data['id']).answer,
+                         "answer: hello")
+
+    def test_stream(self):
+        response = self.post_json("/api/text", {"question": "hello",
+                                                "stream": True})
+        events = self.get_stream_events(response)
+        self.assertEqual(events[0], {"delta": "answer: "})
+        self.assertTrue(events[-1]['done'])
+
+    def test_stream_error_event(self):
+        response = self.post_json("/api/text", {"question": "fail",
+                                                "stream": True})
+        events = self.get_stream_events(response)
+        self.assertEqual(events[0], {"delta": "answer: "})
+        self.assertEqual(events[-1], {"error": True,
+                                      "error_message": "provider failure"})
+
+    def test_stream_save_error_event(self):
+        def save_conversation(**kwargs):
+            raise OSError("disk full")
+
+        self.context.save_conversation = save_conversation
+        response = self.post_json("/api/text", {"question": "hello",
+                                                "stream": True})
+        events = self.get_stream_events(response)
+        self.assertEqual(events[-1], {"error": True,
+                                      "error_message": "disk full"})
+
+    def test_video_checks_have_their_own_threads(self):
+        response = self.post_json("/api/video", {"question": "a cat"})
+        self.assertEqual(response.code, 202)
+        video_id = json.loads(response.body)['id']
+        # The generation check is waiting, but the only API worker
+        # thread still serves the requests
+        response = self.fetch(f"/api/video/{video_id}")
+        self.assertEqual(json.loads(response.body)['status'], "processing")
+        self.ttv_model.release.set()
+
+    def test_video_tasks_from_threads(self):
+        def set_video_tasks(thread: int):
+            for index in range(2000):
+                self.context.set_video_task(f"{thread}-{index}",
+                                            {"status": "processing"})
+                self.context.get_video_task(f"{thread}-{index // 2}")
+
+        with mock.patch.object(codegen_api, "MAX_VIDEO_TASKS", 100):
+            threads = [threading.Thread(target=set_video_tasks, args=(i,))
+                       for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(self.context.video_tasks), 100)
+        self.assertEqual(self.context.get_video_task("missing"), {})
+
+
+class TestApiKey(ApiTestCase):
+
+    api_key = "secret"
+
+    def test_api_key_required(self):
+        response = self.fetch("/api/conversations")
+        self.assertEqual(response.code, 401)
+        response = self.fetch("/api/conversations",
+                              headers={"Authorization": "Bearer wrong"})
+        self.assertEqual(response.code, 401)
+        response = self.fetch("/api/conversations",
+                              headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.code, 200)
+
+    def test_health_checks_without_api_key(self):
+        self.assertEqual(self.fetch("/api/health").code, 200)
+        self.assertEqual(self.fetch("/api/ready").code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Streamlit app tests, with the benchmark stub providers
+"""
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from streamlit.testing.v1 import AppTest
+
+import app_streamlit
+from src.codegen_utilities import get_default_resultset
+from benchmarks.bench_app import stub_providers, APP_SCRIPT
+from benchmarks.bench_utilities import silence_debug_logs
+
+PAGE_SIZE = app_streamlit.CONVERSATIONS_PAGE_SIZE
+
+
+class SessionState(dict):
+    """
+    st.session_state stand-in, with the attribute access
+    """
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+class TestAppStreamlit(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        silence_debug_logs()
+        stub_providers()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp_dir.name, "conversations.json")
+        with open(db_path, "w") as f:
+            json.dump({"id1": {"type": "text", "question": "Question",
+                               "answer": "Answer", "timestamp": 1}}, f)
+        env = mock.patch.dict(os.environ, {
+            "DB_TYPE": "json",
+            "JSON_DB_PATH": db_path,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_home_page(self):
+        at = AppTest.from_file(APP_SCRIPT, default_timeout=30).run()
+        self.assertFalse(at.exception)
+
+    def test_warm_up(self):
+        # The warm-up starts after set_page_config, which must be the
+        # first Streamlit command
+        with mock.patch.dict(os.environ, {"WARMUP_ENABLED": "1"}):
+            at = AppTest.from_file(APP_SCRIPT, default_timeout=30).run()
+        self.assertFalse(at.exception)
+
+
+class TestSessionConversations(unittest.TestCase):
+    """
+    Side bar conversations page updates after this session's writes
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        db_path = os.path.join(self.tmp_dir.name, "conversations.json")
+        with open(db_path, "w") as f:
+            json.dump({f"id{index:02}": {"type": "text",
+                                         "question": f"Question {index}",
+                                         "answer": "Answer",
+                                         "timestamp": index}
+                       for index in range(PAGE_SIZE + 5)}, f)
+        env = mock.patch.dict(os.environ, {
+            "DB_TYPE": "json",
+            "JSON_DB_PATH": db_path,
+            "SEMANTIC_CACHE_MODE": "off",
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        patcher = mock.patch.object(app_streamlit.st, "session_state",
+                                    SessionState())
+        self.session_state = patcher.start()
+        self.addCleanup(patcher.stop)
+        # The AI suggestions aren't needed
+        patcher = mock.patch.object(app_streamlit, "recycle_suggestions")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app_streamlit.update_conversations()
+
+    def get_page_ids(self) -> list:
+        return [item.id for item in self.session_state.conversations]
+
+    def test_save(self):
+        id = app_streamlit.save_conversation("text", "New", "Answer")
+        page_ids = self.get_page_ids()
+        self.assertEqual(page_ids[0], id)
+        self.assertEqual(len(page_ids), PAGE_SIZE)
+        self.assertTrue(self.session_state.conversations_has_more)
+        # The session's own write is seen
+        with mock.patch.object(app_streamlit, "update_conversations") \
+                as update_conversations:
+            app_streamlit.refresh_conversations()
+        update_conversations.assert_not_called()
+
+    def test_delete_fills_the_page(self):
+        app_streamlit.delete_conversation("id24")
+        page_ids = self.get_page_ids()
+        self.assertNotIn("id24", page_ids)
+        self.assertEqual(len(page_ids), PAGE_SIZE)
+        # The next page first conversation
+        self.assertEqual(page_ids[-1], "id04")
+        self.assertTrue(self.session_state.conversations_has_more)
+
+    def test_other_session_writes(self):
+        # Another session saves a conversation, then this one does
+        app_streamlit.init_db().save_item({
+            "type": "text", "question": "Other session",
+            "answer": "Answer", "timestamp": 100}, "other")
+        id = app_streamlit.save_conversation("text", "New", "Answer")
+        self.assertEqual(self.get_page_ids()[:2], [id, "other"])
+        app_streamlit.init_db().save_item({
+            "type": "text", "question": "Other session",
+            "answer": "Answer", "timestamp": 101}, "other2")
+        app_streamlit.delete_conversation(id)
+        self.assertEqual(self.get_page_ids()[:2], ["other2", "other"])
+
+
+class TestVideoPosters(unittest.TestCase):
+    """
+    Poster extraction retries after the failures
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        env = mock.patch.dict(os.environ, {
+            "DB_TYPE": "json",
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+            "VIDEO_CACHE_DIR": self.tmp_dir.name,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        for name, value in [("is_poster_extraction_available",
+                             lambda: True),
+                            ("st", mock.MagicMock())]:
+            patcher = mock.patch.object(app_streamlit, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        app_streamlit.init_db().save_item({
+            "type": "video", "question": "A cat",
+            "answer": "https://example.com/cat.mp4", "timestamp": 1}, "v1")
+        self.poster_path = os.path.join(self.tmp_dir.name, "poster.jpg")
+        open(self.poster_path, "wb").close()
+
+    def add_video_poster(self, error: bool = False):
+        response = get_default_resultset()
+        response['error'] = error
+        response['poster'] = None if error else self.poster_path
+        with mock.patch.object(app_streamlit, "get_video_poster",
+                               return_value=response) as get_video_poster:
+            app_streamlit.add_video_posters(
+                [app_streamlit.get_conversation("v1")])
+        return get_video_poster.call_count
+
+    def test_retry_after_backoff(self):
+        self.assertEqual(self.add_video_poster(error=True), 1)
+        video = app_streamlit.get_conversation("v1")
+        self.assertEqual((video.poster, video["poster_failures"]), ("", 1))
+        # Not tried again on the next reruns
+        self.assertEqual(self.add_video_poster(error=True), 0)
+        later = video["poster_failed_at"] + \
+            app_streamlit.VIDEO_POSTER_RETRY_DELAY
+        with mock.patch.object(app_streamlit.time, "time",
+                               return_value=later):
+            self.assertEqual(self.add_video_poster(error=True), 1)
+        video = app_streamlit.get_conversation("v1")
+        self.assertEqual(video["poster_failures"], 2)
+        # The delay doubles
+        self.assertEqual(
+            app_streamlit.get_video_poster_retry_time(video),
+            video["poster_failed_at"] +
+            app_streamlit.VIDEO_POSTER_RETRY_DELAY * 2)
+        with mock.patch.object(app_streamlit.time, "time",
+                               return_value=video["poster_failed_at"] +
+                               app_streamlit.VIDEO_POSTER_RETRY_DELAY * 2):
+            self.assertEqual(self.add_video_poster(), 1)
+        self.assertEqual(app_streamlit.get_conversation("v1").poster,
+                         self.poster_path)
+        self.assertEqual(self.add_video_poster(), 0)
+
+    def test_empty_poster_of_previous_versions(self):
+        app_streamlit.update_conversation("v1", {"poster": ""})
+        self.assertTrue(app_streamlit.needs_video_poster(
+            app_streamlit.get_conversation("v1")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Batch text and video generation tests
+"""
+import io
+import os
+import json
+import tempfile
+import unittest
+
+from src.codegen_utilities import get_default_resultset
+from src.codegen_ai_abstracts import LlmProviderAbstract
+from src.codegen_ai_utilities import llm_registry
+from src.codegen_batch import BatchProcessor, iter_prompts
+
+
+class EchoLlm(LlmProviderAbstract):
+
+    def query(self, prompt: str, question: str,
+              prompt_enhancement_text: str = None,
+              deadline: float = None) -> dict:
+        response = get_default_resultset()
+        response['response'] = f"answer: {question}"
+        return response
+
+
+class ListDatabase:
+    """
+    Database stand-in that keeps the saved items
+    """
+    def __init__(self):
+        self.items = []
+
+    def save_items(self, items: list) -> None:
+        self.items.extend(items)
+
+
+class TestBatchProcessor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        llm_registry.register("test_echo", EchoLlm)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.tmp_dir.name,
+                                            "checkpoint.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_processor(self, **params) -> BatchProcessor:
+        return BatchProcessor(dict({
+            "llm_provider": "test_echo",
+            "checkpoint_path": self.checkpoint_path,
+            "concurrency": 2,
+        }, **params))
+
+    def test_iter_prompts(self):
+        lines = ['first\n', '\n', '{"question": "second", "type": "video"}',
+                 '{invalid']
+        prompts = list(iter_prompts(lines, skip_lines=1))
+        self.assertEqual(prompts[0], (3, {"question": "second",
+                                          "type": "video"}))
+        self.assertIn("error_message", prompts[1][1])
+
+    def test_results_in_input_order(self):
+        output = io.StringIO()
+        stats = self.get_processor().run(
+            io.StringIO("".join(f"question {index}\n"
+                                for index in range(10))), output)
+        records = [json.loads(line) for line in
+                   output.getvalue().splitlines()]
+        self.assertEqual([record["answer"] for record in records],
+                         [f"answer: question {index}"
+                          for index in range(10)])
+        self.assertEqual(stats, {"processed": 10, "errors": 0})
+
+    def test_checkpoint_with_database(self):
+        db = ListDatabase()
+        processor = self.get_processor(db=db, db_batch_size=100,
+                                       checkpoint_every=3)
+        checkpoints = []
+        write_checkpoint = processor.write_checkpoint
+
+        def record_checkpoint(processed_lines):
+            checkpoints.append((processed_lines, len(db.items)))
+            write_checkpoint(processed_lines)
+
+        processor.write_checkpoint = record_checkpoint
+        processor.run(io.StringIO("".join(f"question {index}\n"
+                                          for index in range(7))),
+                      io.StringIO())
+        # Written every 3 lines, after saving the records, even if the
+        # database batch isn't full
+        self.assertEqual(checkpoints, [(3, 3), (6, 6), (7, 7)])
+
+    def test_resume(self):
+        with open(self.checkpoint_path, "w") as f:
+            json.dump({"processed_lines": 4}, f)
+        output = io.StringIO()
+        self.get_processor().run(
+            io.StringIO("".join(f"question {index}\n"
+                                for index in range(6))), output)
+        records = [json.loads(line) for line in
+                   output.getvalue().splitlines()]
+        self.assertEqual([record["line"] for record in records], [5, 6])
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(json.load(f)["processed_lines"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Hot / cold archival tests
+"""
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+from src import codegen_db_mongodb
+from src.codegen_db import CodegenDatabase
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+NO_ARCHIVE_POLICY = {"DB_ARCHIVE_MAX_AGE_DAYS": "",
+                     "DB_ARCHIVE_KEEP_NEWEST": ""}
+
+
+def get_items(count: int) -> list:
+    """
+    Returns "count" (item_data, id) tuples, one per day back from now
+    """
+    now = time.time()
+    return [({"type": "text", "question": f"question {index}",
+              "answer": f"answer {index}",
+              "timestamp": now - index * 86400}, f"id{index}")
+            for index in range(count)]
+
+
+class ArchiveTests:
+    """
+    Tests run on each backend. get_db() returns a CodegenDatabase of the
+    same store each time it's called.
+    """
+    def setUp(self):
+        env = mock.patch.dict(os.environ, NO_ARCHIVE_POLICY)
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_no_cold_store_without_archive(self):
+        self.assertIsNone(self.get_db().cold_db)
+
+    def test_cold_store_with_policy(self):
+        with mock.patch.dict(os.environ, {"DB_ARCHIVE_KEEP_NEWEST": "10"}):
+            self.assertIsNotNone(self.get_db().cold_db)
+
+    def test_archive(self):
+        db = self.get_db()
+        db.save_items(get_items(20))
+        self.assertEqual(db.archive_old_items(keep_newest=5), 15)
+        self.assertEqual(len(db.get_list()), 5)
+        # A new instance, without archival policy, still finds the
+        # archived items
+        db = self.get_db()
+        self.assertIsNotNone(db.cold_db)
+        self.assertEqual(db.get_item("id12").answer, "answer 12")
+        self.assertEqual([item.id for item in db.search("question 1")][:2],
+                         ["id1", "id10"])
+        db.delete_item("id12")
+        self.assertIsNone(self.get_db().get_item("id12"))
+
+    def test_update_archived_item(self):
+        db = self.get_db()
+        db.save_items(get_items(10))
+        db.archive_old_items(keep_newest=5)
+        self.assertTrue(db.update_item("id8", {"poster": "poster.jpg"}))
+        # Moved back to the hot store, with the update
+        self.assertEqual(db.db.get_item("id8")["poster"], "poster.jpg")
+        self.assertIsNone(db.cold_db.get_item("id8"))
+        item = self.get_db().get_item("id8")
+        self.assertEqual(item.poster, "poster.jpg")
+        self.assertEqual(item.answer, "answer 8")
+        self.assertFalse(db.update_item("missing", {"poster": "x"}))
+
+    def test_update_during_archival(self):
+        db = self.get_db()
+        db.save_items(get_items(10))
+        db.archive_old_items(keep_newest=10)
+        save_items = db.cold_db.save_items
+
+        def save_and_update(items: list):
+            result = save_items(items)
+            if len(items) == 5:
+                # Updated after the batch was read, before its delete
+                self.assertTrue(db.update_item("id8",
+                                               {"poster": "poster.jpg"}))
+            return result
+
+        with mock.patch.object(db.cold_db, "save_items", save_and_update):
+            self.assertEqual(db.archive_old_items(keep_newest=5), 5)
+        self.assertIsNone(db.db.get_item("id8"))
+        # Archived again, with the update
+        self.assertEqual(db.cold_db.get_item("id8")["poster"], "poster.jpg")
+        self.assertEqual(db.get_item("id8").poster, "poster.jpg")
+
+
+class TestJsonArchive(ArchiveTests, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def get_db(self) -> CodegenDatabase:
+        return CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+        }, item_cache_size=0)
+
+    def test_configured_archive_dir(self):
+        db = CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+            "JSON_ARCHIVE_DIR": os.path.join(self.tmp_dir.name, "cold"),
+        })
+        self.assertIsNotNone(db.cold_db)
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestMongoDBArchive(ArchiveTests, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        client = mongomock.MongoClient()
+        patcher = mock.patch.object(codegen_db_mongodb, "get_mongo_client",
+                                    lambda uri: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_db(self, **other_data) -> CodegenDatabase:
+        return CodegenDatabase("mongodb", dict({
+            "MONGODB_URI": "mongodb://localhost",
+            "MONGODB_DB_NAME": "test",
+            "MONGODB_COLLECTION_NAME": "conversations",
+        }, **other_data), item_cache_size=0)
+
+    def test_configured_archive_collection(self):
+        db = self.get_db(MONGODB_ARCHIVE_COLLECTION_NAME="cold")
+        self.assertEqual(db.cold_db.collection.name, "cold")
+
+
+if __name__ == '__main__':
+    unittest.main()
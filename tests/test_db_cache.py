@@ -0,0 +1,128 @@
+"""
+Item cache tests
+"""
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+from src.codegen_db import CodegenDatabase, ItemCache
+from src.codegen_db_records import ConversationRecord
+
+
+def get_record(id: str, answer: str = "Answer") -> ConversationRecord:
+    return ConversationRecord.from_dict({
+        "type": "text", "question": f"Question {id}", "answer": answer,
+        "timestamp": 1}, id)
+
+
+class TestItemCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = ItemCache(size=2)
+        self.assertIsNone(cache.get("id1"))
+        cache.set("id1", get_record("id1"))
+        self.assertEqual(cache.get("id1").answer, "Answer")
+        self.assertEqual(cache.get_stats(), {
+            "size": 1, "max_size": 2, "hits": 1, "misses": 1,
+            "evictions": 0, "hit_rate": 0.5})
+
+    def test_lru_eviction(self):
+        cache = ItemCache(size=2)
+        cache.set("id1", get_record("id1"))
+        cache.set("id2", get_record("id2"))
+        # id1 becomes the most recently used one
+        cache.get("id1")
+        cache.set("id3", get_record("id3"))
+        self.assertIsNone(cache.get("id2"))
+        self.assertIsNotNone(cache.get("id1"))
+        self.assertIsNotNone(cache.get("id3"))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertEqual(cache.get_stats()["size"], 2)
+
+    def test_ttl(self):
+        cache = ItemCache(size=2, ttl=0.05)
+        cache.set("id1", get_record("id1"))
+        self.assertIsNotNone(cache.get("id1"))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("id1"))
+        self.assertEqual(cache.get_stats()["size"], 0)
+
+    def test_disabled(self):
+        cache = ItemCache(size=0)
+        cache.set("id1", get_record("id1"))
+        self.assertIsNone(cache.get("id1"))
+
+    def test_copies(self):
+        cache = ItemCache(size=2)
+        record = get_record("id1")
+        cache.set("id1", record)
+        # Neither the cached record nor the returned ones are shared
+        record['question'] = "Changed"
+        first = cache.get("id1")
+        first['question'] = "Changed too"
+        self.assertEqual(cache.get("id1").question, "Question id1")
+
+
+class TestCodegenDatabaseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        env = mock.patch.dict(os.environ, {"DB_ARCHIVE_MAX_AGE_DAYS": "",
+                                           "DB_ARCHIVE_KEEP_NEWEST": ""})
+        env.start()
+        self.addCleanup(env.stop)
+        self.db = self.get_db()
+        self.db.save_item({"type": "text", "question": "Question",
+                           "answer": "Answer", "timestamp": 1}, "id1")
+
+    def get_db(self, **params) -> CodegenDatabase:
+        return CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+        }, **params)
+
+    def test_read_through(self):
+        db = self.get_db()
+        with mock.patch.object(db.db, "get_item",
+                               wraps=db.db.get_item) as get_item:
+            self.assertEqual(db.get_item("id1").answer, "Answer")
+            self.assertEqual(db.get_item("id1").answer, "Answer")
+            self.assertIsNone(db.get_item("missing"))
+        self.assertEqual(get_item.call_count, 2)
+        stats = db.get_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_write_through(self):
+        with mock.patch.object(self.db.db, "get_item") as get_item:
+            self.assertEqual(self.db.get_item("id1").answer, "Answer")
+        get_item.assert_not_called()
+
+    def test_invalidation(self):
+        self.db.get_item("id1")
+        self.assertTrue(self.db.update_item("id1", {"poster": "p.jpg"}))
+        self.assertEqual(self.db.get_item("id1").poster, "p.jpg")
+        self.db.delete_item("id1")
+        self.assertIsNone(self.db.get_item("id1"))
+
+    def test_other_writers_seen_after_ttl(self):
+        db = self.get_db(item_cache_ttl=0.05)
+        db.get_item("id1")
+        self.get_db().update_item("id1", {"answer": "New answer"})
+        self.assertEqual(db.get_item("id1").answer, "Answer")
+        time.sleep(0.1)
+        self.assertEqual(db.get_item("id1").answer, "New answer")
+
+    def test_independent_copies(self):
+        first = self.db.get_item("id1")
+        first['answer'] = "Changed"
+        first.extra = {"changed": True}
+        second = self.db.get_item("id1")
+        self.assertEqual(second.answer, "Answer")
+        self.assertIsNone(second.extra)
+        self.assertIsNot(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
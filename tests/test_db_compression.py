@@ -0,0 +1,126 @@
+"""
+Conversation fields compression tests
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.codegen_db import CodegenDatabase
+from src.codegen_db_compression import (
+    COMPRESSION_MARKER,
+    compress_item,
+    compress_value,
+    decompress_value,
+    get_compression_config,
+    is_compressed,
+)
+
+LONG_ANSWER = "Tomatoes are fruits. " * 200
+TTV_RESPONSE = {"id": "video", "response": {"data": ["x" * 2000]},
+                "refined_prompt": "a cat"}
+
+
+class TestCompressValue(unittest.TestCase):
+
+    def test_round_trip(self):
+        for value in [LONG_ANSWER, "Unicode: áéíóú ü 漢字 " * 100,
+                      TTV_RESPONSE, ["x" * 2000]]:
+            compressed = compress_value(value)
+            self.assertTrue(is_compressed(compressed))
+            self.assertEqual(compressed[COMPRESSION_MARKER], "zlib")
+            self.assertEqual(decompress_value(compressed), value)
+
+    def test_smaller(self):
+        compressed = compress_value(LONG_ANSWER)
+        self.assertLess(len(compressed["data"]), len(LONG_ANSWER) / 10)
+
+    def test_below_min_size(self):
+        self.assertEqual(compress_value("short"), "short")
+        self.assertEqual(compress_value(LONG_ANSWER,
+                                        min_size=len(LONG_ANSWER) + 1),
+                         LONG_ANSWER)
+
+    def test_uncompressed_values(self):
+        self.assertIsNone(compress_value(None))
+        self.assertEqual(compress_value(LONG_ANSWER, codec="none"),
+                         LONG_ANSWER)
+        for value in [None, "text", {"a": 1}, [1, 2]]:
+            self.assertEqual(decompress_value(value), value)
+
+    def test_already_compressed(self):
+        compressed = compress_value(LONG_ANSWER)
+        self.assertIs(compress_value(compressed), compressed)
+
+    def test_invalid_codec(self):
+        with self.assertRaises(ValueError):
+            decompress_value({COMPRESSION_MARKER: "lz4", "data": ""})
+
+
+class TestCompressItem(unittest.TestCase):
+
+    def test_only_large_fields(self):
+        item = {"type": "text", "question": "x" * 2000,
+                "answer": LONG_ANSWER, "refined_prompt": "short",
+                "ttv_response": None}
+        compressed = compress_item(item)
+        self.assertEqual(compressed["question"], item["question"])
+        self.assertTrue(is_compressed(compressed["answer"]))
+        self.assertEqual(compressed["refined_prompt"], "short")
+        self.assertIsNone(compressed["ttv_response"])
+        # The item isn't modified
+        self.assertEqual(item["answer"], LONG_ANSWER)
+
+    def test_config(self):
+        with mock.patch.dict(os.environ, {"DB_COMPRESSION": "none",
+                                          "DB_COMPRESSION_MIN_SIZE": "10"}):
+            self.assertEqual(get_compression_config(), ("none", 10))
+            self.assertEqual(compress_item({"answer": LONG_ANSWER}),
+                             {"answer": LONG_ANSWER})
+        with mock.patch.dict(os.environ, {"DB_COMPRESSION": "gzip"}):
+            with self.assertRaises(ValueError):
+                get_compression_config()
+
+
+class TestDatabaseCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+        }, item_cache_size=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        self.db.save_item({"type": "video", "question": "a cat",
+                           "answer": LONG_ANSWER,
+                           "ttv_response": TTV_RESPONSE,
+                           "timestamp": 1}, "id1")
+        stored = self.db.db.get_item("id1")
+        self.assertTrue(is_compressed(stored["answer"]))
+        self.assertTrue(is_compressed(stored["ttv_response"]))
+        conversation = self.db.get_item("id1")
+        self.assertEqual(conversation.answer, LONG_ANSWER)
+        self.assertEqual(conversation.ttv_response, TTV_RESPONSE)
+
+    def test_resave_keeps_unread_fields_compressed(self):
+        self.db.save_item({"type": "text", "question": "q",
+                           "answer": LONG_ANSWER, "timestamp": 1}, "id1")
+        conversation = self.db.get_item("id1")
+        conversation["poster"] = "poster.jpg"
+        self.db.save_item(conversation, "id1")
+        conversation = self.db.get_item("id1")
+        self.assertEqual(conversation.answer, LONG_ANSWER)
+        self.assertEqual(conversation.poster, "poster.jpg")
+
+    def test_uncompressed_items(self):
+        # Items saved before the compression are read as they are
+        self.db.db.save_item({"type": "text", "question": "q",
+                              "answer": LONG_ANSWER, "timestamp": 1}, "id1")
+        self.assertEqual(self.db.get_item("id1").answer, LONG_ANSWER)
+
+
+if __name__ == '__main__':
+    unittest.main()
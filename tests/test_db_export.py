@@ -0,0 +1,179 @@
+"""
+Conversations NDJSON export and import tests
+"""
+import os
+import gzip
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from src.codegen_db import CodegenDatabase
+from src.codegen_db_compression import is_compressed
+from src.codegen_db_export import (
+    export_to_file,
+    from_ndjson_line,
+    get_export_key,
+    import_from_file,
+    item_matches,
+    merge_items,
+    to_ndjson_line,
+)
+
+LONG_ANSWER = "Tomatoes are fruits. " * 200
+
+
+class InterruptedDatabase:
+    """
+    CodegenDatabase wrapper whose iter_items() and save_items() fail after
+    "limit" items
+    """
+    def __init__(self, db: CodegenDatabase, limit: int):
+        self.db = db
+        self.limit = limit
+        self.count = 0
+
+    def iter_items(self, *args, **kwargs):
+        for item in self.db.iter_items(*args, **kwargs):
+            if self.count >= self.limit:
+                raise ConnectionError("interrupted")
+            self.count += 1
+            yield item
+
+    def save_items(self, items: list):
+        if self.count + len(items) > self.limit:
+            raise ConnectionError("interrupted")
+        self.count += len(items)
+        return self.db.save_items(items)
+
+    def import_ndjson(self, *args):
+        return CodegenDatabase.import_ndjson(self, *args)
+
+
+class TestExportHelpers(unittest.TestCase):
+
+    def test_line_round_trip(self):
+        item = {"_id": "x", "id": "id1", "question": "q", "timestamp": 1}
+        line = to_ndjson_line(item)
+        self.assertTrue(line.startswith('{"id": "id1"'))
+        self.assertEqual(from_ndjson_line(line),
+                         ({"question": "q", "timestamp": 1}, "id1"))
+        with self.assertRaises(ValueError):
+            from_ndjson_line('{"question": "no id"}')
+
+    def test_item_matches(self):
+        item = {"id": "b", "type": "text", "timestamp": 10}
+        self.assertTrue(item_matches(item, {"type": "text"}, 10, 11))
+        self.assertFalse(item_matches(item, {"type": "video"}))
+        self.assertFalse(item_matches(item, until=10))
+        self.assertTrue(item_matches(item, after=(10, "a")))
+        self.assertFalse(item_matches(item, after=(10, "b")))
+
+    def test_merge_items(self):
+        hot = [{"id": "a", "timestamp": 1}, {"id": "c", "timestamp": 3}]
+        cold = [{"id": "a", "timestamp": 1}, {"id": "b", "timestamp": 2}]
+        self.assertEqual([get_export_key(item)[1]
+                          for item in merge_items(hot, cold)],
+                         ["a", "b", "c"])
+
+
+class TestExportImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        env = mock.patch.dict(os.environ, {"DB_ARCHIVE_MAX_AGE_DAYS": "",
+                                           "DB_ARCHIVE_KEEP_NEWEST": ""})
+        env.start()
+        self.addCleanup(env.stop)
+        self.db = self.get_db("source.json")
+        self.db.save_items([
+            ({"type": "video" if index % 5 == 0 else "text",
+              "question": f"question {index}",
+              "answer": LONG_ANSWER if index == 3 else f"answer {index}",
+              "timestamp": 1000 + index}, f"id{index:03}")
+            for index in range(50)])
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir.name, name)
+
+    def get_db(self, name: str) -> CodegenDatabase:
+        return CodegenDatabase("json", {"JSON_DB_PATH": self.get_path(name)},
+                               item_cache_size=0)
+
+    def read_ids(self, path: str) -> list:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            return [json.loads(line)["id"] for line in f]
+
+    def test_export_filters(self):
+        path = self.get_path("videos.ndjson")
+        self.assertEqual(export_to_file(self.db, path, {"type": "video"},
+                                        since=1010, until=1040), 6)
+        self.assertEqual(self.read_ids(path),
+                         ["id010", "id015", "id020", "id025", "id030",
+                          "id035"])
+
+    def test_export_resume(self):
+        for name in ["export.ndjson", "export.ndjson.gz"]:
+            path = self.get_path(name)
+            checkpoint_path = f"{path}.checkpoint"
+            with self.assertRaises(ConnectionError):
+                export_to_file(InterruptedDatabase(self.db, 25), path,
+                               checkpoint_path=checkpoint_path,
+                               checkpoint_every=10)
+            # The chunks up to the checkpoint are complete
+            self.assertEqual(len(self.read_ids(path)), 20)
+            self.assertEqual(export_to_file(self.db, path,
+                                            checkpoint_path=checkpoint_path,
+                                            checkpoint_every=10), 50)
+            self.assertEqual(self.read_ids(path),
+                             [f"id{index:03}" for index in range(50)])
+            # Running it again appends the new items only
+            self.db.save_item({"type": "text", "question": "new",
+                               "timestamp": 2000}, "new")
+            self.assertEqual(export_to_file(self.db, path,
+                                            checkpoint_path=checkpoint_path,
+                                            checkpoint_every=10), 51)
+            self.assertEqual(self.read_ids(path)[-2:], ["id049", "new"])
+            self.db.delete_item("new")
+
+    def test_import_round_trip(self):
+        path = self.get_path("export.ndjson.gz")
+        export_to_file(self.db, path)
+        target = self.get_db("target.json")
+        self.assertEqual(import_from_file(target, path, batch_size=7), 50)
+        # The compressed fields are imported as they are
+        self.assertTrue(is_compressed(target.db.get_item("id003")["answer"]))
+        for item in self.db.iter_items():
+            self.assertEqual(target.get_item(item["id"]).to_dict(),
+                             self.db.get_item(item["id"]).to_dict())
+
+    def test_import_resume(self):
+        path = self.get_path("export.ndjson")
+        export_to_file(self.db, path)
+        target = self.get_db("target.json")
+        checkpoint_path = self.get_path("import.checkpoint")
+        with self.assertRaises(ConnectionError):
+            import_from_file(InterruptedDatabase(target, 25), path,
+                             batch_size=10, checkpoint_path=checkpoint_path)
+        with open(checkpoint_path) as f:
+            self.assertEqual(json.load(f)["processed_lines"], 20)
+        self.assertEqual(import_from_file(target, path, batch_size=10,
+                                          checkpoint_path=checkpoint_path),
+                         50)
+        self.assertEqual(len(target.get_list()), 50)
+
+    def test_import_invalid_line(self):
+        path = self.get_path("invalid.ndjson")
+        with open(path, "w") as f:
+            f.write('{"id": "a", "question": "q"}\n{invalid\n')
+        target = self.get_db("target.json")
+        with self.assertRaises(ValueError):
+            import_from_file(target, path)
+        # The items before the invalid line are saved
+        self.assertIsNotNone(target.get_item("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
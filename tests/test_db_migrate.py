@@ -0,0 +1,141 @@
+"""
+Database migration tests
+"""
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from src import codegen_db_mongodb
+from src.codegen_db import CodegenDatabase
+from src.codegen_db_migrate import DatabaseMigration, get_item_checksum
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+LONG_ANSWER = "Tomatoes are fruits. " * 200
+
+
+class FailingDatabase:
+    """
+    CodegenDatabase wrapper whose save_items() fails after "limit" items
+    """
+    def __init__(self, db: CodegenDatabase, limit: int):
+        self.db = db
+        self.limit = limit
+        self.count = 0
+
+    def save_items(self, items: list):
+        if self.count + len(items) > self.limit:
+            raise ConnectionError("interrupted")
+        self.count += len(items)
+        return self.db.save_items(items)
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestDatabaseMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        env = mock.patch.dict(os.environ, {"DB_ARCHIVE_MAX_AGE_DAYS": "",
+                                           "DB_ARCHIVE_KEEP_NEWEST": ""})
+        env.start()
+        self.addCleanup(env.stop)
+        client = mongomock.MongoClient()
+        patcher = mock.patch.object(codegen_db_mongodb, "get_mongo_client",
+                                    lambda uri: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.checkpoint_path = os.path.join(self.tmp_dir.name,
+                                            "migrate.checkpoint")
+        self.source_db = CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(self.tmp_dir.name, "db.json"),
+        }, item_cache_size=0)
+        self.target_db = CodegenDatabase("mongodb", {
+            "MONGODB_URI": "mongodb://localhost",
+            "MONGODB_DB_NAME": "test",
+            "MONGODB_COLLECTION_NAME": "conversations",
+        }, item_cache_size=0)
+        self.save_source_items(0, 30)
+
+    def save_source_items(self, start: int, end: int) -> None:
+        self.source_db.save_items([
+            ({"type": "text", "question": f"question {index}",
+              "answer": LONG_ANSWER if index == 3 else f"answer {index}",
+              "timestamp": 1000 + index}, f"id{index:03}")
+            for index in range(start, end)])
+
+    def get_migration(self, target_db=None) -> DatabaseMigration:
+        return DatabaseMigration(self.source_db,
+                                 target_db or self.target_db, {
+                                     "batch_size": 7,
+                                     "workers": 2,
+                                     "checkpoint_path": self.checkpoint_path,
+                                 })
+
+    def test_checksum_ignores_compression(self):
+        stored = self.source_db.db.get_item("id003")
+        self.assertNotEqual(stored["answer"], LONG_ANSWER)
+        self.assertEqual(get_item_checksum(stored),
+                         get_item_checksum(dict(stored,
+                                                answer=LONG_ANSWER)))
+
+    def test_migrate_and_verify(self):
+        passes = self.get_migration().run()
+        self.assertEqual(passes[0]["migrated"], 30)
+        self.assertEqual(passes[0]["batches"], 5)
+        self.assertEqual(passes[-1]["migrated"], 0)
+        result = self.get_migration().verify()
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["target_count"], 30)
+        self.assertEqual(self.target_db.get_item("id003").answer,
+                         LONG_ANSWER)
+
+    def test_catch_up_pass(self):
+        migration = self.get_migration()
+        migration.run_pass()
+        self.save_source_items(30, 35)
+        self.assertTrue(self.source_db.update_item("id001",
+                                                   {"poster": "p.png"}))
+        stats = migration.run_pass()
+        self.assertEqual(stats["migrated"], 5)
+        self.assertEqual(stats["updated"], 1)
+        self.assertEqual(stats["total_migrated"], 35)
+        self.assertEqual(self.target_db.get_item("id001").poster, "p.png")
+        self.assertTrue(migration.verify()["ok"])
+
+    def test_verify_mismatches(self):
+        self.get_migration().run()
+        self.target_db.db.update_item("id005", {"answer": "changed"})
+        self.target_db.delete_item("id006")
+        self.target_db.save_item({"type": "text", "question": "extra",
+                                  "timestamp": 5000}, "extra")
+        result = self.get_migration().verify()
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["different"], ["id005"])
+        self.assertEqual(result["missing"], ["id006"])
+        self.assertEqual(result["extra"], ["extra"])
+        self.assertEqual((result["source_count"], result["target_count"]),
+                         (30, 30))
+
+    def test_resume(self):
+        with self.assertRaises(ConnectionError):
+            self.get_migration(FailingDatabase(self.target_db, 16)).run()
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        # The checkpoint is at the last batch saved with all the previous
+        # ones
+        self.assertEqual(checkpoint["migrated"], 14)
+        self.assertEqual(checkpoint["after"], [1013, "id013"])
+        stats = self.get_migration().run_pass()
+        self.assertEqual(stats["migrated"], 16)
+        self.assertEqual(stats["total_migrated"], 30)
+        self.assertTrue(self.get_migration().verify()["ok"])
+
+
+if __name__ == '__main__':
+    unittest.main()
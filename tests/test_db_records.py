@@ -0,0 +1,106 @@
+"""
+Conversation records tests
+"""
+import json
+import unittest
+
+from src.codegen_utilities import get_date_time
+from src.codegen_db_compression import compress_value, is_compressed
+from src.codegen_db_records import (
+    ConversationRecord,
+    ConversationSummary,
+)
+
+LONG_ANSWER = "Tomatoes are fruits. " * 200
+ITEM = {
+    "type": "text",
+    "question": "Are tomatoes fruits?",
+    "answer": "Yes",
+    "refined_prompt": None,
+    "timestamp": 1700000000.0,
+    "llm_provider": "rhymes",
+}
+
+
+class TestConversationSummary(unittest.TestCase):
+
+    def test_from_dict(self):
+        summary = ConversationSummary.from_dict(dict(ITEM, _id="id1"))
+        self.assertEqual(summary.id, "id1")
+        self.assertEqual(summary.question, ITEM["question"])
+        self.assertFalse(hasattr(summary, "__dict__"))
+        self.assertEqual(summary.keys(),
+                         ["id", "type", "question", "timestamp"])
+        self.assertNotIn("answer", summary)
+        with self.assertRaises(KeyError):
+            summary["answer"]
+
+    def test_date_time(self):
+        summary = ConversationSummary.from_dict(ITEM, "id1")
+        self.assertEqual(summary["date_time"],
+                         get_date_time(ITEM["timestamp"]))
+        self.assertIsNone(ConversationSummary("id2").date_time)
+
+
+class TestConversationRecord(unittest.TestCase):
+
+    def test_dict_access(self):
+        record = ConversationRecord.from_dict(ITEM, "id1")
+        self.assertEqual(record["answer"], "Yes")
+        self.assertEqual(record.get("llm_provider"), "rhymes")
+        self.assertEqual(record.get("poster", "none"), "none")
+        record["poster"] = "poster.jpg"
+        self.assertEqual(record.poster, "poster.jpg")
+
+    def test_extra_attributes(self):
+        record = ConversationRecord.from_dict(
+            dict(ITEM, semantic_cache_id="id0", date_time="ignored"), "id1")
+        self.assertEqual(record["semantic_cache_id"], "id0")
+        self.assertIn("semantic_cache_id", record.keys())
+        self.assertNotIn("date_time", record.extra)
+        record["plugin_field"] = 1
+        self.assertEqual(record.to_raw_dict()["plugin_field"], 1)
+
+    def test_to_dict(self):
+        record = ConversationRecord.from_dict(ITEM, "id1")
+        data = record.to_dict()
+        self.assertEqual(data["id"], "id1")
+        self.assertEqual(data["date_time"], get_date_time(ITEM["timestamp"]))
+        self.assertIsNone(data["refined_prompt"])
+        # JSON serializable, for the API responses
+        self.assertEqual(json.loads(json.dumps(data))["answer"], "Yes")
+
+    def test_raw_dict_round_trip(self):
+        record = ConversationRecord.from_dict(ITEM, "id1")
+        raw = record.to_raw_dict()
+        self.assertNotIn("id", raw)
+        # The unset attributes aren't saved
+        self.assertNotIn("refined_prompt", raw)
+        self.assertEqual(ConversationRecord.from_dict(raw, "id1").to_dict(),
+                         record.to_dict())
+
+    def test_lazy_decompression(self):
+        compressed = compress_value(LONG_ANSWER)
+        record = ConversationRecord.from_dict(dict(ITEM, answer=compressed),
+                                              "id1")
+        # Not read yet: saved as it is
+        self.assertIs(record.to_raw_dict()["answer"], compressed)
+        copy = record.copy()
+        self.assertEqual(record.answer, LONG_ANSWER)
+        self.assertEqual(record.to_raw_dict()["answer"], LONG_ANSWER)
+        # The copy is independent
+        self.assertTrue(is_compressed(copy.to_raw_dict()["answer"]))
+        self.assertEqual(copy["answer"], LONG_ANSWER)
+
+    def test_copy(self):
+        record = ConversationRecord.from_dict(dict(ITEM, extra_field=[1]),
+                                              "id1")
+        copy = record.copy()
+        copy["question"] = "Changed"
+        copy["extra_field2"] = True
+        self.assertEqual(record.question, ITEM["question"])
+        self.assertNotIn("extra_field2", record.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
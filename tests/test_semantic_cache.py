@@ -0,0 +1,143 @@
+"""
+Semantic answer cache tests
+"""
+import os
+import sys
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+from src import codegen_semantic_cache
+from src.codegen_db import CodegenDatabase
+from src.codegen_semantic_cache import (
+    DEFAULT_SEMANTIC_CACHE_THRESHOLD,
+    HashingVectorizer,
+    SemanticCache,
+    get_semantic_cache,
+    get_semantic_cache_mode,
+)
+
+# Questions that must not share their answer
+DIFFERENT_QUESTIONS = [
+    ("What is 2 + 2", "What is 2 * 2"),
+    ("What is 10 / 5", "What is 10 - 5"),
+    ("Is python faster than java", "Is java faster than python"),
+    ("Find the max of a list", "Find the min of a list"),
+    ("How do I read a CSV file in Python?",
+     "How do I write a CSV file in Python?"),
+    ("Translate 'good morning' to French",
+     "Translate 'good morning' to German"),
+]
+SIMILAR_QUESTIONS = [
+    ("What's the capital of France?", "what is the capital of france"),
+    ("How to reverse a string in python",
+     "How do I reverse a string in Python?"),
+]
+
+
+def get_similarity(first: str, second: str) -> float:
+    vectorizer = HashingVectorizer()
+    return float(vectorizer.transform(first) @ vectorizer.transform(second))
+
+
+class TestHashingVectorizer(unittest.TestCase):
+
+    def test_different_questions(self):
+        for first, second in DIFFERENT_QUESTIONS:
+            with self.subTest(first=first, second=second):
+                self.assertLess(get_similarity(first, second), 0.8)
+
+    def test_similar_questions(self):
+        for first, second in SIMILAR_QUESTIONS:
+            with self.subTest(first=first, second=second):
+                self.assertGreaterEqual(get_similarity(first, second),
+                                        DEFAULT_SEMANTIC_CACHE_THRESHOLD)
+
+    def test_features(self):
+        features = HashingVectorizer().get_features("What is 2 + 2?")
+        self.assertEqual(features["w:2"], 2)
+        self.assertEqual(features["w:+"], 1)
+        self.assertEqual(features["b:2 +"], 1)
+        self.assertNotIn("w:what", features)
+        self.assertIsNone(HashingVectorizer().transform("what is it?"))
+
+
+class TestSemanticCache(unittest.TestCase):
+
+    def test_add_find_remove(self):
+        cache = SemanticCache()
+        for index, (first, _) in enumerate(DIFFERENT_QUESTIONS):
+            cache.add(f"id{index}", first)
+        for index, (first, second) in enumerate(DIFFERENT_QUESTIONS):
+            self.assertEqual(cache.find(first)[0], f"id{index}")
+            self.assertIsNone(cache.find(second))
+        cache.remove("id0")
+        self.assertIsNone(cache.find("What is 2 + 2"))
+        # The removed rows are reused
+        cache.add("new", "What is 2 * 2")
+        self.assertEqual(cache.find("what is 2*2?")[0], "new")
+        self.assertEqual(cache.get_stats()["size"],
+                         len(DIFFERENT_QUESTIONS))
+
+    def test_growth(self):
+        cache = SemanticCache(dimensions=64)
+        for index in range(codegen_semantic_cache.INITIAL_CAPACITY + 1):
+            cache.add(f"id{index}", f"question number {index}")
+        self.assertEqual(cache.find("Question number 256?")[0], "id256")
+
+    def test_find_conversation(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db = CodegenDatabase("json", {
+            "JSON_DB_PATH": os.path.join(tmp_dir.name, "db.json"),
+        }, item_cache_size=0)
+        db.save_item({"type": "text", "question": "What is 2 + 2",
+                      "answer": "4", "timestamp": 1}, "sum")
+        db.save_item({"type": "text", "question": "What is 2 * 3",
+                      "timestamp": 2}, "unanswered")
+        cache = SemanticCache()
+        conversation, similarity = cache.find_conversation(
+            db, "what is 2+2?")
+        self.assertEqual((conversation.id, conversation.answer),
+                         ("sum", "4"))
+        self.assertGreaterEqual(similarity, 0.99)
+        self.assertIsNone(cache.find_conversation(db, "What is 2 * 3"))
+        # Deleted by another process: removed from the index
+        db.delete_item("sum")
+        self.assertIsNone(cache.find_conversation(db, "What is 2 + 2"))
+        self.assertEqual(cache.get_stats()["size"], 0)
+
+
+class TestSemanticCacheConfig(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(codegen_semantic_cache,
+                                    "_semantic_cache", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mode(self):
+        with mock.patch.dict(os.environ, {"SEMANTIC_CACHE_MODE": "off"}):
+            self.assertIsNone(get_semantic_cache())
+        with mock.patch.dict(os.environ, {"SEMANTIC_CACHE_MODE": "maybe"}):
+            with self.assertRaises(ValueError):
+                get_semantic_cache_mode()
+
+    def test_numpy_not_imported_when_off(self):
+        code = ("import sys, app_streamlit, src.codegen_api; "
+                "print('numpy' in sys.modules)")
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.dirname(__file__)),
+            env=dict(os.environ, SEMANTIC_CACHE_MODE="off"))
+        self.assertEqual(output.stdout.strip().splitlines()[-1], "False")
+
+    def test_threshold(self):
+        with mock.patch.dict(os.environ, {"SEMANTIC_CACHE_MODE": "offer",
+                                          "SEMANTIC_CACHE_THRESHOLD": "0.9"}):
+            self.assertEqual(get_semantic_cache().threshold, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
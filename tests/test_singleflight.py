@@ -0,0 +1,151 @@
+"""
+Single-flight request coalescing tests
+"""
+import time
+import asyncio
+import threading
+import unittest
+
+from src.codegen_singleflight import SingleFlight, get_request_key
+from src.codegen_deadlines import (
+    get_deadline,
+    is_deadline_exceeded,
+    get_deadline_exceeded_resultset,
+)
+
+
+def run_concurrently(count: int, target) -> list:
+    """
+    Run target(index) in "count" threads and return their results
+    """
+    results = [None] * count
+
+    def run(index):
+        results[index] = target(index)
+
+    threads = [threading.Thread(target=run, args=(index,))
+               for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_request_key(self):
+        self.assertEqual(get_request_key("query", "a", None),
+                         get_request_key("query", "a", None))
+        self.assertNotEqual(get_request_key("query", "a"),
+                            get_request_key("query", "b"))
+
+    def test_concurrent_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def func():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return {"response": "answer"}
+
+        def call(index):
+            if index:
+                started.wait()
+            return single_flight.do("key", func)
+
+        results = run_concurrently(5, call)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"response": "answer"}] * 5)
+        self.assertEqual(single_flight.stats["coalesced"], 4)
+        # Each follower gets its own copy
+        results[1]["response"] = "changed"
+        self.assertEqual(results[2]["response"], "answer")
+
+    def test_leader_exception_is_shared(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+
+        def func():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("upstream error")
+
+        def call(index):
+            if index:
+                started.wait()
+            try:
+                single_flight.do("key", func)
+            except ValueError as e:
+                return str(e)
+
+        self.assertEqual(run_concurrently(3, call), ["upstream error"] * 3)
+        self.assertEqual(single_flight.calls, {})
+
+    def test_follower_timeout(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+
+        def func():
+            started.set()
+            time.sleep(0.3)
+            return "answer"
+
+        leader = threading.Thread(target=single_flight.do,
+                                  args=("key", func))
+        leader.start()
+        started.wait()
+        with self.assertRaises(TimeoutError):
+            single_flight.do("key", func, timeout=0.05)
+        leader.join()
+
+    def test_follower_retries_after_leader_deadline(self):
+        single_flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def get_func(deadline):
+            def func():
+                calls.append(deadline)
+                started.set()
+                time.sleep(0.1)
+                if deadline is not None and time.monotonic() >= deadline:
+                    return get_deadline_exceeded_resultset("LLM query")
+                return {"error": False, "response": "answer"}
+            return func
+
+        def call(index):
+            # The leader has a short deadline, the follower none
+            deadline = get_deadline(0.05) if index == 0 else None
+            if index:
+                started.wait()
+            return single_flight.do("key", get_func(deadline),
+                                    retry=is_deadline_exceeded)
+
+        results = run_concurrently(2, call)
+        self.assertTrue(results[0]["deadline_exceeded"])
+        self.assertEqual(results[1]["response"], "answer")
+        self.assertEqual(len(calls), 2)
+
+    def test_async_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"response": "answer"}
+
+        async def main():
+            return await asyncio.gather(*[
+                single_flight.do_async("key", func) for _ in range(4)])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"response": "answer"}] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()